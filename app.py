@@ -1,21 +1,32 @@
 # app.py - Secured Tennis Match Organizer with Mobile Messages Only
-from dotenv import load_dotenv
-load_dotenv()
+import json, os, random, re, secrets, time, threading
+from importlib.util import find_spec
 
-import os, random, csv, io, re, time
-from datetime import timedelta
-from collections import defaultdict
-from flask import Flask, render_template, request, session, redirect, abort
+# Only pay for python-dotenv when there is a .env file to read
+if os.path.exists(os.path.join(os.path.dirname(os.path.abspath(__file__)), ".env")) or os.path.exists(".env"):
+    from dotenv import load_dotenv
+    load_dotenv()
 
-# Only import CSRF if available
-try:
-    from flask_wtf.csrf import CSRFProtect
-    CSRF_AVAILABLE = True
-except ImportError:
+from contextlib import contextmanager
+from functools import wraps
+from datetime import datetime, timedelta
+from flask import Flask, render_template, request, session, redirect, abort, g
+from flask.sessions import SecureCookieSessionInterface
+
+# Only use CSRF if available - Flask-WTF itself is imported when it is needed
+CSRF_AVAILABLE = find_spec("flask_wtf") is not None
+if not CSRF_AVAILABLE:
     print("Warning: Flask-WTF not installed. CSRF protection disabled.")
-    CSRF_AVAILABLE = False
 
-from utils import organize_matches
+from utils import (SCHEDULE_MAX_PLAYER_ROUNDS, SESSION_MAX_PLAYERS, SchedulerBusy, SchedulingTimeout,
+                   build_rounds, count_matches, iter_organize_rounds)
+from roster import RosterIndex, process_csv_upload_secure
+from storage import event_store, roster_library
+from outbox import outbox
+from scheduler import compute_job, schedule_fingerprint, scheduler, streamed_schedules
+from exports import default_start, iter_rounds, iter_schedule_csv, iter_schedule_ics
+from assets import ONE_YEAR, assets
+from compression import compress_response, etag_matches, page_etag, source_version
 from weather_service import WeatherService
 # Simplified imports - keeping only CAPTCHA and basic CSRF
 import hashlib
@@ -35,21 +46,169 @@ def generate_csrf_token():
             f"{time.time()}{request.remote_addr}".encode()
         ).hexdigest()
     return session['csrf_token']
-from captcha import simple_captcha, math_captcha, require_captcha_after_failures
+from captcha import simple_captcha, math_captcha, require_captcha_after_failures, validate_any_captcha
+from captcha_engine import captcha_engine
 # Email service removed - using simple email link instead
 
 app = Flask(__name__)
 app.secret_key = os.getenv("FLASK_SECRET_KEY", "dev_key_UNSAFE_FOR_PRODUCTION")
 
-# Initialize weather service
-weather_service = WeatherService()
+# Weather service - built by the first weather request
+_weather_service = None
+_weather_service_lock = threading.Lock()
+
+def get_weather_service():
+    global _weather_service
+    if _weather_service is None:
+        with _weather_service_lock:
+            if _weather_service is None:
+                _weather_service = WeatherService()
+    return _weather_service
+
+# Caps for normal sessions and for large-event mode (league nights, camps)
+SESSION_LIMITS = {"max_players": SESSION_MAX_PLAYERS, "max_courts": 20, "time_budget": float(os.getenv("SCHEDULE_TIME_BUDGET", "5"))}
+LARGE_EVENT_LIMITS = {
+    "max_players": int(os.getenv("LARGE_EVENT_MAX_PLAYERS", "400")),
+    "max_courts": int(os.getenv("LARGE_EVENT_MAX_COURTS", "50")),
+    "time_budget": float(os.getenv("LARGE_EVENT_TIME_BUDGET", "15"))
+}
+
+# Large events are scheduled a few at a time so small sessions keep their workers
+large_event_slots = threading.BoundedSemaphore(int(os.getenv("LARGE_EVENT_CONCURRENCY", "2")))
+
+# Roster and schedule keys - kept in the cookie normally, server-side for large events
+STATE_DEFAULTS = {"players": list, "matchups": list, "player_match_counts": dict, "rounds": dict}
+
+def is_large_event():
+    return bool(session.get("event_id"))
+
+def event_limits():
+    return LARGE_EVENT_LIMITS if is_large_event() else SESSION_LIMITS
+
+def load_state():
+    """Roster and schedule for this visitor - from the event store in large-event mode"""
+    event_id = session.get("event_id")
+    if event_id:
+        state = event_store.load(event_id)
+        if state is not None:
+            g.event_state = state
+            return {key: state.get(key) or default() for key, default in STATE_DEFAULTS.items()}
+        # Expired or purged - carry on as a normal session
+        session.pop("event_id", None)
+    return {key: session.get(key) or default() for key, default in STATE_DEFAULTS.items()}
+
+def save_state(**changes):
+    """Store roster/schedule changes; a value of None clears that key
+
+    Returns an error message, and stores nothing, when a large event's
+    state would grow past the event store's size limit.
+    """
+    event_id = session.get("event_id")
+    if event_id:
+        # Changed on a copy so a refused save leaves this request's state as it was
+        state = dict(g.get("event_state") or event_store.load(event_id) or {})
+        for key, value in changes.items():
+            if value is None:
+                state.pop(key, None)
+            else:
+                state[key] = value
+        try:
+            event_store.save(event_id, state)
+        except ValueError as e:
+            return f"{e}. Remove some players or rounds and try again."
+        g.event_state = state
+    
+    if "rounds" in changes:
+        # Every new schedule gets a fresh version for export ETags
+        if changes["rounds"] is None:
+            session.pop("schedule_version", None)
+        else:
+            session["schedule_version"] = secrets.token_urlsafe(8)
+    if event_id:
+        return None
+    for key, value in changes.items():
+        if value is None:
+            session.pop(key, None)
+        else:
+            session[key] = value
+
+def start_large_event():
+    """Move this session's roster and schedule into the event store"""
+    if is_large_event():
+        return
+    state = {key: session.pop(key) for key in STATE_DEFAULTS if key in session}
+    session["event_id"] = event_store.create(state)
+
+def library_owner(create=False):
+    """Anonymous owner id for this browser - keys saved rosters and speculative schedules"""
+    if create and "owner_id" not in session:
+        session["owner_id"] = secrets.token_urlsafe(16)
+    return session.get("owner_id")
+
+def sync_active_roster(method, *args, **kwargs):
+    """Apply a single-player edit to the loaded saved roster, if any"""
+    active = session.get("active_roster")
+    owner = library_owner()
+    if active and owner:
+        getattr(roster_library, method)(owner, active, *args, **kwargs)
+
+@contextmanager
+def scheduling_guard():
+    """Time budget for one scheduling request; large events also take a concurrency slot"""
+    slot = large_event_slots if is_large_event() else None
+    if slot and not slot.acquire(blocking=False):
+        raise SchedulerBusy("All large-event scheduling slots are in use")
+    try:
+        yield event_limits()["time_budget"]
+    finally:
+        if slot:
+            slot.release()
+
+def organize_error(players, match_type, num_matches):
+    """Why a roster cannot be organized with these settings, or None"""
+    limits = event_limits()
+    min_players = 2 if match_type == "singles" else 4
+    if len(players) < min_players:
+        return f"Need at least {min_players} players for {match_type} sessions"
+    if len(players) > limits["max_players"]:
+        return f"Too many players (max {limits['max_players']})"
+    if len(players) * num_matches > SCHEDULE_MAX_PLAYER_ROUNDS:
+        return "Schedule too large. Please use fewer rounds."
+    return None
+
+def speculate_schedule(players, courts, match_type, num_matches):
+    """Queue a background schedule for this roster so organizing can be instant
+
+    Skipped for clients that sent no session cookie - each of their requests
+    would get a fresh owner id and so escape the per-user cap.
+    """
+    if not request.cookies.get(app.config["SESSION_COOKIE_NAME"]):
+        return
+    if organize_error(players, match_type, num_matches):
+        return
+    scheduler.speculate(
+        library_owner(create=True),
+        schedule_fingerprint(players, courts, match_type, num_matches),
+        {"players": players, "courts": courts, "match_type": match_type, "num_matches": num_matches},
+        event_limits()["time_budget"]
+    )
+
+@app.context_processor
+def inject_event_mode():
+    return {"large_event": is_large_event(), "limits": event_limits()}
+
+@app.context_processor
+def inject_asset_url():
+    return {"asset_url": assets.url}
 
 # Session counter functionality
 SESSION_COUNTER_FILE = "session_counter.txt"
+# Pages show the count, so it is kept in memory for a while rather than read on every render
+SESSION_COUNT_TTL = float(os.getenv("SESSION_COUNT_TTL", "30"))
+_session_count = {"value": 0, "read": None}
 
 
-def get_session_count():
-    """Get the current session count"""
+def _read_session_count():
     try:
         if os.path.exists(SESSION_COUNTER_FILE):
             with open(SESSION_COUNTER_FILE, 'r') as f:
@@ -58,19 +217,29 @@ def get_session_count():
     except:
         return 0
 
+def get_session_count():
+    """Get the current session count - may lag other workers by SESSION_COUNT_TTL"""
+    now = time.monotonic()
+    if _session_count["read"] is None or now - _session_count["read"] > SESSION_COUNT_TTL:
+        _session_count.update(value=_read_session_count(), read=now)
+    return _session_count["value"]
+
 def increment_session_count():
     """Increment and save the session count"""
     try:
-        count = get_session_count() + 1
+        count = _read_session_count() + 1
         with open(SESSION_COUNTER_FILE, 'w') as f:
             f.write(str(count))
+        _session_count.update(value=count, read=time.monotonic())
         return count
     except:
         return get_session_count()
 
 
 # Initialize CSRF Protection only if available and in production
+csrf = None
 if CSRF_AVAILABLE and os.getenv("FLASK_ENV") == "production":
+    from flask_wtf.csrf import CSRFProtect
     csrf = CSRFProtect(app)
     # CSRF Configuration
     app.config['WTF_CSRF_TIME_LIMIT'] = 3600  # 1 hour
@@ -86,9 +255,43 @@ app.config['SESSION_COOKIE_SECURE'] = IS_PRODUCTION  # Only secure in production
 app.config['PERMANENT_SESSION_LIFETIME'] = timedelta(hours=24)
 app.config['MAX_CONTENT_LENGTH'] = 2 * 1024 * 1024  # 2MB
 
+class AppSessionInterface(SecureCookieSessionInterface):
+    """Cookie sessions, except on asset responses that shared caches should keep"""
+
+    def save_session(self, app, session, response):
+        if request.path.startswith("/assets/"):
+            return
+        super().save_session(app, session, response)
+
+app.session_interface = AppSessionInterface()
+
+def csrf_exempt(view):
+    """The JSON API is cookieless, so it has no CSRF token to check"""
+    return csrf.exempt(view) if csrf else view
+
 @app.before_request
 def before_request():
-    session.permanent = True
+    # The JSON API holds no session state, so it never gets a cookie; nor do assets
+    if request.path.startswith(("/api/", "/assets/")):
+        return
+    # Only flag the session once so requests that never write to it leave it unmodified
+    if not session.permanent:
+        session.permanent = True
+
+# Set once the first request has started the outbox sender
+_outbox_resumed = False
+
+@app.before_request
+def resume_outbox():
+    """Resume sending anything a previous run left in the outbox, once per process
+
+    Done on the first request rather than at import so importing the app
+    starts no threads and opens no database.
+    """
+    global _outbox_resumed
+    if not _outbox_resumed:
+        _outbox_resumed = True
+        outbox.start()
 
 @app.after_request
 def add_basic_headers(response):
@@ -96,370 +299,127 @@ def add_basic_headers(response):
     response.headers['X-Content-Type-Options'] = 'nosniff'
     return response
 
-def sanitize_csv_field(field_value):
-    """Sanitize CSV field to prevent formula injection"""
-    if not field_value:
-        return field_value
-    
-    field_value = str(field_value).strip()
-    
-    # Remove any quotes that might hide formulas
-    field_value = field_value.strip('"\'')
-    
-    # If field starts with dangerous characters, prefix with single quote to neutralize
-    if field_value and field_value[0] in ['=', '+', '-', '@', '\t', '\r']:
-        field_value = "'" + field_value
-    
-    return field_value
+@app.after_request
+def compress_body(response):
+    return compress_response(response, request.accept_encodings)
 
-def validate_player_name(name):
-    """Enhanced player name validation with security checks"""
-    if not name or len(name.strip()) == 0:
-        return False, "Player name cannot be empty"
-    
-    name = name.strip()
-    
-    if len(name) > 50:
-        return False, "Player name too long (max 50 characters)"
-    
-    # Check for dangerous CSV injection characters
-    dangerous_chars = ['=', '+', '-', '@', '\t', '\r', '\n']
-    if any(char in name for char in dangerous_chars):
-        return False, "Player name contains potentially dangerous characters"
-    
-    # Allow only alphanumeric, spaces, hyphens, apostrophes, periods
-    if not re.match(r"^[a-zA-Z0-9\s\-'.]+$", name):
-        return False, "Player name contains invalid characters"
-    
-    # Additional checks
-    if name.startswith(' ') or name.endswith(' '):
-        return False, "Player name cannot start or end with spaces"
-    
-    if '  ' in name:  # Multiple consecutive spaces
-        return False, "Player name cannot contain multiple consecutive spaces"
-    
-    return True, ""
+# Rendered pages are versioned by their templates, static files and this module
+PAGE_SOURCES = [os.path.join(app.root_path, app.template_folder), app.static_folder, os.path.abspath(__file__)]
+_template_version = None
 
-def validate_csv_file(file):
-    """Enhanced CSV file validation with security checks"""
-    if not file:
-        return False, "No file provided"
-    
-    if not file.filename:
-        return False, "No file selected"
-    
-    # Check file extension
-    if not file.filename.lower().endswith('.csv'):
-        return False, "File must have .csv extension"
-    
-    # Check file size (already limited by MAX_CONTENT_LENGTH, but double-check)
-    file.seek(0, 2)  # Seek to end
-    size = file.tell()
-    file.seek(0)  # Reset
-    
-    if size > 1024 * 1024:  # 1MB limit for CSV
-        return False, "CSV file too large (max 1MB)"
-    
-    if size == 0:
-        return False, "CSV file is empty"
-    
-    # Basic content validation
-    try:
-        # Read first 1KB to check if it's valid UTF-8 text
-        file_sample = file.read(min(1024, size))
-        file.seek(0)  # Reset
-        
-        try:
-            file_sample.decode('utf-8')
-        except UnicodeDecodeError:
-            return False, "File does not appear to be a valid text file"
-            
-    except Exception:
-        return False, "Error reading file"
-    
-    return True, ""
+def template_version():
+    global _template_version
+    # Rechecked on every request in debug mode, where templates reload
+    if _template_version is None or app.debug:
+        _template_version = source_version(PAGE_SOURCES)
+    return _template_version
 
-def sanitize_csv_content(content):
-    """Sanitize entire CSV content to prevent formula injection"""
-    lines = content.split('\n')
-    sanitized_lines = []
-    
-    for line in lines:
-        if not line.strip():  # Skip empty lines
-            sanitized_lines.append(line)
-            continue
-            
-        # Split by comma and sanitize each field
-        fields = []
-        # Simple CSV parsing - split by comma but handle quoted fields
-        current_field = ""
-        in_quotes = False
-        
-        for char in line:
-            if char == '"' and (not current_field or current_field[-1] != '\\'):
-                in_quotes = not in_quotes
-                current_field += char
-            elif char == ',' and not in_quotes:
-                fields.append(sanitize_csv_field(current_field))
-                current_field = ""
-            else:
-                current_field += char
-        
-        # Add the last field
-        fields.append(sanitize_csv_field(current_field))
-        sanitized_lines.append(','.join(fields))
-    
-    return '\n'.join(sanitized_lines)
+def page_validator():
+    """Strong ETag for a GET page - its templates plus the session it renders from
 
-def process_csv_upload_secure(file, existing_players):
-    """Secure CSV upload processing with comprehensive validation"""
-    try:
-        # Validate file
-        is_valid, error_msg = validate_csv_file(file)
-        if not is_valid:
-            return [], error_msg
-        
-        # Read and sanitize content
-        content = file.read().decode("utf-8")
-        content = sanitize_csv_content(content)
-        
-        # Parse CSV
-        reader = csv.DictReader(io.StringIO(content))
-        
-        # Check for required columns
-        required_columns = ['name', 'grade']
-        if not reader.fieldnames or not all(col in reader.fieldnames for col in required_columns):
-            return [], "CSV must have 'name' and 'grade' columns. Optional: 'max_rounds'"
-        
-        new_players = []
-        added_count = 0
-        skipped_count = 0
-        errors = []
-        
-        for row_num, row in enumerate(reader, start=2):
-            if row_num > 102:  # Limit to 100 players (plus header)
-                break
-            
-            name = sanitize_csv_field(row.get("name", "")).strip()
-            grade_str = sanitize_csv_field(row.get("grade", "")).strip()
-            max_rounds_str = sanitize_csv_field(row.get("max_rounds", "")).strip()
-            
-            # Validate name with enhanced security
-            is_valid_name, name_error = validate_player_name(name)
-            if not is_valid_name:
-                skipped_count += 1
-                errors.append(f"Row {row_num}: {name_error}")
-                continue
-            
-            # Validate grade
-            try:
-                grade = int(grade_str.strip("'\""))  # Remove any quotes added by sanitization
-                if not (1 <= grade <= 4):
-                    skipped_count += 1
-                    errors.append(f"Row {row_num}: Grade must be between 1 and 4")
-                    continue
-            except (ValueError, TypeError):
-                skipped_count += 1
-                errors.append(f"Row {row_num}: Invalid grade format")
-                continue
-            
-            # Validate max_rounds (optional)
-            max_rounds = None
-            if max_rounds_str:
-                try:
-                    max_rounds = int(max_rounds_str.strip("'\""))
-                    if not (1 <= max_rounds <= 10):
-                        skipped_count += 1
-                        errors.append(f"Row {row_num}: Max rounds must be between 1 and 10")
-                        continue
-                except (ValueError, TypeError):
-                    skipped_count += 1
-                    errors.append(f"Row {row_num}: Invalid max_rounds format")
-                    continue
-            
-            # Check for duplicates with existing players
-            if any(p["name"].lower() == name.lower() for p in existing_players + new_players):
-                skipped_count += 1
-                errors.append(f"Row {row_num}: Player '{name}' already exists")
-                continue
-            
-            # Create player dictionary
-            player = {"name": name, "grade": grade}
-            if max_rounds is not None:
-                player["max_rounds"] = max_rounds
-            
-            new_players.append(player)
-            added_count += 1
-        
-        # Prepare result message
-        if added_count > 0:
-            success_msg = f"Added {added_count} players"
-            if skipped_count > 0:
-                success_msg += f", skipped {skipped_count} invalid entries"
-            return new_players, success_msg
-        elif skipped_count > 0:
-            return [], f"No valid players found. Skipped {skipped_count} entries with errors."
+    Index posts stamp page_version, which covers state the session only
+    points to (the roster library). A large event's row can also change
+    from another tab or expire, so its last save time is included too.
+    """
+    parts = [template_version(), request.full_path, request.headers.get("X-Fragment", ""),
+             json.dumps(dict(session), sort_keys=True, default=str), get_session_count()]
+    if session.get("event_id"):
+        parts.append(event_store.version(session["event_id"]))
+    if csrf:
+        # Flask-WTF tokens carry a timestamp, so a revalidated page must not hand out an old one
+        parts.append(int(time.time() // (app.config['WTF_CSRF_TIME_LIMIT'] / 4)))
+    return page_etag(*parts)
+
+def conditional_page(view):
+    """Answer GETs with 304 before rendering when the client's copy is current"""
+    @wraps(view)
+    def wrapper(*args, **kwargs):
+        from flask import make_response
+        if request.method != "GET":
+            return view(*args, **kwargs)
+
+        matched = etag_matches(request.if_none_match, page_validator())
+        if matched:
+            response = make_response("", 304)
+            response.set_etag(matched)
         else:
-            return [], "No players found in CSV file"
-        
-    except Exception as e:
-        return [], "Error processing CSV file. Please check format and try again."
+            response = make_response(view(*args, **kwargs))
+            if response.status_code != 200:
+                return response
+            # Computed after rendering, which may have added a CSRF token to the session
+            response.set_etag(page_validator())
+        # Browsers keep the page but check back every time; shared caches never store it
+        response.headers['Cache-Control'] = 'private, no-cache'
+        return response
+    return wrapper
 
-def reshuffle_single_round(players, courts, match_type, round_to_reshuffle, existing_matchups, existing_rounds):
-    """
-    Reshuffle a specific round while preserving other rounds. More flexible algorithm that allows multiple reshuffles.
+# Partial templates served in place of index.html to fetch/htmx clients
+FRAGMENTS = {
+    "players": "partials/_players.html",
+    "schedule": "partials/_schedule.html",
+    "round": "partials/_round.html",
+    "error": "partials/_error.html"
+}
+
+def requested_fragment():
+    """Fragment asked for by the X-Fragment header or ?fragment=, else None"""
+    fragment = request.headers.get("X-Fragment") or request.args.get("fragment")
+    return fragment if fragment in FRAGMENTS else None
+
+def render_fragment(fragment, context):
+    """Render one partial; the X-Fragment header tells the client what it got
+
+    Errors always come back as the error partial with a 422 so the client
+    can show them without touching the rest of the page.
     """
-    # Find players available for this round
-    available_players = []
-    for player in players:
-        max_rounds = player.get('max_rounds', len(existing_rounds))
-        if round_to_reshuffle <= max_rounds:
-            available_players.append(player)
-    
-    if len(available_players) < (4 if match_type == "doubles" else 2):
-        return None  # Not enough players for reshuffling
-    
-    # Shuffle available players for maximum randomness
-    random.shuffle(available_players)
-    
-    # Track existing combinations from OTHER rounds (not the one we're reshuffling)
-    existing_combinations = set()
-    if match_type == "doubles":
-        for court_matches in existing_matchups:
-            for match, round_num in court_matches:
-                if round_num != round_to_reshuffle and len(match) == 4:
-                    # Store all possible team combinations
-                    names = [p['name'] for p in match]
-                    # Try different team splits
-                    team1 = frozenset([names[0], names[1]])
-                    team2 = frozenset([names[2], names[3]])
-                    existing_combinations.add(frozenset([team1, team2]))
-                    
-                    team1 = frozenset([names[0], names[2]])
-                    team2 = frozenset([names[1], names[3]])
-                    existing_combinations.add(frozenset([team1, team2]))
-                    
-                    team1 = frozenset([names[0], names[3]])
-                    team2 = frozenset([names[1], names[2]])
-                    existing_combinations.add(frozenset([team1, team2]))
-    else:  # singles
-        for court_matches in existing_matchups:
-            for match, round_num in court_matches:
-                if round_num != round_to_reshuffle and len(match) == 2:
-                    pair = frozenset([match[0]['name'], match[1]['name']])
-                    existing_combinations.add(pair)
-    
-    # Generate new matches for this round
-    new_round_matches = []
-    used_players = set()
-    
-    def grade_distance(g1, g2):
-        return abs(g1 - g2)
-    
-    def create_singles_match(candidates):
-        """Create a singles match, preferring new combinations"""
-        if len(candidates) < 2:
-            return None
-            
-        best_pair = None
-        best_score = float('inf')
-        
-        for i in range(len(candidates)):
-            for j in range(i+1, len(candidates)):
-                p1, p2 = candidates[i], candidates[j]
-                pair_key = frozenset([p1['name'], p2['name']])
-                
-                # Score this pairing
-                grade_diff = grade_distance(p1['grade'], p2['grade'])
-                
-                # Bonus for new combinations (but don't block old ones completely)
-                novelty_bonus = 0 if pair_key in existing_combinations else -2
-                
-                score = grade_diff + novelty_bonus
-                
-                if score < best_score:
-                    best_score = score
-                    best_pair = [p1, p2]
-        
-        return best_pair
-    
-    def create_doubles_match(candidates):
-        """Create a doubles match, preferring new combinations"""
-        if len(candidates) < 4:
-            return None
-            
-        best_group = None
-        best_score = float('inf')
-        
-        # Try different combinations of 4 players
-        for i in range(len(candidates)):
-            for j in range(i+1, len(candidates)):
-                for k in range(len(candidates)):
-                    for l in range(k+1, len(candidates)):
-                        if len(set([i, j, k, l])) != 4:
-                            continue
-                            
-                        group = [candidates[i], candidates[j], candidates[k], candidates[l]]
-                        
-                        # Try this as team1 vs team2
-                        team1 = [group[0], group[1]]
-                        team2 = [group[2], group[3]]
-                        
-                        team1_avg = (team1[0]['grade'] + team1[1]['grade']) / 2
-                        team2_avg = (team2[0]['grade'] + team2[1]['grade']) / 2
-                        grade_diff = abs(team1_avg - team2_avg)
-                        
-                        # Check if this combination exists
-                        team1_names = frozenset([team1[0]['name'], team1[1]['name']])
-                        team2_names = frozenset([team2[0]['name'], team2[1]['name']])
-                        match_key = frozenset([team1_names, team2_names])
-                        
-                        # Bonus for new combinations
-                        novelty_bonus = 0 if match_key in existing_combinations else -3
-                        
-                        score = grade_diff + novelty_bonus
-                        
-                        if score < best_score:
-                            best_score = score
-                            best_group = group
-        
-        return best_group
-    
-    # Create matches for each court
-    for court_index in range(courts):
-        remaining_players = [p for p in available_players if p['name'] not in used_players]
-        
-        if match_type == "singles":
-            match = create_singles_match(remaining_players)
-            if match:
-                new_round_matches.append((court_index, match))
-                used_players.update([p['name'] for p in match])
-        else:  # doubles
-            match = create_doubles_match(remaining_players)
-            if match:
-                new_round_matches.append((court_index, match))
-                used_players.update([p['name'] for p in match])
-    
-    return new_round_matches
+    from flask import make_response
+    status = 200
+    if context["error"]:
+        fragment, status = "error", 422
+    elif fragment == "round":
+        round_num = request.values.get("reshuffle_round") or request.values.get("round", "")
+        rounds = context["rounds"] or {}
+        # Round keys are strings once the schedule has been through the session
+        matches = rounds.get(round_num)
+        if matches is None and round_num.isdigit():
+            matches = rounds.get(int(round_num))
+        if matches is None:
+            abort(404)
+        context = dict(context, round_num=int(round_num), matches=matches)
+
+    response = make_response(render_template(FRAGMENTS[fragment], **context), status)
+    response.headers["X-Fragment"] = fragment
+    response.headers["X-Player-Count"] = str(len(context["players"]))
+    response.headers["Vary"] = "X-Fragment"
+    return response
 
 @app.route("/", methods=["GET", "POST"])
 @app.route("/index", methods=["GET", "POST"])
+@conditional_page
 # Simplified security - only basic rate limiting
 def index():
     """Main session organizer page."""
     
     # Get current session data
-    players = session.get("players", [])
+    state = load_state()
+    players = state["players"]
     courts = session.get("courts", 1)
     num_matches = session.get("num_matches", 1)
     match_type = session.get("match_type", "singles")
     
-    matchups = session.get("matchups", [])
-    player_match_counts = session.get("player_match_counts", {})
-    rounds = session.get("rounds", {})
+    matchups = state["matchups"]
+    player_match_counts = state["player_match_counts"]
+    rounds = state["rounds"]
     error = None
+    fragment = requested_fragment()
 
     if request.method == "POST":
+        # Any post may change the page, including state kept outside the session
+        session["page_version"] = secrets.token_urlsafe(8)
+        
+        # Casefolded name index kept in step with players for this request
+        roster = RosterIndex(players)
+        
         # Basic CSRF check only if available and in production
         if CSRF_AVAILABLE and os.getenv("FLASK_ENV") == "production":
             try:
@@ -494,15 +454,11 @@ def index():
                     error=error, csrf_available=CSRF_AVAILABLE,
                     csrf_token=generate_csrf_token(),
                     require_captcha=True,
-                    captcha_image=simple_captcha.generate_captcha(),
-                    math_question=math_captcha.generate_math_captcha()
+                    session_count=get_session_count()
                 )
             
             # Validate CAPTCHA
-            image_valid, _ = simple_captcha.validate_captcha(captcha_response)
-            math_valid, _ = math_captcha.validate_math_captcha(captcha_response)
-            
-            if not (image_valid or math_valid):
+            if not validate_any_captcha(captcha_response, request.form.get('captcha_token')):
                 session['form_failures'] = session.get('form_failures', 0) + 1
                 error = "Invalid CAPTCHA. Please try again."
                 return render_template(
@@ -513,16 +469,20 @@ def index():
                     error=error, csrf_available=CSRF_AVAILABLE,
                     csrf_token=generate_csrf_token(),
                     require_captcha=True,
-                    captcha_image=simple_captcha.generate_captcha(),
-                    math_question=math_captcha.generate_math_captcha()
+                    session_count=get_session_count()
                 )
             
             # Reset failure count on successful CAPTCHA
             session['form_failures'] = 0
+        # Large-event mode lifts the caps below until the session is reset
+        if "large_event" in request.form:
+            start_large_event()
+        limits = event_limits()
+        
         # Update session configuration with validation
         try:
             courts_input = int(request.form.get("courts", courts))
-            courts = max(1, min(20, courts_input))  # Limit to reasonable range
+            courts = max(1, min(limits["max_courts"], courts_input))  # Limit to reasonable range
             
             num_matches_input = int(request.form.get("num_matches", num_matches))
             num_matches = max(1, min(10, num_matches_input))  # Limit to reasonable range
@@ -544,33 +504,99 @@ def index():
             name_to_remove = request.form.get("remove_player", "").strip()
             if name_to_remove:
                 # Basic validation only
-                players = [p for p in players if p["name"] != name_to_remove]
-                session["players"] = players
+                roster.remove(name_to_remove)
+                players = roster.to_list()
                 # Clear matches when player is removed
-                session.pop("matchups", None)
-                session.pop("player_match_counts", None)
-                session.pop("rounds", None)
+                error = save_state(players=players, matchups=None, player_match_counts=None, rounds=None)
+                if error:
+                    players = load_state()["players"]
+                else:
+                    sync_active_roster("remove_player", name_to_remove)
 
         # CSV upload with enhanced security
         elif "upload_csv" in request.form:
             file = request.files.get("csv_file")
-            new_players, message = process_csv_upload_secure(file, players)
+            new_players, message = process_csv_upload_secure(file, roster, max_rows=limits["max_players"])
             
             if new_players:
-                players.extend(new_players)
-                session["players"] = players
                 # Clear matches when new players added
-                session.pop("matchups", None)
-                session.pop("player_match_counts", None)
-                session.pop("rounds", None)
+                error = save_state(players=players + new_players, matchups=None, player_match_counts=None, rounds=None)
+                if not error:
+                    players.extend(new_players)
+                    sync_active_roster("add_players", new_players)
             else:
                 error = message
 
         # Reset everything
         elif "reset" in request.form:
+            if is_large_event():
+                event_store.delete(session["event_id"])
+            # Saved rosters survive a reset
+            owner_id = library_owner()
             session.clear()
+            if owner_id:
+                session["owner_id"] = owner_id
             return redirect("/")
 
+        # Save the current players to the roster library
+        elif "save_roster" in request.form:
+            roster_name = request.form.get("roster_name", "").strip()
+            if not roster_name or len(roster_name) > 50 or not re.match(r"^[a-zA-Z0-9\s\-'.]+$", roster_name):
+                error = "Roster name must be 1-50 letters, numbers, spaces, hyphens or apostrophes"
+            elif not players:
+                error = "Add players before saving a roster"
+            else:
+                try:
+                    roster_library.save(library_owner(create=True), roster_name, players)
+                    session["active_roster"] = roster_name
+                except ValueError as e:
+                    error = str(e)
+
+        # Load a saved roster - already validated, so no re-parsing
+        elif "load_roster" in request.form:
+            roster_name = request.form.get("saved_roster", "").strip()
+            saved_players = roster_library.load(library_owner(), roster_name) if library_owner() else None
+            if saved_players is None:
+                error = "Saved roster not found"
+            elif len(saved_players) > limits["max_players"]:
+                error = f"This roster has {len(saved_players)} players. Switch on large event mode to load it."
+            else:
+                error = save_state(players=saved_players, matchups=None, player_match_counts=None, rounds=None)
+            if not error:
+                players = saved_players
+                session["active_roster"] = roster_name
+                if not fragment:
+                    speculate_schedule(players, courts, match_type, num_matches)
+                    return redirect("/")
+
+        elif "delete_roster" in request.form:
+            roster_name = request.form.get("saved_roster", "").strip()
+            if library_owner() and roster_library.delete(library_owner(), roster_name):
+                if RosterIndex.key(session.get("active_roster", "")) == RosterIndex.key(roster_name):
+                    session.pop("active_roster", None)
+            else:
+                error = "Saved roster not found"
+
+        # Change one player's grade
+        elif "set_grade" in request.form:
+            player = roster.get(request.form.get("set_grade", ""))
+            try:
+                grade = int(request.form.get("player_grade", ""))
+            except (TypeError, ValueError):
+                grade = None
+            if not player:
+                error = "Player not found"
+            elif grade not in (1, 2, 3, 4):
+                error = "Grade must be between 1 and 4"
+            else:
+                old_grade, player["grade"] = player["grade"], grade
+                # Clear matches - they were balanced on the old grade
+                error = save_state(players=players, matchups=None, player_match_counts=None, rounds=None)
+                if error:
+                    player["grade"] = old_grade
+                else:
+                    sync_active_roster("update_player", player["name"], grade=grade)
+
         # Add individual player with enhanced validation
         elif "add_player" in request.form:
             name = request.form.get("name", "").strip()
@@ -593,11 +619,11 @@ def index():
                     if not (1 <= grade <= 4):
                         error = "Grade must be between 1 and 4"
                     # Check for duplicates
-                    elif any(p["name"].lower() == name.lower() for p in players):
+                    elif name in roster:
                         error = f"Player '{name}' already exists"
                     # Check player limit
-                    elif len(players) >= 100:
-                        error = "Maximum 100 players allowed"
+                    elif len(players) >= limits["max_players"]:
+                        error = f"Maximum {limits['max_players']} players allowed"
                     else:
                         # Validate max_rounds (optional)
                         max_rounds = None
@@ -619,12 +645,18 @@ def index():
                             if max_rounds is not None:
                                 player["max_rounds"] = max_rounds
                             
+                            error = save_state(players=players + [player])
+                        
+                        if not error:
                             players.append(player)
-                            session["players"] = players
+                            roster.add(player)
+                            sync_active_roster("add_players", [player])
                             # Reset failure count on success
                             session['form_failures'] = 0
-                            # Clear form by redirecting
-                            return redirect("/")
+                            # Clear form by redirecting; fragment clients clear it themselves
+                            if not fragment:
+                                speculate_schedule(players, courts, match_type, num_matches)
+                                return redirect("/")
                 except (TypeError, ValueError):
                     error = "Invalid grade selected"
 
@@ -636,100 +668,85 @@ def index():
                 if not (1 <= round_to_reshuffle <= 10):
                     error = "Invalid round number"
                 elif matchups and rounds:
-                    # Generate new matches for this round
-                    new_round_matches = reshuffle_single_round(
-                        players, courts, match_type, round_to_reshuffle, matchups, rounds
-                    )
+                    # Generate new matches for this round in a scheduler worker
+                    with scheduling_guard() as time_budget:
+                        result = scheduler.run({
+                            "players": players, "courts": courts, "match_type": match_type,
+                            "round": round_to_reshuffle, "matchups": matchups
+                        }, time_budget, worker=compute_job)
                     
-                    if new_round_matches is not None:
-                        # Remove old matches for this round from all courts
-                        for court_index in range(len(matchups)):
-                            matchups[court_index] = [
-                                (match, round_num) for match, round_num in matchups[court_index]
-                                if round_num != round_to_reshuffle
-                            ]
-                        
-                        # Add new matches
-                        for court_index, match in new_round_matches:
-                            if court_index < len(matchups):
-                                matchups[court_index].append((match, round_to_reshuffle))
-                        
-                        # Rebuild rounds structure
-                        round_structure = defaultdict(list)
-                        for court_index, court_matches in enumerate(matchups):
-                            for match, round_num in court_matches:
-                                round_structure[round_num].append((court_index + 1, match))
-                        rounds = dict(sorted(round_structure.items()))
-                        
-                        # Recalculate match counts
-                        player_match_counts = {p['name']: 0 for p in players}
-                        for court_matches in matchups:
-                            for match, round_num in court_matches:
-                                for player in match:
-                                    player_match_counts[player['name']] += 1
-                        
-                        # Update session
-                        session.update({
-                            "matchups": matchups,
-                            "player_match_counts": player_match_counts,
-                            "rounds": rounds
-                        })
-                        
+                    if "error" in result:
+                        error = result["error"]
                     else:
-                        error = f"Unable to reshuffle round {round_to_reshuffle} - not enough available players"
+                        # Update session
+                        error = save_state(matchups=result["matchups"], player_match_counts=result["match_counts"],
+                                           rounds=result["rounds"])
+                        if not error:
+                            matchups, player_match_counts, rounds = result["matchups"], result["match_counts"], result["rounds"]
                         
             except (ValueError, TypeError):
                 error = "Invalid round number format"
+            except SchedulerBusy:
+                abort(429)
 
         # Organize sessions with validation  
         elif "organize_sessions" in request.form or "organize_matches" in request.form or "reshuffle" in request.form:
             # Organizing sessions
-            min_players = 2 if match_type == "singles" else 4
-            
-            if len(players) < min_players:
-                error = f"Need at least {min_players} players for {match_type} sessions"
-            elif len(players) > 100:
-                error = "Too many players (max 100)"
-            else:
+            error = organize_error(players, match_type, num_matches)
+            if not error:
                 if "reshuffle" in request.form:
                     random.shuffle(players)
 
                 try:
-                    matchups, player_match_counts, opponent_averages, opponent_diff = organize_matches(
-                        players, courts, match_type, num_matches
-                    )
-
-                    # Build round structure
-                    round_structure = defaultdict(list)
-                    for court_index, court_matches in enumerate(matchups):
-                        for match, round_num in court_matches:
-                            round_structure[round_num].append((court_index + 1, match))
-                    rounds = dict(sorted(round_structure.items()))
-
-                    session.update({
-                        "matchups": matchups,
-                        "player_match_counts": player_match_counts,
-                        "rounds": rounds
-                    })
+                    # A schedule already streamed to the page is saved as it is
+                    result = None
+                    if request.form.get("streamed_schedule") and "reshuffle" not in request.form:
+                        result = streamed_schedules.take(
+                            request.form["streamed_schedule"],
+                            schedule_fingerprint(players, courts, match_type, num_matches)
+                        )
                     
-                    # Increment session counter for new organizations (not reshuffles)
-                    if "organize_sessions" in request.form or "organize_matches" in request.form:
-                        increment_session_count()
+                    # Or one computed speculatively since the last roster change
+                    if result is None and "reshuffle" not in request.form and library_owner():
+                        result = scheduler.take_speculative(
+                            library_owner(), schedule_fingerprint(players, courts, match_type, num_matches)
+                        )
+                    
+                    # Otherwise it runs in a scheduler worker, off this web thread
+                    if result is None:
+                        with scheduling_guard() as time_budget:
+                            result = scheduler.run({
+                                "players": players, "courts": courts, "match_type": match_type,
+                                "num_matches": num_matches
+                            }, time_budget, worker=compute_job)
+
+                    if "error" in result:
+                        error = result["error"]
+                    else:
+                        error = save_state(matchups=result["matchups"], player_match_counts=result["match_counts"],
+                                           rounds=result["rounds"])
+                    if not error:
+                        matchups, player_match_counts, rounds = result["matchups"], result["match_counts"], result["rounds"]
+                        
+                        # Increment session counter for new organizations (not reshuffles)
+                        if "organize_sessions" in request.form or "organize_matches" in request.form:
+                            increment_session_count()
                         
+                except SchedulerBusy:
+                    abort(429)
                 except Exception as e:
                     error = "Error organizing sessions. Please try again."
 
-    # Determine if CAPTCHA is required
+    # Roster or settings changed - start on the schedule before it is asked for
+    if request.method == "POST" and not error and not any(
+            action in request.form for action in ("organize_sessions", "organize_matches", "reshuffle", "reshuffle_round")):
+        speculate_schedule(players, courts, match_type, num_matches)
+
+    # Determine if CAPTCHA is required - the page fetches a challenge on demand
     failures = session.get('form_failures', 0)
     require_captcha = failures >= 3
     
-    captcha_data = {}
-    if require_captcha:
-        captcha_data['captcha_image'] = simple_captcha.generate_captcha()
-        captcha_data['math_question'] = math_captcha.generate_math_captcha()
-    
-    return render_template(
-        "index.html",
+    context = dict(
         players=players,
         matchups=matchups,
         courts=courts,
@@ -737,14 +754,146 @@ def index():
         match_type=match_type,
         player_match_counts=player_match_counts,
         rounds=rounds,
-        error=error,
+        error=error
+    )
+    if fragment:
+        return render_fragment(fragment, context)
+    
+    return render_template(
+        "index.html",
+        **context,
         csrf_available=CSRF_AVAILABLE,
         csrf_token=generate_csrf_token(),
         require_captcha=require_captcha,
         session_count=get_session_count(),
-        **captcha_data
+        saved_rosters=roster_library.list_rosters(library_owner()) if library_owner() else [],
+        active_roster=session.get("active_roster")
     )
 
+def sse_event(name, data):
+    """One server-sent event with a JSON payload"""
+    return f"event: {name}\ndata: {json.dumps(data)}\n\n"
+
+@app.route("/schedule/stream")
+def stream_schedule():
+    """Server-sent events of each round as soon as it is scheduled
+
+    Sends a "round" event per round with its rendered markup, then "done"
+    with a token. Posting organize_matches with streamed_schedule=<token>
+    saves that exact schedule without computing it again. Problems are
+    sent as a "failed" event.
+    """
+    from flask import Response, stream_with_context
+    state = load_state()
+    players = state["players"]
+    limits = event_limits()
+    try:
+        courts = max(1, min(limits["max_courts"], int(request.args.get("courts", session.get("courts", 1)))))
+        num_matches = max(1, min(10, int(request.args.get("num_matches", session.get("num_matches", 1)))))
+    except ValueError:
+        abort(400)
+    match_type = request.args.get("match_type", session.get("match_type", "singles"))
+    if match_type not in ("singles", "doubles"):
+        abort(400)
+    
+    def events():
+        error = organize_error(players, match_type, num_matches)
+        if error:
+            yield sse_event("failed", {"error": error})
+            return
+        
+        matchups = [[] for _ in range(courts)]
+        try:
+            with scheduling_guard() as time_budget:
+                deadline = time.monotonic() + time_budget
+                for round_num, round_matches in iter_organize_rounds(players, courts, match_type, num_matches, deadline):
+                    for court_num, match in round_matches:
+                        matchups[court_num - 1].append((match, round_num))
+                    if round_matches:
+                        html = render_template("partials/_round.html", round_num=round_num,
+                                               matches=round_matches, players=players)
+                        yield sse_event("round", {"round": round_num, "html": html})
+        except SchedulingTimeout:
+            yield sse_event("failed", {"error": "Scheduling took too long. Please try fewer courts or rounds."})
+            return
+        except SchedulerBusy:
+            yield sse_event("failed", {"error": "The scheduler is busy. Please try again in a moment."})
+            return
+        
+        token = streamed_schedules.put(
+            schedule_fingerprint(players, courts, match_type, num_matches),
+            {"matchups": matchups, "match_counts": count_matches(players, matchups), "rounds": build_rounds(matchups)}
+        )
+        yield sse_event("done", {"token": token})
+    
+    response = Response(stream_with_context(events()), mimetype="text/event-stream")
+    response.headers["Cache-Control"] = "no-cache"
+    response.headers["X-Accel-Buffering"] = "no"  # let nginx pass events straight through
+    return response
+
+# Schedule export formats
+EXPORT_FORMATS = {
+    "csv": ("text/csv", "attachment; filename=schedule.csv"),
+    "ics": ("text/calendar", "attachment; filename=schedule.ics"),
+    "html": ("text/html", None)
+}
+
+@app.route("/export/schedule.<fmt>")
+def export_schedule(fmt):
+    """Stream the current schedule as CSV, iCalendar or printable HTML"""
+    from flask import Response, stream_template
+    if fmt not in EXPORT_FORMATS:
+        abort(404)
+    
+    state = load_state()
+    version = session.get("schedule_version")
+    if not version or not state["rounds"]:
+        abort(404)
+    
+    etag = f"{version}-{fmt}"
+    if fmt == "ics":
+        try:
+            start = datetime.fromisoformat(request.args["start"]) if request.args.get("start") else default_start()
+            round_minutes = int(request.args.get("round_minutes", 30))
+        except ValueError:
+            abort(400)
+        if not 5 <= round_minutes <= 240:
+            abort(400)
+        start = start.replace(tzinfo=None)
+        etag += f"-{start:%Y%m%dT%H%M}-{round_minutes}"
+    elif fmt == "html":
+        # The print view also shows the roster (sitting out, player count) and
+        # settings, which change without a new schedule version
+        inputs = json.dumps([state["players"], session.get("courts", 1),
+                             session.get("match_type", "singles"), template_version()], sort_keys=True)
+        etag += "-" + hashlib.sha256(inputs.encode()).hexdigest()[:12]
+    
+    # A schedule version never changes, so a matching ETag needs no body
+    if request.if_none_match.contains(etag):
+        response = Response(status=304)
+    else:
+        # Generators are built from the already loaded state and yield row by row
+        if fmt == "csv":
+            body = iter_schedule_csv(state["rounds"])
+        elif fmt == "ics":
+            body = iter_schedule_ics(state["rounds"], start, round_minutes, version)
+        else:
+            body = stream_template(
+                "print_schedule.html",
+                rounds=iter_rounds(state["rounds"], state["players"]),
+                player_count=len(state["players"]),
+                courts=session.get("courts", 1),
+                match_type=session.get("match_type", "singles")
+            )
+        mimetype, disposition = EXPORT_FORMATS[fmt]
+        response = Response(body, mimetype=mimetype)
+        if disposition:
+            response.headers["Content-Disposition"] = disposition
+    
+    response.set_etag(etag)
+    response.headers["Cache-Control"] = "private, no-cache"
+    return response
+
 @app.route("/weather", methods=["GET"])
 def weather():
     """Weather forecast page for coaches"""
@@ -762,17 +911,20 @@ def weather():
             error = "Please enter a valid postcode"
         else:
             try:
-                # Get weather forecast
-                forecast_data = weather_service.get_weather_forecast(postcode, country_code)
-                
-                if forecast_data and "error" in forecast_data:
-                    error = forecast_data["error"]
-                    forecast_data = None
-                else:
-                    # Also get current weather
-                    current_weather = weather_service.get_current_weather(postcode, country_code)
-                    if current_weather and "error" in current_weather:
-                        current_weather = None
+                # Both lookups share one upstream time budget
+                weather_service = get_weather_service()
+                with weather_service.request_budget():
+                    # Get weather forecast
+                    forecast_data = weather_service.get_weather_forecast(postcode, country_code)
+                    
+                    if forecast_data and "error" in forecast_data:
+                        error = forecast_data["error"]
+                        forecast_data = None
+                    else:
+                        # Also get current weather
+                        current_weather = weather_service.get_current_weather(postcode, country_code)
+                        if current_weather and "error" in current_weather:
+                            current_weather = None
                     
                     # Store in session for easy access
                     session["last_weather_postcode"] = postcode
@@ -781,14 +933,146 @@ def weather():
             except Exception as e:
                 error = f"Error processing request: {str(e)}"
     
-    return render_template("weather.html", 
+    html = render_template("weather.html", 
                          forecast_data=forecast_data, 
                          current_weather=current_weather,
                          error=error,
                          last_postcode=session.get("last_weather_postcode", ""),
                          last_country=session.get("last_weather_country", "GB"))
 
+    # The forecast is only known once fetched, so unlike conditional_page the
+    # tag covers the rendered page - a revalidation still saves the transfer
+    from flask import make_response
+    etag = page_etag(html)
+    matched = etag_matches(request.if_none_match, etag)
+    response = make_response("", 304) if matched else make_response(html)
+    response.set_etag(matched or etag)
+    response.headers['Cache-Control'] = 'private, no-cache'
+    return response
+
+@app.route("/weather/batch", methods=["GET", "POST"])
+@csrf_exempt
+def weather_batch():
+    """Daily tennis conditions for several venues in one round-trip
+
+    Read-only and session-free, so JSON POSTs need no CSRF token.
+    """
+    from flask import jsonify
+
+    # Accept a JSON body or a comma-separated query string
+    if request.method == "POST" and request.is_json:
+        payload = request.get_json(silent=True) or {}
+        postcodes = payload.get("postcodes", [])
+        country_code = str(payload.get("country_code", "GB")).strip().upper()
+    else:
+        postcodes = request.values.get("postcodes", "").split(",")
+        country_code = request.values.get("country_code", "GB").strip().upper()
+
+    if not isinstance(postcodes, list):
+        return jsonify({'error': 'postcodes must be a list'}), 400
+
+    postcodes = [str(pc).strip().upper() for pc in postcodes if str(pc).strip()]
+    if not postcodes:
+        return jsonify({'error': 'Please enter at least one postcode'}), 400
+    if len(postcodes) > 10:
+        return jsonify({'error': 'Too many venues (max 10)'}), 400
+    if any(len(pc) < 2 or len(pc) > 20 for pc in postcodes):
+        return jsonify({'error': 'Please enter valid postcodes'}), 400
+
+    try:
+        weather_service = get_weather_service()
+        with weather_service.request_budget():
+            result = weather_service.get_batch_forecasts(postcodes, country_code)
+    except Exception as e:
+        return jsonify({'error': f"Error processing request: {str(e)}"}), 500
+
+    if "error" in result:
+        return jsonify(result), 400
+    return jsonify(result)
+
+def api_response(result, status=200):
+    """JSON for a scheduler result; errors are the client's input, so 422"""
+    from flask import jsonify
+    return jsonify(result), 422 if "error" in result else status
+
+def scheduler_busy(error):
+    """429 with a retry hint when the scheduler queue is full"""
+    from flask import jsonify
+    response = jsonify({"error": "The scheduler is busy. Please try again in a moment."})
+    response.status_code = 429
+    response.headers["Retry-After"] = "5"
+    return response
+
+@app.route("/api/v1/schedule", methods=["POST"])
+@csrf_exempt
+def api_schedule():
+    """Organize sessions for a roster given in the body - no session state"""
+    payload = request.get_json(silent=True)
+    if payload is None:
+        return api_response({"error": "Expected a JSON body"})
+    try:
+        return api_response(scheduler.schedule(payload))
+    except SchedulerBusy as e:
+        return scheduler_busy(e)
+
+@app.route("/api/v1/schedule/batch", methods=["POST"])
+@csrf_exempt
+def api_schedule_batch():
+    """Several independent scheduling jobs in one call, run in parallel"""
+    payload = request.get_json(silent=True)
+    if not isinstance(payload, dict):
+        return api_response({"error": "Expected a JSON body with a 'jobs' list"})
+    try:
+        return api_response(scheduler.schedule_batch(payload.get("jobs")))
+    except SchedulerBusy as e:
+        return scheduler_busy(e)
+
+@app.route("/api/v1/reshuffle", methods=["POST"])
+@csrf_exempt
+def api_reshuffle():
+    """Reshuffle one round of a schedule previously returned by the API"""
+    payload = request.get_json(silent=True)
+    if payload is None:
+        return api_response({"error": "Expected a JSON body"})
+    try:
+        return api_response(scheduler.schedule(payload, reshuffle=True))
+    except SchedulerBusy as e:
+        return scheduler_busy(e)
+
+@app.route("/api/v1/jobs", methods=["POST"])
+@csrf_exempt
+def api_submit_job():
+    """Queue a schedule or reshuffle job and return its id straight away"""
+    payload = request.get_json(silent=True)
+    if payload is None:
+        return api_response({"error": "Expected a JSON body"})
+    try:
+        return api_response(scheduler.schedule_async(payload), 202)
+    except SchedulerBusy as e:
+        return scheduler_busy(e)
+
+@app.route("/api/v1/jobs/<job_id>", methods=["GET", "DELETE"])
+@csrf_exempt
+def api_job(job_id):
+    """Job status; ?wait=N long-polls up to 30s for the result. DELETE cancels a queued job"""
+    from flask import jsonify
+    if request.method == "DELETE":
+        cancelled = scheduler.cancel(job_id)
+        if cancelled is None:
+            abort(404)
+        return jsonify({"job_id": job_id, "cancelled": cancelled})
+    
+    try:
+        wait = min(max(float(request.args.get("wait", 0)), 0), 30)
+    except ValueError:
+        abort(400)
+    status = scheduler.status(job_id, wait)
+    if status is None:
+        abort(404)
+    return jsonify(status)
+
 @app.route("/contact", methods=["GET", "POST"])
+@conditional_page
 def contact():
     """Contact page with form"""
     error = None
@@ -813,23 +1097,16 @@ def contact():
                 return render_template("contact.html", 
                                      error=error, 
                                      success=success,
-                                     require_captcha=True,
-                                     captcha_image=simple_captcha.generate_captcha(),
-                                     math_question=math_captcha.generate_math_captcha())
+                                     require_captcha=True)
             
             # Validate CAPTCHA
-            image_valid, _ = simple_captcha.validate_captcha(captcha_response)
-            math_valid, _ = math_captcha.validate_math_captcha(captcha_response)
-            
-            if not (image_valid or math_valid):
+            if not validate_any_captcha(captcha_response, request.form.get('captcha_token')):
                 session['contact_form_failures'] = session.get('contact_form_failures', 0) + 1
                 error = "Invalid CAPTCHA. Please try again."
                 return render_template("contact.html", 
                                      error=error, 
                                      success=success,
-                                     require_captcha=True,
-                                     captcha_image=simple_captcha.generate_captcha(),
-                                     math_question=math_captcha.generate_math_captcha())
+                                     require_captcha=True)
             
             # Reset failure count on successful CAPTCHA
             session['contact_form_failures'] = 0
@@ -864,24 +1141,23 @@ def contact():
         if error:
             session['contact_form_failures'] = session.get('contact_form_failures', 0) + 1
         else:
-            # Send email
+            # Queue the email - the outbox sender delivers it in the background
             try:
-                import smtplib
                 from email.mime.text import MIMEText
                 from email.mime.multipart import MIMEMultipart
+                from email.utils import formatdate, make_msgid
                 
                 # Email configuration from environment
-                smtp_server = os.getenv('SMTP_SERVER', 'smtp.gmail.com')
-                smtp_port = int(os.getenv('SMTP_PORT', '587'))
-                smtp_username = os.getenv('SMTP_USERNAME', '')
-                smtp_password = os.getenv('SMTP_PASSWORD', '')
+                from_email = os.getenv('SMTP_USERNAME', '') or os.getenv('FROM_EMAIL', 'noreply@coaches-hub.app')
                 to_email = os.getenv('TO_EMAIL', 'jamierjhill@gmail.com')
                 
                 # Create message
                 msg = MIMEMultipart()
-                msg['From'] = smtp_username
+                msg['From'] = from_email
                 msg['To'] = to_email
                 msg['Subject'] = f"Contact Form: {subject.replace('_', ' ').title()}"
+                msg['Date'] = formatdate(localtime=True)
+                msg['Message-ID'] = make_msgid()
                 
                 # Email body
                 body = f"""
@@ -900,55 +1176,73 @@ Sent from Tennis Session Organizer
                 
                 msg.attach(MIMEText(body, 'plain'))
                 
-                # Send email
-                server = smtplib.SMTP(smtp_server, smtp_port)
-                server.starttls()
-                server.login(smtp_username, smtp_password)
-                text = msg.as_string()
-                server.sendmail(smtp_username, to_email, text)
-                server.quit()
+                message_id = outbox.enqueue(from_email, to_email, msg.as_string())
                 
                 success = "Thank you for your message! We'll get back to you soon."
-                print(f"Email sent successfully: {name} ({email}) - {subject}")
+                print(f"Email queued ({message_id}): {name} ({email}) - {subject}")
                 
             except Exception as e:
-                print(f"Error sending email: {str(e)}")
+                print(f"Error queueing email: {str(e)}")
                 error = "Sorry, there was an error sending your message. Please try again later."
     
-    # Determine if CAPTCHA is required
+    # Determine if CAPTCHA is required - the page fetches a challenge on demand
     failures = session.get('contact_form_failures', 0)
     require_captcha = failures >= 2
     
-    captcha_data = {}
-    if require_captcha:
-        captcha_data['require_captcha'] = True
-        captcha_data['captcha_image'] = simple_captcha.generate_captcha()
-        captcha_data['math_question'] = math_captcha.generate_math_captcha()
-    else:
-        captcha_data['require_captcha'] = False
-    
-    return render_template("contact.html", error=error, success=success, **captcha_data)
+    return render_template("contact.html", error=error, success=success, require_captcha=require_captcha)
+
+@app.route("/assets/<path:name>")
+def asset(name):
+    """Serve a fingerprinted static file, precompressed, cacheable for a year"""
+    from flask import Response
+    found = assets.lookup(name, request.accept_encodings)
+    if found is None:
+        abort(404)
+    asset_file, encoding, body = found
+
+    response = Response(body, mimetype=asset_file.content_type)
+    if encoding != "identity":
+        response.headers['Content-Encoding'] = encoding
+    if len(asset_file.variants) > 1:
+        response.headers['Vary'] = 'Accept-Encoding'
+    # The name changes with the content, so the response never goes stale
+    response.headers['Cache-Control'] = f'public, max-age={ONE_YEAR}, immutable'
+    response.set_etag(f"{asset_file.digest}-{encoding}")
+    return response.make_conditional(request)
 
 @app.route("/captcha/image")
 # Rate limiting removed
 def get_captcha_image():
-    """Generate new CAPTCHA image"""
+    """Generate new CAPTCHA image and return its URL and signed token"""
     from flask import jsonify
     try:
-        image_data = simple_captcha.generate_captcha()
-        return jsonify({'image': image_data})
+        image_url, token = simple_captcha.generate_captcha()
+        return jsonify({'image': image_url, 'token': token})
     except Exception as e:
         # Error generating CAPTCHA
         return jsonify({'error': 'Unable to generate CAPTCHA'}), 500
 
+@app.route("/captcha/image/<challenge_id>.png", endpoint="captcha_image")
+def get_captcha_image_png(challenge_id):
+    """Serve a CAPTCHA challenge image as raw PNG bytes"""
+    from flask import Response
+    png = simple_captcha.get_image(challenge_id)
+    if png is None:
+        abort(404)
+    
+    response = Response(png, mimetype='image/png')
+    # A challenge id always carries the same answer, so the image never needs refetching
+    response.headers['Cache-Control'] = 'private, max-age=300, immutable'
+    return response
+
 @app.route("/captcha/math")
 # Rate limiting removed
 def get_math_captcha():
     """Generate new math CAPTCHA"""
     from flask import jsonify
     try:
-        question = math_captcha.generate_math_captcha()
-        return jsonify({'question': question})
+        question, token = math_captcha.generate_math_captcha()
+        return jsonify({'question': question, 'token': token})
     except Exception as e:
         # Error generating CAPTCHA
         return jsonify({'error': 'Unable to generate math CAPTCHA'}), 500
@@ -964,17 +1258,19 @@ def security_status():
     # Simplified status
     status = {
         'status': 'running',
-        'csrf_available': CSRF_AVAILABLE
+        'csrf_available': CSRF_AVAILABLE,
+        'weather': get_weather_service().status(),
+        'captcha': captcha_engine.metrics()
     }
     
     return jsonify(status)
 
 @app.errorhandler(429)
 def rate_limit_exceeded(error):
-    """Handle rate limit exceeded"""
+    """Handle rate limit exceeded - also raised when the scheduler queue is full"""
     return render_template('error.html', 
                          error_code=429, 
-                         error_message="Too many requests. Please slow down."), 429
+                         error_message="Too many requests. Please slow down."), 429, {"Retry-After": "5"}
 
 @app.errorhandler(400)
 def bad_request(error):
@@ -0,0 +1,120 @@
+# assets.py - Fingerprinted, precompressed static assets
+import hashlib
+import mimetypes
+import os
+import threading
+from typing import Dict, Optional, Tuple
+
+from compression import BROTLI_AVAILABLE, COMPRESSIBLE_TYPES, compress
+
+ONE_YEAR = 365 * 24 * 3600
+
+
+class Asset:
+    """One static file with its content hash and encoded variants"""
+
+    def __init__(self, path: str, data: bytes, mtime: float):
+        self.path = path
+        self.mtime = mtime
+        self.digest = hashlib.sha256(data).hexdigest()[:12]
+        self.content_type = mimetypes.guess_type(path)[0] or "application/octet-stream"
+        stem, ext = os.path.splitext(path)
+        self.fingerprinted = f"{stem}.{self.digest}{ext}"
+
+        self.variants = {"identity": data}
+        if self.content_type.startswith(COMPRESSIBLE_TYPES):
+            for encoding in (("gzip", "br") if BROTLI_AVAILABLE else ("gzip",)):
+                compressed = compress(data, encoding, static=True)
+                if len(compressed) < len(data):
+                    self.variants[encoding] = compressed
+
+
+class AssetManifest:
+    """Maps static file paths to content-hashed URLs and serves their bytes
+
+    Every file under the static folder is hashed and compressed once, the
+    first time an asset URL is needed. Its URL changes whenever its content
+    does, so responses can be cached for a year without revalidation. With
+    auto_reload (debug mode) an edited file is picked up on the next render.
+    """
+
+    def __init__(self, static_dir: str, url_prefix: str = "/assets", auto_reload: bool = False):
+        self.static_dir = static_dir
+        self.url_prefix = url_prefix.rstrip("/")
+        self.auto_reload = auto_reload
+        self._assets: Dict[str, Asset] = {}      # path -> asset
+        self._by_name: Dict[str, Asset] = {}     # fingerprinted path -> asset
+        self._built = False
+        self._lock = threading.Lock()
+        self._build_lock = threading.Lock()
+
+    def build(self):
+        """Hash and compress every file under the static folder"""
+        assets = {}
+        for root, _, files in os.walk(self.static_dir):
+            for filename in files:
+                full_path = os.path.join(root, filename)
+                path = os.path.relpath(full_path, self.static_dir).replace(os.sep, "/")
+                assets[path] = self._load(path, full_path)
+        with self._lock:
+            self._assets = assets
+            self._by_name = {asset.fingerprinted: asset for asset in assets.values()}
+            self._built = True
+
+    def _load(self, path: str, full_path: str) -> Asset:
+        with open(full_path, "rb") as f:
+            data = f.read()
+        return Asset(path, data, os.path.getmtime(full_path))
+
+    def _ensure_built(self):
+        if not self._built:
+            with self._build_lock:
+                if not self._built:
+                    self.build()
+
+    def _get(self, path: str) -> Optional[Asset]:
+        self._ensure_built()
+        asset = self._assets.get(path)
+        if asset is None or not self.auto_reload:
+            return asset
+
+        full_path = os.path.join(self.static_dir, path)
+        try:
+            if os.path.getmtime(full_path) != asset.mtime:
+                asset = self._load(path, full_path)
+                with self._lock:
+                    self._assets[path] = asset
+                    self._by_name[asset.fingerprinted] = asset
+        except OSError:
+            pass
+        return asset
+
+    def url(self, path: str) -> str:
+        """Content-hashed URL for a static file, or its plain /static URL if unknown"""
+        path = path.lstrip("/")
+        asset = self._get(path)
+        if asset is None:
+            return f"/static/{path}"
+        return f"{self.url_prefix}/{asset.fingerprinted}"
+
+    def lookup(self, name: str, accept_encodings) -> Optional[Tuple[Asset, str, bytes]]:
+        """The asset for a fingerprinted name and the best encoding the client accepts
+
+        accept_encodings is the request's Accept-Encoding header as parsed by
+        Werkzeug; returns (asset, encoding, body) or None for unknown names.
+        """
+        self._ensure_built()
+        asset = self._by_name.get(name)
+        if asset is None:
+            return None
+        for encoding in ("br", "gzip"):
+            if encoding in asset.variants and accept_encodings[encoding]:
+                return asset, encoding, asset.variants[encoding]
+        return asset, "identity", asset.variants["identity"]
+
+
+# Global instance - built on first use so startup stays cheap
+assets = AssetManifest(
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), "static"),
+    auto_reload=os.getenv("FLASK_DEBUG") == "1" or os.getenv("FLASK_ENV") == "development"
+)
@@ -0,0 +1,91 @@
+# bench_captcha.py - CAPTCHA validation throughput, legacy vs HMAC
+#
+# The legacy validator hashed 1000 freshly generated random strings per
+# attempt looking for the stored answer; it is reproduced here as the
+# baseline. The current validator is a single HMAC comparison.
+#
+#     python benchmarks/bench_captcha.py --attempts 2000
+import argparse
+import hashlib
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from flask import Flask, session
+
+from captcha import math_captcha, simple_captcha
+
+CHARS = 'ABCDEFGHJKLMNPQRSTUVWXYZ23456789'
+
+
+def legacy_validate(user_input):
+    """The pre-HMAC SimpleCaptcha.validate_captcha + _generate_possible_texts"""
+    stored_hash = session.get('legacy_hash')
+    stored_time = session.get('legacy_time')
+    user_input_clean = user_input.strip().upper()
+    texts = [''.join(random.choice(CHARS) for _ in range(4)) for _ in range(1000)]
+    for test_text in texts:
+        test_hash = hashlib.sha256(f"{test_text.lower()}{stored_time}".encode()).hexdigest()
+        if test_hash == stored_hash and user_input_clean == test_text.upper():
+            return True
+    return False
+
+
+def legacy_validate_math(user_input):
+    stored_time = session.get('legacy_math_time')
+    test_hash = hashlib.sha256(f"{int(user_input)}{stored_time}".encode()).hexdigest()
+    return test_hash == session.get('legacy_math_hash')
+
+
+def run(label, attempts, validate):
+    start = time.perf_counter()
+    for _ in range(attempts):
+        validate()
+    elapsed = time.perf_counter() - start
+    print(f"{label:<28} {attempts / elapsed:>12,.0f} validations/s  {elapsed / attempts * 1e6:>9.1f} us each")
+    return elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description="CAPTCHA validation throughput")
+    parser.add_argument('--attempts', type=int, default=1000)
+    args = parser.parse_args()
+
+    app = Flask(__name__)
+    app.secret_key = 'benchmark'
+
+    with app.test_request_context('/'):
+        # Seed both schemes with a pending challenge whose answer is 'K7QP'
+        timestamp = str(int(time.time()))
+        session['legacy_hash'] = hashlib.sha256(f"k7qp{timestamp}".encode()).hexdigest()
+        session['legacy_time'] = timestamp
+        session['legacy_math_hash'] = hashlib.sha256(f"7{timestamp}".encode()).hexdigest()
+        session['legacy_math_time'] = timestamp
+
+        from captcha import IMAGE_KIND, MATH_KIND, issue_token
+
+        # Tokens are single use, so each attempt gets a freshly issued pair
+        tokens = iter([(issue_token(IMAGE_KIND, 'K7QP')[1], issue_token(MATH_KIND, 7)[1])
+                       for _ in range(args.attempts + 1)])
+
+        def token_validate():
+            image_token, math_token = next(tokens)
+            return (simple_captcha.validate_captcha('ABCD', image_token)[0]
+                    or math_captcha.validate_math_captcha('3', math_token)[0])
+
+        # A wrong answer exercises the full cost of every attempt
+        before = run("legacy image + math", args.attempts,
+                     lambda: legacy_validate('ABCD') or legacy_validate_math('3'))
+        after = run("hmac token image + math", args.attempts, token_validate)
+        print(f"speed-up                     {before / after:>12,.0f}x")
+
+        image_token = issue_token(IMAGE_KIND, 'K7QP')[1]
+        assert simple_captcha.validate_captcha('k7qp ', image_token)[0], "correct answer must validate"
+        assert not simple_captcha.validate_captcha('k7qp', image_token)[0], "tokens must be single use"
+
+
+if __name__ == "__main__":
+    main()
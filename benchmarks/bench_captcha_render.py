@@ -0,0 +1,64 @@
+# bench_captcha_render.py - CPU per page render for a client stuck behind the CAPTCHA
+#
+# Simulates an abusive client that keeps failing the CAPTCHA on /index and
+# /contact. Pages now render a placeholder and challenges are generated on
+# demand, so the "eager" row adds back the image + math generation that each
+# render used to perform, measured with process CPU time (which includes the
+# pool refill thread).
+#
+#     python benchmarks/bench_captcha_render.py --renders 300
+import argparse
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app import app, math_captcha, simple_captcha
+
+
+def abusive_requests(client):
+    """One failed CAPTCHA attempt on each form"""
+    client.post('/index', data={'add_player': 'true', 'name': 'Bot', 'grade': '1', 'captcha_response': 'XXXX'})
+    client.post('/contact', data={'name': 'Bot', 'email': 'bot@example.com', 'subject': 'other',
+                                  'message': 'spam spam spam', 'captcha_response': 'XXXX'})
+
+
+def measure(label, renders, extra=None):
+    client = app.test_client()
+    with client.session_transaction() as session:
+        session['form_failures'] = 10
+        session['contact_form_failures'] = 10
+
+    abusive_requests(client)  # warm templates and the glyph atlas
+    start = time.process_time()
+    for _ in range(renders):
+        abusive_requests(client)
+        if extra:
+            extra()
+    cpu = time.process_time() - start
+    per_render = cpu / (renders * 2) * 1000
+    print(f"{label:<34} {per_render:8.3f} ms CPU per render")
+    return per_render
+
+
+def eager_generation():
+    """What every CAPTCHA render used to do before lazy generation"""
+    with app.test_request_context('/'):
+        for _ in range(2):
+            simple_captcha.generate_captcha()
+            math_captcha.generate_math_captcha()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="CAPTCHA page render cost under abuse")
+    parser.add_argument('--renders', type=int, default=200)
+    args = parser.parse_args()
+
+    lazy = measure("lazy (placeholder only)", args.renders)
+    eager = measure("eager (image + math per render)", args.renders, eager_generation)
+    print(f"saved per render                   {eager - lazy:8.3f} ms CPU ({(eager - lazy) / eager:.0%})")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,131 @@
+# bench_csv_import.py - Roster CSV import throughput, legacy vs streaming
+#
+# Builds a roster of about 1 MB (the upload limit) with a free-text notes
+# column, then runs the whole file through the legacy import - decode the
+# upload, re-write every line character by character, re-parse with
+# DictReader, then validate and scan the whole list for duplicates per row -
+# and through the streaming pipeline in roster.py, which validates in bulk
+# against a casefolded name index. The upload row cap is lifted so the full
+# file is measured. Peak memory comes from tracemalloc.
+#
+# The last rows compare re-importing a weekly roster of --roster-size
+# players with loading the same roster from the saved roster library.
+#
+#     python benchmarks/bench_csv_import.py --size-kb 1024 --repeat 5
+import argparse
+import csv
+import io
+import os
+import random
+import sys
+import tempfile
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from roster import iter_csv_rows, parse_player_row, sanitize_csv_field, validate_roster
+from storage import RosterLibrary
+
+
+def build_roster(size_bytes, seed=7):
+    """name,grade,max_rounds,notes rows until the file reaches size_bytes"""
+    rng = random.Random(seed)
+    words = ['forehand', 'backhand', 'serve', 'volley', 'lob', 'slice', 'topspin', 'drop shot']
+    lines = ['name,grade,max_rounds,notes']
+    size = len(lines[0]) + 1
+    n = 0
+    while size < size_bytes:
+        n += 1
+        notes = ' '.join(rng.choice(words) for _ in range(rng.randint(5, 40)))
+        line = f'Player {n},{rng.randint(1, 4)},{rng.choice(["", "3", "5"])},"{notes}, prefers court {rng.randint(1, 6)}"'
+        lines.append(line)
+        size += len(line) + 1
+    return ('\n'.join(lines) + '\n').encode('utf-8')
+
+
+def legacy_sanitize_csv_content(content):
+    """The pre-streaming app.sanitize_csv_content"""
+    sanitized_lines = []
+    for line in content.split('\n'):
+        if not line.strip():
+            sanitized_lines.append(line)
+            continue
+        fields = []
+        current_field = ""
+        in_quotes = False
+        for char in line:
+            if char == '"' and (not current_field or current_field[-1] != '\\'):
+                in_quotes = not in_quotes
+                current_field += char
+            elif char == ',' and not in_quotes:
+                fields.append(sanitize_csv_field(current_field))
+                current_field = ""
+            else:
+                current_field += char
+        fields.append(sanitize_csv_field(current_field))
+        sanitized_lines.append(','.join(fields))
+    return '\n'.join(sanitized_lines)
+
+
+def legacy_import(data):
+    content = legacy_sanitize_csv_content(data.decode('utf-8'))
+    new_players = []
+    for row in csv.DictReader(io.StringIO(content)):
+        player, _ = parse_player_row({key: sanitize_csv_field(row.get(key, "")) for key in ('name', 'grade', 'max_rounds')})
+        if player and not any(p["name"].lower() == player["name"].lower() for p in new_players):
+            new_players.append(player)
+    return len(new_players)
+
+
+def streaming_import(data):
+    rows = iter_csv_rows(io.BytesIO(data))
+    next(rows)
+    players, _ = validate_roster(rows)
+    return len(players)
+
+
+def measure(label, func, data, repeat):
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        accepted = func(data)
+        timings.append(time.perf_counter() - start)
+    tracemalloc.start()
+    func(data)
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    best = min(timings)
+    print(f"{label:<10} {best * 1000:8.1f} ms  {len(data) / best / 1e6:6.2f} MB/s  "
+          f"{accepted / best:>10,.0f} rows/s  peak {peak / 1024:7.0f} KB  ({accepted} rows)")
+    return best
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Roster CSV import throughput")
+    parser.add_argument('--size-kb', type=int, default=1024)
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--roster-size', type=int, default=100)
+    args = parser.parse_args()
+
+    data = build_roster(args.size_kb * 1024)
+    rows = data.count(b'\n') - 1
+    print(f"roster     {len(data) / 1024:.0f} KB, {rows} rows")
+    before = measure("legacy", legacy_import, data, args.repeat)
+    after = measure("streaming", streaming_import, data, args.repeat)
+    print(f"speed-up   {before / after:.1f}x")
+
+    # Weekly roster: re-upload the CSV or load it from the library
+    weekly = b'\n'.join(data.split(b'\n')[:args.roster_size + 1]) + b'\n'
+    with tempfile.TemporaryDirectory() as directory:
+        library = RosterLibrary(os.path.join(directory, 'rosters.db'))
+        rows = iter_csv_rows(io.BytesIO(weekly))
+        next(rows)
+        library.save('bench', 'weekly', validate_roster(rows)[0])
+        upload = measure("re-upload", streaming_import, weekly, args.repeat * 20)
+        saved = measure("library", lambda _: len(library.load('bench', 'weekly')), weekly, args.repeat * 20)
+    print(f"speed-up   {upload / saved:.1f}x")
+
+
+if __name__ == "__main__":
+    main()
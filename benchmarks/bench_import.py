@@ -0,0 +1,132 @@
+# bench_import.py - Cold-start cost of importing the app
+#
+# Runs `python -X importtime -c "import app"` in fresh interpreters and
+# reports the median cumulative import time of the app, the slowest
+# top-level imports, and whether the modules that should load on first
+# use (PIL, requests, smtplib, email.mime, ...) were pulled in anyway.
+# Importing the app must also start no threads and open or create no files
+# (the stores and the outbox sender wait for the first request); the
+# benchmark exits non-zero if it does.
+#
+#     python benchmarks/bench_import.py --runs 7 --top 12
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Modules the app should not import until a request needs them
+DEFERRED = ["PIL", "requests", "smtplib", "email.mime", "dotenv",
+            "flask_wtf", "concurrent.futures.process"]
+
+PROBE = """
+import os, sys, threading
+FD_DIR = "/proc/self/fd"  # Linux only; elsewhere only created files are checked
+def open_files():
+    if not os.path.isdir(FD_DIR):
+        return {{}}
+    files = {{}}
+    for fd in os.listdir(FD_DIR):
+        try:
+            files[fd] = os.readlink(os.path.join(FD_DIR, fd))
+        except OSError:
+            pass  # the descriptor listing the directory
+    return files
+before = open_files()
+sys.path.insert(0, {root!r})
+import app
+opened = sorted(path for fd, path in open_files().items() if before.get(fd) != path)
+print(json.dumps({{
+    "eager": [m for m in {deferred!r} if m in sys.modules],
+    "threads": [t.name for t in threading.enumerate() if t is not threading.main_thread()],
+    "opened": opened,
+    "created": sorted(os.listdir(".")),
+}}))
+"""
+
+
+def run_once(env):
+    """One cold import; returns (wall ms, {module: cumulative us}, side effects)"""
+    code = "import json\n" + PROBE.format(root=ROOT, deferred=DEFERRED)
+    start = time.perf_counter()
+    result = subprocess.run([sys.executable, "-X", "importtime", "-c", code],
+                            capture_output=True, text=True, env=env, cwd=env["BENCH_CWD"])
+    wall = (time.perf_counter() - start) * 1000
+    if result.returncode != 0:
+        sys.exit(result.stderr[-2000:])
+
+    # importtime lists children before their parent, indented two spaces a
+    # level; keep the app's direct imports so nested ones are not counted twice
+    cumulative = {}
+    children = {}
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "|" not in line:
+            continue
+        parts = line[len("import time:"):].split("|")
+        if not parts[1].strip().isdigit():
+            continue  # header row
+        name = parts[2].rstrip()
+        depth = (len(name) - len(name.lstrip())) // 2
+        if depth == 1:
+            children[name.strip()] = int(parts[1])
+        elif depth == 0:
+            if name.strip() == "app":
+                cumulative = dict(children, app=int(parts[1]))
+            children = {}
+    effects = json.loads(result.stdout.strip().splitlines()[-1])
+    return wall, cumulative, effects
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Cold-start import cost of the app")
+    parser.add_argument('--runs', type=int, default=5)
+    parser.add_argument('--top', type=int, default=10)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as scratch:
+        # Each run imports from an empty directory, so anything left in it was created by the import
+        # Keep the stores' SQLite files out of the working tree
+        env = dict(os.environ, BENCH_CWD=scratch,
+                   EVENT_DB_PATH=os.path.join(scratch, "events.db"),
+                   ROSTER_DB_PATH=os.path.join(scratch, "rosters.db"),
+                   OUTBOX_DB_PATH=os.path.join(scratch, "outbox.db"))
+        runs = []
+        for _ in range(args.runs):
+            runs.append(run_once(env))
+            for name in os.listdir(scratch):
+                os.remove(os.path.join(scratch, name))
+
+    walls = [wall for wall, _, _ in runs]
+    app_times = [cumulative.get("app", 0) / 1000 for _, cumulative, _ in runs]
+    print(f"runs                      {args.runs}")
+    print(f"interpreter + import app  {statistics.median(walls):8.1f} ms wall (median)")
+    print(f"import app                {statistics.median(app_times):8.1f} ms cumulative (median)")
+
+    # Median cumulative time of each module the app imports directly
+    modules = {}
+    for _, cumulative, _ in runs:
+        for name, micros in cumulative.items():
+            if name == "app":
+                continue
+            modules.setdefault(name, []).append(micros / 1000)
+    slowest = sorted(modules.items(), key=lambda item: statistics.median(item[1]), reverse=True)
+    print("\nslowest imports made by app:")
+    for name, times in slowest[:args.top]:
+        print(f"  {name:<32} {statistics.median(times):8.1f} ms")
+
+    effects = runs[-1][2]
+    print("\nloaded at import (should be deferred): " + (", ".join(effects["eager"]) or "none"))
+    print("threads started at import:            " + (", ".join(effects["threads"]) or "none"))
+    print("files opened at import:               " + (", ".join(effects["opened"]) or "none"))
+    print("files created at import:              " + (", ".join(effects["created"]) or "none"))
+    if effects["threads"] or effects["opened"] or effects["created"]:
+        sys.exit("importing app must not start threads or touch files")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,101 @@
+# bench_weather.py - Concurrent load benchmark for the /weather page
+#
+# Starts the OpenWeatherMap stub, points the app at it and drives /weather
+# from several threads with a skewed postcode mix (a few popular venues and a
+# long tail), then reports latency percentiles, upstream calls and cache hits.
+#
+#     python benchmarks/bench_weather.py --requests 2000 --concurrency 16 --latency 150
+import argparse
+import os
+import random
+import statistics
+import sys
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from owm_stub import start_stub
+
+
+def percentile(samples, pct):
+    ordered = sorted(samples)
+    index = min(len(ordered) - 1, max(0, round(pct / 100 * len(ordered)) - 1))
+    return ordered[index]
+
+
+def build_workload(total, venues, seed=42):
+    """Zipf-like postcode mix - venue n is requested roughly 1/n as often"""
+    rng = random.Random(seed)
+    postcodes = [f"N{n} {rng.randint(1, 9)}AB" for n in range(1, venues + 1)]
+    weights = [1 / rank for rank in range(1, venues + 1)]
+    return rng.choices(postcodes, weights=weights, k=total)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Load benchmark for /weather")
+    parser.add_argument('--requests', type=int, default=1000)
+    parser.add_argument('--concurrency', type=int, default=8)
+    parser.add_argument('--venues', type=int, default=50, help="distinct postcodes in the mix")
+    parser.add_argument('--latency', type=float, default=100, help="stub latency in ms")
+    parser.add_argument('--jitter', type=float, default=25)
+    parser.add_argument('--error-rate', type=float, default=0.0)
+    parser.add_argument('--timeout-rate', type=float, default=0.0)
+    args = parser.parse_args()
+
+    server, stub = start_stub(latency_ms=args.latency, jitter_ms=args.jitter,
+                              error_rate=args.error_rate, timeout_rate=args.timeout_rate)
+    os.environ['OPENWEATHER_API_ROOT'] = f"http://127.0.0.1:{server.server_port}"
+    os.environ.setdefault('OUTCODE_INDEX_PATH', os.devnull)  # measure the full upstream chain
+
+    from app import app, get_weather_service
+    weather_service = get_weather_service()
+
+    workload = build_workload(args.requests, args.venues)
+    latencies = []
+    failures = 0
+    lock = threading.Lock()
+    position = iter(range(len(workload)))
+
+    def worker():
+        nonlocal failures
+        client = app.test_client()
+        while True:
+            with lock:
+                index = next(position, None)
+            if index is None:
+                return
+            start = time.perf_counter()
+            response = client.get('/weather', query_string={'postcode': workload[index], 'country_code': 'GB'})
+            elapsed = time.perf_counter() - start
+            with lock:
+                latencies.append(elapsed)
+                if response.status_code != 200 or b'alert-danger' in response.data:
+                    failures += 1
+
+    started = time.perf_counter()
+    threads = [threading.Thread(target=worker) for _ in range(args.concurrency)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    wall = time.perf_counter() - started
+
+    upstream = stub.stats()
+    cache = weather_service.cache.status()
+    print(f"requests      {len(latencies)} in {wall:.2f}s ({len(latencies) / wall:.1f} req/s), "
+          f"concurrency {args.concurrency}, {args.venues} venues")
+    print(f"latency ms    p50 {percentile(latencies, 50) * 1000:.1f}  "
+          f"p95 {percentile(latencies, 95) * 1000:.1f}  "
+          f"p99 {percentile(latencies, 99) * 1000:.1f}  "
+          f"mean {statistics.mean(latencies) * 1000:.1f}")
+    print(f"upstream      {upstream['total']} calls {upstream['calls']}, {upstream['errors']} injected errors")
+    print(f"cache         hit ratio {cache['hit_ratio']:.1%} "
+          f"(hits {cache['hits']}, stale {cache['stale_hits']}, misses {cache['misses']})")
+    print(f"breaker       {weather_service.breaker.status()['state']}")
+    print(f"error pages   {failures}")
+    server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
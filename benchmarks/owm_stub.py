@@ -0,0 +1,173 @@
+# owm_stub.py - Local OpenWeatherMap stand-in for load testing /weather
+#
+# Replays the recorded fixtures in benchmarks/fixtures with configurable
+# latency and error injection. Point the app at it with
+#
+#     python benchmarks/owm_stub.py --port 8081 --latency 150 --error-rate 0.02
+#     OPENWEATHER_API_ROOT=http://127.0.0.1:8081 python app.py
+#
+# GET /__stats returns per-endpoint call counts; GET /__reset clears them.
+import argparse
+import copy
+import hashlib
+import json
+import os
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+FIXTURE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'fixtures')
+
+ROUTES = {
+    '/geo/1.0/zip': 'geocode',
+    '/data/2.5/forecast': 'forecast',
+    '/data/2.5/weather': 'current',
+}
+
+
+def load_fixtures(directory=FIXTURE_DIR):
+    fixtures = {}
+    for name in set(ROUTES.values()):
+        with open(os.path.join(directory, f"{name}.json")) as f:
+            fixtures[name] = json.load(f)
+    return fixtures
+
+
+class StubState:
+    """Fixtures, fault settings and call counters shared by handler threads"""
+
+    def __init__(self, latency_ms=0, jitter_ms=0, error_rate=0.0, timeout_rate=0.0, hang_seconds=15):
+        self.fixtures = load_fixtures()
+        self.latency_ms = latency_ms
+        self.jitter_ms = jitter_ms
+        self.error_rate = error_rate
+        self.timeout_rate = timeout_rate
+        self.hang_seconds = hang_seconds
+        self.lock = threading.Lock()
+        self.calls = {name: 0 for name in ROUTES.values()}
+        self.errors = 0
+
+    def count(self, name):
+        with self.lock:
+            self.calls[name] += 1
+
+    def stats(self):
+        with self.lock:
+            return {'calls': dict(self.calls), 'total': sum(self.calls.values()), 'errors': self.errors}
+
+    def reset(self):
+        with self.lock:
+            self.calls = {name: 0 for name in ROUTES.values()}
+            self.errors = 0
+
+
+def geocode_response(fixture, zip_param):
+    """Deterministic location per postcode; codes starting ZZ are unknown"""
+    code = zip_param.split(',')[0].upper()
+    if not code or code.startswith('ZZ'):
+        return None
+
+    # Spread postcodes around the recorded point so distinct codes map to
+    # distinct locations, while the same code always maps to the same one
+    digest = hashlib.sha256(code.encode()).digest()
+    body = dict(fixture)
+    body['zip'] = code
+    body['lat'] = round(fixture['lat'] + (digest[0] - 128) / 2000, 4)
+    body['lon'] = round(fixture['lon'] + (digest[1] - 128) / 2000, 4)
+    return body
+
+
+def forecast_response(fixture):
+    """Recorded forecast with timestamps shifted to start at the current slot"""
+    body = copy.deepcopy(fixture)
+    slots = body.get('list', [])
+    if slots:
+        shift = int(time.time()) // 10800 * 10800 - slots[0]['dt']
+        for slot in slots:
+            slot['dt'] += shift
+            slot['dt_txt'] = time.strftime('%Y-%m-%d %H:%M:%S', time.gmtime(slot['dt']))
+    return body
+
+
+def make_handler(state):
+    class Handler(BaseHTTPRequestHandler):
+        def log_message(self, format, *args):
+            pass
+
+        def send_json(self, status, body):
+            payload = json.dumps(body).encode()
+            self.send_response(status)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(payload)))
+            self.end_headers()
+            self.wfile.write(payload)
+
+        def do_GET(self):
+            url = urlparse(self.path)
+            if url.path == '/__stats':
+                return self.send_json(200, state.stats())
+            if url.path == '/__reset':
+                state.reset()
+                return self.send_json(200, {'reset': True})
+
+            name = ROUTES.get(url.path)
+            if not name:
+                return self.send_json(404, {'cod': '404', 'message': 'not found'})
+            state.count(name)
+
+            delay = state.latency_ms + random.uniform(-state.jitter_ms, state.jitter_ms)
+            roll = random.random()
+            if roll < state.timeout_rate:
+                time.sleep(state.hang_seconds)
+            elif delay > 0:
+                time.sleep(delay / 1000)
+
+            if roll < state.timeout_rate + state.error_rate:
+                with state.lock:
+                    state.errors += 1
+                return self.send_json(500, {'cod': '500', 'message': 'injected error'})
+
+            params = parse_qs(url.query)
+            if name == 'geocode':
+                body = geocode_response(state.fixtures['geocode'], params.get('zip', [''])[0])
+                if body is None:
+                    return self.send_json(404, {'cod': '404', 'message': 'not found'})
+                return self.send_json(200, body)
+            if name == 'forecast':
+                return self.send_json(200, forecast_response(state.fixtures['forecast']))
+            return self.send_json(200, state.fixtures['current'])
+
+    return Handler
+
+
+def start_stub(port=0, **options):
+    """Start the stub on a background thread; returns (server, state)"""
+    state = StubState(**options)
+    server = ThreadingHTTPServer(('127.0.0.1', port), make_handler(state))
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name="owm-stub", daemon=True).start()
+    return server, state
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Local OpenWeatherMap stand-in")
+    parser.add_argument('--port', type=int, default=8081)
+    parser.add_argument('--latency', type=float, default=100, help="mean response latency in ms")
+    parser.add_argument('--jitter', type=float, default=25, help="+/- latency jitter in ms")
+    parser.add_argument('--error-rate', type=float, default=0.0, help="fraction of calls answered with HTTP 500")
+    parser.add_argument('--timeout-rate', type=float, default=0.0, help="fraction of calls that hang before failing")
+    args = parser.parse_args()
+
+    server, _ = start_stub(args.port, latency_ms=args.latency, jitter_ms=args.jitter,
+                           error_rate=args.error_rate, timeout_rate=args.timeout_rate)
+    print(f"OpenWeatherMap stub listening on http://127.0.0.1:{server.server_port}")
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
@@ -1,158 +1,201 @@
 # captcha.py - Simple CAPTCHA implementation for abuse prevention
-import random
-import string
-from PIL import Image, ImageDraw, ImageFont
-import io
 import base64
+import random
 import hashlib
+import hmac
+import secrets
+import threading
 import time
-from flask import session
+from collections import OrderedDict
+from flask import current_app, jsonify, request, session, url_for
 
-class SimpleCaptcha:
-    def __init__(self):
-        self.width = 120
-        self.height = 40
-        self.length = 4
-        
-    def generate_text(self):
-        """Generate random CAPTCHA text"""
-        # Use letters and numbers, avoiding confusing characters
-        chars = 'ABCDEFGHJKLMNPQRSTUVWXYZ23456789'
-        return ''.join(random.choice(chars) for _ in range(self.length))
+from captcha_engine import CAPTCHA_CHARS, captcha_engine
+
+# Challenges expire after 5 minutes
+CAPTCHA_TTL = 300
+
+# Token kinds - which challenge the token's answer belongs to
+IMAGE_KIND = 'i'
+MATH_KIND = 'm'
+
+def _token_signature(challenge_id, kind, expires):
+    """Keyed HMAC showing we issued a challenge id, kind and expiry - no answer needed to check it"""
+    key = str(current_app.secret_key).encode()
+    message = f"issued|{challenge_id}|{kind}|{expires}".encode()
+    return hmac.new(key, message, hashlib.sha256).hexdigest()[:16]
+
+def _token_mac(challenge_id, kind, expires, answer):
+    """Keyed HMAC binding a normalised answer to its challenge id, kind and expiry"""
+    key = str(current_app.secret_key).encode()
+    message = f"{challenge_id}|{kind}|{expires}|{answer}".encode()
+    return hmac.new(key, message, hashlib.sha256).hexdigest()[:32]
+
+def _image_key():
+    """Key for sealing image answers, separate from the token MAC key"""
+    return hmac.new(str(current_app.secret_key).encode(), b"captcha-image-id", hashlib.sha256).digest()
+
+def seal_answer(text):
+    """Encrypt an image answer into a URL-safe challenge id
+
+    Any worker can turn the id back into the image, so challenges need no
+    shared server-side state. A tag stops made-up ids being rendered.
+    """
+    key = _image_key()
+    nonce = secrets.token_bytes(9)
+    keystream = hmac.new(key, b"stream|" + nonce, hashlib.sha256).digest()
+    sealed = bytes(c ^ k for c, k in zip(text.encode(), keystream))
+    tag = hmac.new(key, b"tag|" + nonce + sealed, hashlib.sha256).digest()[:6]
+    return base64.urlsafe_b64encode(nonce + sealed + tag).decode().rstrip("=")
+
+def open_answer(challenge_id):
+    """The answer sealed in a challenge id, or None if the id was not issued by us"""
+    try:
+        raw = base64.urlsafe_b64decode(challenge_id + "=" * (-len(challenge_id) % 4))
+    except (ValueError, TypeError):
+        return None
+    if not 16 <= len(raw) <= 9 + 32 + 6:
+        return None
+    nonce, sealed, tag = raw[:9], raw[9:-6], raw[-6:]
+    key = _image_key()
+    if not hmac.compare_digest(hmac.new(key, b"tag|" + nonce + sealed, hashlib.sha256).digest()[:6], tag):
+        return None
+    keystream = hmac.new(key, b"stream|" + nonce, hashlib.sha256).digest()
+    text = bytes(c ^ k for c, k in zip(sealed, keystream)).decode("ascii", "ignore")
+    return text if text and all(char in CAPTCHA_CHARS for char in text) else None
+
+def _parse_token(token):
+    """Split an 'id.kind.expires.signature.mac' token, or None if malformed"""
+    parts = (token or '').split('.')
+    if len(parts) != 5 or not parts[2].isdigit():
+        return None
+    return parts[0], parts[1], int(parts[2]), parts[3], parts[4]
+
+class UsedTokenSet:
+    """In-memory set of spent challenge ids, each kept only until it expires"""
     
-    def add_noise(self, draw, width, height):
-        """Add noise to make OCR harder"""
-        # Add random lines
-        for _ in range(random.randint(2, 4)):
-            x1 = random.randint(0, width)
-            y1 = random.randint(0, height)
-            x2 = random.randint(0, width)
-            y2 = random.randint(0, height)
-            draw.line([(x1, y1), (x2, y2)], fill=random.choice(['#808080', '#606060']), width=1)
-        
-        # Add random dots
-        for _ in range(random.randint(10, 20)):
-            x = random.randint(0, width)
-            y = random.randint(0, height)
-            draw.point((x, y), fill=random.choice(['#808080', '#606060']))
+    def __init__(self, max_entries=20000):
+        self.max_entries = max_entries
+        self._used = OrderedDict()  # challenge id -> expires
+        self._lock = threading.Lock()
     
-    def create_image(self, text):
-        """Create CAPTCHA image"""
-        # Create image with white background
-        image = Image.new('RGB', (self.width, self.height), 'white')
-        draw = ImageDraw.Draw(image)
-        
-        # Add background noise
-        self.add_noise(draw, self.width, self.height)
-        
-        # Try to use a font, fallback to default
-        try:
-            font = ImageFont.truetype("arial.ttf", 24)
-        except:
-            try:
-                font = ImageFont.load_default()
-            except:
-                font = None
-        
-        # Calculate text position
-        if font:
-            bbox = draw.textbbox((0, 0), text, font=font)
-            text_width = bbox[2] - bbox[0]
-            text_height = bbox[3] - bbox[1]
-        else:
-            text_width = len(text) * 8
-            text_height = 12
-        
-        x = (self.width - text_width) // 2
-        y = (self.height - text_height) // 2
-        
-        # Draw each character with slight rotation and color variation
-        char_width = text_width // len(text)
-        for i, char in enumerate(text):
-            char_x = x + i * char_width + random.randint(-3, 3)
-            char_y = y + random.randint(-3, 3)
-            color = random.choice(['#000000', '#333333', '#666666'])
-            
-            if font:
-                draw.text((char_x, char_y), char, font=font, fill=color)
-            else:
-                draw.text((char_x, char_y), char, fill=color)
-        
-        return image
+    def spend(self, challenge_id, expires):
+        """Mark a challenge used; False if it had already been used"""
+        now = time.time()
+        with self._lock:
+            # Tokens are spent roughly in expiry order, so expired ids sit at the front
+            while self._used and (len(self._used) >= self.max_entries
+                                  or next(iter(self._used.values())) < now):
+                self._used.popitem(last=False)
+            if challenge_id in self._used:
+                return False
+            self._used[challenge_id] = expires
+            return True
+
+# Shared by both challenge types; a token is spent on its first attempt
+used_tokens = UsedTokenSet()
+
+def issue_token(kind, answer, challenge_id=None):
+    """Create a signed, expiring challenge token - nothing is stored server side"""
+    challenge_id = challenge_id or secrets.token_urlsafe(12)
+    expires = int(time.time()) + CAPTCHA_TTL
+    signature = _token_signature(challenge_id, kind, expires)
+    mac = _token_mac(challenge_id, kind, expires, answer)
+    return challenge_id, f"{challenge_id}.{kind}.{expires}.{signature}.{mac}"
+
+def check_token(token, kind, answer):
+    """Constant-time check of an answer against a challenge token"""
+    parsed = _parse_token(token)
+    if not parsed or parsed[1] != kind:
+        return False, "CAPTCHA expired or missing"
+    challenge_id, _, expires, signature, mac = parsed
+    now = time.time()
+    if now > expires:
+        return False, "CAPTCHA expired"
+    # Only tokens we issued may take a slot in used_tokens, so made-up ones
+    # cannot push real spent ids out or sit in it long past their TTL
+    if expires > now + CAPTCHA_TTL or not hmac.compare_digest(
+            _token_signature(challenge_id, kind, expires), signature):
+        return False, "CAPTCHA expired or missing"
+    # One attempt per challenge, right or wrong, so answers cannot be guessed in turn
+    if not used_tokens.spend(challenge_id, expires):
+        return False, "CAPTCHA already used"
+    if hmac.compare_digest(_token_mac(challenge_id, kind, expires, answer), mac):
+        return True, "CAPTCHA validated"
+    return False, None
+
+def token_kind(token):
+    """Challenge kind named in a token, or None"""
+    parsed = _parse_token(token)
+    return parsed[1] if parsed else None
+
+class CaptchaImageStore:
+    """Short-lived cache of challenge images keyed by challenge id
+
+    Only a per-process shortcut - an id this process never saw is rendered
+    again from the answer sealed in it.
+    """
+    
+    def __init__(self, max_entries=5000):
+        self.max_entries = max_entries
+        self._images = OrderedDict()  # challenge id -> (png bytes, expires)
+        self._lock = threading.Lock()
+    
+    def put(self, challenge_id, png, expires):
+        now = time.time()
+        with self._lock:
+            self._images[challenge_id] = (png, expires)
+            # Entries arrive in expiry order, so expired ones sit at the front
+            while self._images and (len(self._images) > self.max_entries
+                                    or next(iter(self._images.values()))[1] < now):
+                self._images.popitem(last=False)
+    
+    def get(self, challenge_id):
+        with self._lock:
+            entry = self._images.get(challenge_id)
+        if not entry or entry[1] < time.time():
+            return None
+        return entry[0]
+
+class SimpleCaptcha:
+    def __init__(self, engine=None):
+        self.engine = engine or captcha_engine
+        self.images = CaptchaImageStore()
     
     def generate_captcha(self):
-        """Generate CAPTCHA and return image data and hash"""
-        text = self.generate_text()
-        image = self.create_image(text)
-        
-        # Convert image to base64
-        buffer = io.BytesIO()
-        image.save(buffer, format='PNG')
-        image_data = base64.b64encode(buffer.getvalue()).decode()
+        """Generate CAPTCHA and return (image URL, signed token)"""
+        # Pre-rendered challenges come from the engine's pool
+        text, png = self.engine.get_challenge()
         
-        # Create hash for validation
-        timestamp = str(int(time.time()))
-        hash_input = f"{text.lower()}{timestamp}"
-        captcha_hash = hashlib.sha256(hash_input.encode()).hexdigest()
-        
-        # Store in session with timestamp
-        session['captcha_hash'] = captcha_hash
-        session['captcha_time'] = timestamp
-        
-        return f"data:image/png;base64,{image_data}"
+        # The answer travels as an HMAC in the token and encrypted in the id
+        challenge_id, token = issue_token(IMAGE_KIND, text.upper(), seal_answer(text.upper()))
+        self.images.put(challenge_id, png, int(time.time()) + CAPTCHA_TTL)
+        return url_for('captcha_image', challenge_id=challenge_id), token
     
-    def validate_captcha(self, user_input):
-        """Validate CAPTCHA input"""
+    def get_image(self, challenge_id):
+        """PNG bytes for a challenge, or None if the id was not issued by us"""
+        png = self.images.get(challenge_id)
+        if png is None:
+            # Issued by another worker, or pushed out of this one's cache
+            text = open_answer(challenge_id)
+            if text is None:
+                return None
+            png = self.engine.encode(self.engine.render(text))
+            self.images.put(challenge_id, png, int(time.time()) + CAPTCHA_TTL)
+        return png
+    
+    def validate_captcha(self, user_input, token):
+        """Validate CAPTCHA input against its challenge token"""
         if not user_input:
             return False, "CAPTCHA is required"
         
-        stored_hash = session.get('captcha_hash')
-        stored_time = session.get('captcha_time')
-        
-        if not stored_hash or not stored_time:
-            return False, "CAPTCHA expired or missing"
-        
-        # Check if CAPTCHA is expired (5 minutes)
-        current_time = int(time.time())
-        if current_time - int(stored_time) > 300:
-            return False, "CAPTCHA expired"
-        
-        # Validate input
-        user_input_clean = user_input.strip().upper()
-        
-        # Try all possible correct answers from the time window
-        for test_text in self._generate_possible_texts():
-            hash_input = f"{test_text.lower()}{stored_time}"
-            test_hash = hashlib.sha256(hash_input.encode()).hexdigest()
-            
-            if test_hash == stored_hash and user_input_clean == test_text.upper():
-                # Clear CAPTCHA from session after successful validation
-                session.pop('captcha_hash', None)
-                session.pop('captcha_time', None)
-                return True, "CAPTCHA validated"
-        
-        return False, "Incorrect CAPTCHA"
-    
-    def _generate_possible_texts(self):
-        """Generate possible CAPTCHA texts for validation"""
-        # This is a simple implementation
-        # In a real scenario, you'd need to store the original text more securely
-        chars = 'ABCDEFGHJKLMNPQRSTUVWXYZ23456789'
-        
-        # For this simple implementation, we'll generate some common possibilities
-        # This is not ideal but works for demonstration
-        texts = []
-        for _ in range(1000):  # Generate many possibilities
-            text = ''.join(random.choice(chars) for _ in range(self.length))
-            texts.append(text)
-        
-        return texts
+        valid, message = check_token(token, IMAGE_KIND, user_input.strip().upper())
+        return valid, message or "Incorrect CAPTCHA"
 
 class MathCaptcha:
     """Simple math-based CAPTCHA as alternative"""
     
     def generate_math_captcha(self):
-        """Generate simple math problem"""
+        """Generate simple math problem and return (question, signed token)"""
         num1 = random.randint(1, 10)
         num2 = random.randint(1, 10)
         operation = random.choice(['+', '-'])
@@ -167,50 +210,29 @@ class MathCaptcha:
             answer = num1 - num2
             question = f"What is {num1} - {num2}?"
         
-        # Store answer hash in session
-        timestamp = str(int(time.time()))
-        hash_input = f"{answer}{timestamp}"
-        answer_hash = hashlib.sha256(hash_input.encode()).hexdigest()
-        
-        session['math_captcha_hash'] = answer_hash
-        session['math_captcha_time'] = timestamp
-        
-        return question
+        _, token = issue_token(MATH_KIND, answer)
+        return question, token
     
-    def validate_math_captcha(self, user_input):
-        """Validate math CAPTCHA answer"""
+    def validate_math_captcha(self, user_input, token):
+        """Validate math CAPTCHA answer against its challenge token"""
         try:
             user_answer = int(user_input.strip())
-        except (ValueError, TypeError):
+        except (ValueError, TypeError, AttributeError):
             return False, "Please enter a number"
         
-        stored_hash = session.get('math_captcha_hash')
-        stored_time = session.get('math_captcha_time')
-        
-        if not stored_hash or not stored_time:
-            return False, "CAPTCHA expired or missing"
-        
-        # Check if expired (5 minutes)
-        current_time = int(time.time())
-        if current_time - int(stored_time) > 300:
-            return False, "CAPTCHA expired"
-        
-        # Validate answer
-        hash_input = f"{user_answer}{stored_time}"
-        test_hash = hashlib.sha256(hash_input.encode()).hexdigest()
-        
-        if test_hash == stored_hash:
-            # Clear CAPTCHA from session
-            session.pop('math_captcha_hash', None)
-            session.pop('math_captcha_time', None)
-            return True, "CAPTCHA validated"
-        
-        return False, "Incorrect answer"
+        valid, message = check_token(token, MATH_KIND, user_answer)
+        return valid, message or "Incorrect answer"
 
 # Global instances
 simple_captcha = SimpleCaptcha()
 math_captcha = MathCaptcha()
 
+def validate_any_captcha(user_input, token):
+    """Validate an answer against whichever challenge the token was issued for"""
+    if token_kind(token) == MATH_KIND:
+        return math_captcha.validate_math_captcha(user_input, token)[0]
+    return simple_captcha.validate_captcha(user_input, token)[0]
+
 def require_captcha_after_failures(failure_threshold=3):
     """Decorator to require CAPTCHA after multiple failures"""
     def decorator(f):
@@ -226,11 +248,7 @@ def require_captcha_after_failures(failure_threshold=3):
                 if not captcha_input:
                     return jsonify({'error': 'CAPTCHA required after multiple attempts'}), 400
                 
-                # Validate CAPTCHA (try both types)
-                image_valid, _ = simple_captcha.validate_captcha(captcha_input)
-                math_valid, _ = math_captcha.validate_math_captcha(captcha_input)
-                
-                if not (image_valid or math_valid):
+                if not validate_any_captcha(captcha_input, request.form.get('captcha_token')):
                     return jsonify({'error': 'Invalid CAPTCHA'}), 400
                 
                 # Reset failure count on successful CAPTCHA
@@ -238,4 +256,4 @@ def require_captcha_after_failures(failure_threshold=3):
             
             return f(*args, **kwargs)
         return decorated_function
-    return decorator
\ No newline at end of file
+    return decorator
@@ -0,0 +1,99 @@
+# circuit_breaker.py - Circuit breaker for calls to upstream services
+import threading
+import time
+from typing import Dict
+
+
+class UpstreamUnavailable(Exception):
+    """Raised instead of calling upstream when it cannot answer in time"""
+
+
+class CircuitOpenError(UpstreamUnavailable):
+    """The breaker is open, so the call was rejected without being made"""
+
+
+class BudgetExceeded(UpstreamUnavailable):
+    """The per-request time budget ran out before the call could be made"""
+
+
+class CircuitBreaker:
+    """Classic closed / open / half-open circuit breaker
+
+    After failure_threshold consecutive failures the breaker opens and every
+    call is rejected immediately. Once recovery_timeout has passed a single
+    probe call is let through (half-open); its success closes the breaker,
+    its failure opens it again for another recovery_timeout.
+    """
+
+    CLOSED = 'closed'
+    OPEN = 'open'
+    HALF_OPEN = 'half_open'
+
+    def __init__(self, name: str, failure_threshold: int = 5, recovery_timeout: float = 30):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.recovery_timeout = recovery_timeout
+
+        self._lock = threading.Lock()
+        self._state = self.CLOSED
+        self._consecutive_failures = 0
+        self._opened_at = 0.0
+        self._probe_in_flight = False
+
+        self.counts = {'successes': 0, 'failures': 0, 'rejected': 0, 'opened': 0}
+
+    @property
+    def state(self) -> str:
+        with self._lock:
+            return self._current_state()
+
+    def _current_state(self) -> str:
+        """State with the open -> half-open timeout applied (lock held)"""
+        if self._state == self.OPEN and time.time() - self._opened_at >= self.recovery_timeout:
+            self._state = self.HALF_OPEN
+            self._probe_in_flight = False
+        return self._state
+
+    def allow_request(self) -> bool:
+        """Whether a call may go upstream now; half-open admits one probe"""
+        with self._lock:
+            state = self._current_state()
+            if state == self.CLOSED:
+                return True
+            if state == self.HALF_OPEN and not self._probe_in_flight:
+                self._probe_in_flight = True
+                return True
+            self.counts['rejected'] += 1
+            return False
+
+    def record_success(self):
+        with self._lock:
+            self.counts['successes'] += 1
+            self._consecutive_failures = 0
+            self._state = self.CLOSED
+            self._probe_in_flight = False
+
+    def record_failure(self):
+        with self._lock:
+            self.counts['failures'] += 1
+            self._consecutive_failures += 1
+            state = self._current_state()
+            if state == self.HALF_OPEN or self._consecutive_failures >= self.failure_threshold:
+                if state != self.OPEN:
+                    self.counts['opened'] += 1
+                self._state = self.OPEN
+                self._opened_at = time.time()
+                self._probe_in_flight = False
+
+    def status(self) -> Dict:
+        """Breaker state and counters for monitoring"""
+        with self._lock:
+            state = self._current_state()
+            return {
+                'name': self.name,
+                'state': state,
+                'consecutive_failures': self._consecutive_failures,
+                'retry_in': round(max(0.0, self.recovery_timeout - (time.time() - self._opened_at)), 1)
+                            if state == self.OPEN else 0,
+                **self.counts
+            }
@@ -0,0 +1,102 @@
+# compression.py - gzip/brotli response bodies and page validators
+import gzip
+import hashlib
+import os
+from importlib.util import find_spec
+
+# Brotli is optional - without it clients get gzip
+BROTLI_AVAILABLE = find_spec("brotli") is not None
+
+# Only text formats are worth compressing; PNGs are already compressed
+COMPRESSIBLE_TYPES = ("text/", "application/javascript", "application/json",
+                      "application/manifest+json", "image/svg+xml")
+
+# Bodies smaller than this gain less than the compression costs
+COMPRESS_MIN_SIZE = int(os.getenv("COMPRESS_MIN_SIZE", "1024"))
+
+
+def compress(data: bytes, encoding: str, static: bool = False) -> bytes:
+    """Encode a body; static files get the slowest, smallest settings since it happens once"""
+    if encoding == "br":
+        import brotli
+        return brotli.compress(data, quality=11 if static else 5)
+    # mtime=0 keeps the output identical for identical input
+    return gzip.compress(data, compresslevel=9 if static else 6, mtime=0)
+
+
+def preferred_encoding(accept_encodings) -> str:
+    """Best encoding the client accepts, from Werkzeug's parsed Accept-Encoding"""
+    if BROTLI_AVAILABLE and accept_encodings["br"]:
+        return "br"
+    if accept_encodings["gzip"]:
+        return "gzip"
+    return "identity"
+
+
+def compress_response(response, accept_encodings):
+    """Compress a rendered response in place when the client and content allow it
+
+    Streamed responses (server-sent events, exports) and files sent by
+    send_file are left alone, so nothing is buffered that should flow.
+    """
+    if (response.status_code < 200 or response.status_code in (204, 304)
+            or response.is_streamed or response.direct_passthrough
+            or "Content-Encoding" in response.headers
+            or "no-transform" in response.headers.get("Cache-Control", "")
+            or not (response.mimetype or "").startswith(COMPRESSIBLE_TYPES)):
+        return response
+
+    # Whether or not this client gets it compressed, another might
+    response.vary.add("Accept-Encoding")
+    encoding = preferred_encoding(accept_encodings)
+    if encoding == "identity":
+        return response
+    data = response.get_data()
+    if len(data) < COMPRESS_MIN_SIZE:
+        return response
+
+    response.set_data(compress(data, encoding))
+    response.headers["Content-Encoding"] = encoding
+    # Each encoding is its own representation, so it needs its own strong ETag
+    etag, weak = response.get_etag()
+    if etag:
+        response.set_etag(f"{etag}-{encoding}", weak)
+    return response
+
+
+def etag_matches(if_none_match, etag: str):
+    """The client's tag for this content in any encoding, or None
+
+    Returns the matching tag so a 304 can echo the representation the
+    client already holds.
+    """
+    for candidate in (etag, f"{etag}-gzip", f"{etag}-br"):
+        if if_none_match.contains(candidate):
+            return candidate
+    return None
+
+
+def source_version(paths) -> str:
+    """Short hash of the size and mtime of every file under paths
+
+    Changes whenever a template, static file or listed module is edited,
+    which is all a rendered page depends on besides its request state.
+    """
+    digest = hashlib.sha256()
+    for path in paths:
+        if os.path.isdir(path):
+            files = sorted(os.path.join(root, name) for root, _, names in os.walk(path) for name in names)
+        else:
+            files = [path]
+        for file_path in files:
+            try:
+                stat = os.stat(file_path)
+            except OSError:
+                continue
+            digest.update(f"{file_path}:{stat.st_size}:{stat.st_mtime_ns};".encode())
+    return digest.hexdigest()[:12]
+
+
+def page_etag(*parts) -> str:
+    """Strong ETag value for a page rendered from the given inputs"""
+    return hashlib.sha256("\x1f".join(str(part) for part in parts).encode()).hexdigest()[:24]
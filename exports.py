@@ -0,0 +1,115 @@
+# exports.py - Streaming schedule exports (CSV, iCalendar, printable HTML)
+import csv
+import io
+from datetime import datetime, timedelta, timezone
+
+from roster import sanitize_csv_field
+
+CSV_HEADER = ["round", "court", "format", "side_a", "side_a_grade", "side_b", "side_b_grade"]
+
+def iter_rounds(rounds, players=None):
+    """Yield (round number, matches, sitting out) in round order
+
+    Round keys may be ints or, after a trip through the session cookie,
+    strings. Sitting-out lists are only built when players are given.
+    """
+    for round_key in sorted(rounds, key=int):
+        matches = rounds[round_key]
+        sitting_out = []
+        if players is not None:
+            playing = {player["name"] for _, match in matches for player in match}
+            sitting_out = [player for player in players if player["name"] not in playing]
+        yield int(round_key), matches, sitting_out
+
+def match_sides(match):
+    """Split a match into its two sides - one player each or a pair each"""
+    half = len(match) // 2
+    return match[:half], match[half:]
+
+def side_label(side):
+    return " & ".join(player["name"] for player in side)
+
+def side_grade(side):
+    return round(sum(player["grade"] for player in side) / len(side), 1) if side else ""
+
+def iter_schedule_csv(rounds):
+    """CSV export, one line per match, produced as it is written"""
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+
+    def line(row):
+        writer.writerow(row)
+        value = buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate(0)
+        return value
+
+    yield line(CSV_HEADER)
+    for round_num, matches, _ in iter_rounds(rounds):
+        for court_num, match in matches:
+            side_a, side_b = match_sides(match)
+            # Names go through the same formula-injection guard as imports
+            yield line([
+                round_num, court_num, "doubles" if len(match) == 4 else "singles",
+                sanitize_csv_field(side_label(side_a)), side_grade(side_a),
+                sanitize_csv_field(side_label(side_b)), side_grade(side_b)
+            ])
+
+def _ics_text(value):
+    """Escape a TEXT value (RFC 5545 section 3.3.11)"""
+    return (value.replace("\\", "\\\\").replace(";", "\\;")
+            .replace(",", "\\,").replace("\n", "\\n"))
+
+def _ics_line(content):
+    """Fold a content line at 75 octets and terminate it with CRLF"""
+    encoded = content.encode("utf-8")
+    if len(encoded) <= 75:
+        return content + "\r\n"
+
+    parts = []
+    start = 0
+    limit = 75
+    while start < len(encoded):
+        end = min(start + limit, len(encoded))
+        # Never split a multi-byte character
+        while end < len(encoded) and (encoded[end] & 0xC0) == 0x80:
+            end -= 1
+        parts.append(encoded[start:end].decode("utf-8"))
+        start = end
+        limit = 74  # continuation lines start with a space
+    return "\r\n ".join(parts) + "\r\n"
+
+def iter_schedule_ics(rounds, start, round_minutes, uid_prefix):
+    """iCalendar export - one event per match, rounds back to back from start
+
+    Times are floating local times, so they show at the same clock time
+    in whatever time zone the calendar is in.
+    """
+    stamp = datetime.now(timezone.utc).strftime("%Y%m%dT%H%M%SZ")
+    length = timedelta(minutes=round_minutes)
+
+    yield _ics_line("BEGIN:VCALENDAR")
+    yield _ics_line("VERSION:2.0")
+    yield _ics_line("PRODID:-//Coach Organiser//Tennis Schedule//EN")
+    yield _ics_line("CALSCALE:GREGORIAN")
+    for round_num, matches, _ in iter_rounds(rounds):
+        begins = start + length * (round_num - 1)
+        for court_num, match in matches:
+            side_a, side_b = match_sides(match)
+            yield "".join([
+                _ics_line("BEGIN:VEVENT"),
+                _ics_line(f"UID:{uid_prefix}-r{round_num}-c{court_num}@coach-organiser"),
+                _ics_line(f"DTSTAMP:{stamp}"),
+                _ics_line(f"DTSTART:{begins:%Y%m%dT%H%M%S}"),
+                _ics_line(f"DTEND:{begins + length:%Y%m%dT%H%M%S}"),
+                _ics_line("SUMMARY:" + _ics_text(f"Round {round_num}, Court {court_num}: "
+                                                  f"{side_label(side_a)} vs {side_label(side_b)}")),
+                _ics_line("LOCATION:" + _ics_text(f"Court {court_num}")),
+                _ics_line("END:VEVENT"),
+            ])
+    yield _ics_line("END:VCALENDAR")
+
+def default_start(now=None):
+    """Next full hour - used when an ICS export gives no start time"""
+    now = now or datetime.now()
+    return now.replace(minute=0, second=0, microsecond=0) + timedelta(hours=1)
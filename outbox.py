@@ -0,0 +1,228 @@
+# outbox.py - Durable email outbox drained by a background SMTP sender
+import atexit
+import os
+import random
+import sqlite3
+import threading
+import time
+from typing import Optional
+
+from lazy_import import lazy_module
+from storage import SQLiteStore
+
+# smtplib is loaded when the first message is sent
+smtplib = lazy_module("smtplib")
+
+
+class Outbox(SQLiteStore):
+    """Outgoing mail spooled in SQLite and sent by one background thread
+
+    enqueue() only writes the message to disk, so a request never waits on
+    SMTP. The sender thread keeps one SMTP connection open while there is
+    mail to send (and for idle_timeout seconds after), so messages do not
+    each pay for a TLS handshake and login. Failed sends are retried with
+    exponential backoff up to max_attempts; a message is claimed with a
+    lease before sending, so several app processes can share one spool.
+    """
+
+    def __init__(self, path: str = None):
+        super().__init__(path or os.getenv("OUTBOX_DB_PATH", "outbox.db"))
+        self.smtp_server = os.getenv("SMTP_SERVER", "smtp.gmail.com")
+        self.smtp_port = int(os.getenv("SMTP_PORT", "587"))
+        self.smtp_username = os.getenv("SMTP_USERNAME", "")
+        self.smtp_password = os.getenv("SMTP_PASSWORD", "")
+        # Off for a local sink such as `python -m aiosmtpd -n -l localhost:8025`
+        self.use_tls = os.getenv("SMTP_USE_TLS", "1").lower() not in ("0", "false", "no")
+        self.smtp_timeout = float(os.getenv("SMTP_TIMEOUT", "10"))
+        self.idle_timeout = float(os.getenv("SMTP_IDLE_TIMEOUT", "60"))
+        self.max_attempts = int(os.getenv("OUTBOX_MAX_ATTEMPTS", "8"))
+        self.retry_base = float(os.getenv("OUTBOX_RETRY_BASE", "5"))
+        self.retry_max = float(os.getenv("OUTBOX_RETRY_MAX", "900"))
+        self.lease = self.smtp_timeout * 3 + 30
+
+        self._smtp = None
+        self._smtp_used = 0.0
+        self._wakeup = threading.Event()
+        self._stopping = threading.Event()
+        self._thread = None
+        self._thread_lock = threading.Lock()
+
+    def _create_schema(self, connection: sqlite3.Connection):
+        with connection:
+            connection.execute(
+                "CREATE TABLE IF NOT EXISTS messages ("
+                " id INTEGER PRIMARY KEY,"
+                " sender TEXT NOT NULL,"
+                " recipient TEXT NOT NULL,"
+                " body TEXT NOT NULL,"
+                " created REAL NOT NULL,"
+                " attempts INTEGER NOT NULL DEFAULT 0,"
+                " next_attempt REAL,"
+                " last_error TEXT)"
+            )
+            # Only messages still to be sent are indexed; given-up ones have no next_attempt
+            connection.execute(
+                "CREATE INDEX IF NOT EXISTS messages_due ON messages (next_attempt) WHERE next_attempt IS NOT NULL"
+            )
+
+    def enqueue(self, sender: str, recipient: str, body: str) -> int:
+        """Spool a message for sending and return its id"""
+        connection = self._connect()
+        now = time.time()
+        with connection:
+            message_id = connection.execute(
+                "INSERT INTO messages (sender, recipient, body, created, next_attempt) VALUES (?, ?, ?, ?, ?)",
+                (sender, recipient, body, now, now)
+            ).lastrowid
+        self.start()
+        self._wakeup.set()
+        return message_id
+
+    def pending(self) -> int:
+        """Messages not yet sent and not given up"""
+        return self._connect().execute(
+            "SELECT COUNT(*) FROM messages WHERE next_attempt IS NOT NULL"
+        ).fetchone()[0]
+
+    def start(self):
+        """Start the sender thread once per process"""
+        with self._thread_lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._stopping.clear()
+                self._thread = threading.Thread(target=self._run, name="outbox-sender", daemon=True)
+                self._thread.start()
+
+    def stop(self, timeout: float = 5):
+        """Stop the sender and close its SMTP connection"""
+        self._stopping.set()
+        self._wakeup.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+
+    def _run(self):
+        while not self._stopping.is_set():
+            try:
+                sent_any = self._drain()
+            except Exception as e:
+                print(f"Outbox sender error: {str(e)}")
+                sent_any = False
+            if sent_any:
+                continue
+
+            if self._smtp is not None and time.monotonic() - self._smtp_used > self.idle_timeout:
+                self._disconnect()
+            self._wakeup.wait(self._seconds_until_due())
+            self._wakeup.clear()
+        self._disconnect()
+
+    def _seconds_until_due(self) -> float:
+        """Sleep until the next retry is due, the idle connection should close, or enqueue wakes us"""
+        row = self._connect().execute(
+            "SELECT MIN(next_attempt) FROM messages WHERE next_attempt IS NOT NULL"
+        ).fetchone()
+        wait = self.idle_timeout if self._smtp is not None else 300
+        if row[0] is not None:
+            wait = min(wait, max(0.0, row[0] - time.time()))
+        return wait
+
+    def _claim(self) -> Optional[tuple]:
+        """Lease the oldest due message so no other sender picks it up"""
+        connection = self._connect()
+        now = time.time()
+        with connection:
+            row = connection.execute(
+                "SELECT id, sender, recipient, body, attempts, next_attempt FROM messages"
+                " WHERE next_attempt IS NOT NULL AND next_attempt <= ? ORDER BY next_attempt, id LIMIT 1",
+                (now,)
+            ).fetchone()
+            if row is None:
+                return None
+            claimed = connection.execute(
+                "UPDATE messages SET next_attempt = ? WHERE id = ? AND next_attempt = ?",
+                (now + self.lease, row[0], row[5])
+            ).rowcount
+        return row[:5] if claimed else None
+
+    def _drain(self) -> bool:
+        """Send every due message; True if anything was attempted"""
+        attempted = False
+        while not self._stopping.is_set():
+            message = self._claim()
+            if message is None:
+                return attempted
+            attempted = True
+            self._send(*message)
+        return attempted
+
+    def _send(self, message_id: int, sender: str, recipient: str, body: str, attempts: int):
+        connection = self._connect()
+        try:
+            try:
+                self._connection().sendmail(sender, recipient, body)
+            except smtplib.SMTPServerDisconnected:
+                # The server closed our idle connection - reconnect once straight away
+                self._smtp = None
+                self._connection().sendmail(sender, recipient, body)
+            self._smtp_used = time.monotonic()
+        except (smtplib.SMTPRecipientsRefused, smtplib.SMTPSenderRefused) as e:
+            # Refusals that will not change on retry - the message is given up
+            self._fail(message_id, attempts + 1, e, give_up=True)
+            return
+        except (smtplib.SMTPException, OSError) as e:
+            # The connection may be half-dead; the next attempt opens a fresh one
+            self._disconnect()
+            self._fail(message_id, attempts + 1, e, give_up=attempts + 1 >= self.max_attempts)
+            return
+
+        with connection:
+            connection.execute("DELETE FROM messages WHERE id = ?", (message_id,))
+
+    def _fail(self, message_id: int, attempts: int, error: Exception, give_up: bool):
+        """Record a failed attempt and schedule the retry, with jitter, or give up"""
+        next_attempt = None
+        if not give_up:
+            backoff = min(self.retry_max, self.retry_base * 2 ** (attempts - 1))
+            next_attempt = time.time() + backoff * random.uniform(0.8, 1.2)
+        print(f"Outbox message {message_id} attempt {attempts} failed: {str(error)}"
+              + (" - giving up" if give_up else ""))
+        connection = self._connect()
+        with connection:
+            connection.execute(
+                "UPDATE messages SET attempts = ?, next_attempt = ?, last_error = ? WHERE id = ?",
+                (attempts, next_attempt, str(error)[:500], message_id)
+            )
+
+    def _connection(self) -> "smtplib.SMTP":
+        """The open SMTP connection, or a new one (STARTTLS and login as configured)"""
+        if self._smtp is not None:
+            return self._smtp
+
+        server = smtplib.SMTP(self.smtp_server, self.smtp_port, timeout=self.smtp_timeout)
+        try:
+            server.ehlo()
+            if self.use_tls:
+                server.starttls()
+                server.ehlo()
+            # A local relay or test sink needs no login
+            if self.smtp_username:
+                server.login(self.smtp_username, self.smtp_password)
+        except Exception:
+            server.close()
+            raise
+        self._smtp = server
+        self._smtp_used = time.monotonic()
+        return server
+
+    def _disconnect(self):
+        if self._smtp is None:
+            return
+        try:
+            self._smtp.quit()
+        except (smtplib.SMTPException, OSError):
+            self._smtp.close()
+        self._smtp = None
+
+
+# Global instance - the sender thread starts with the first enqueued message
+outbox = Outbox()
+atexit.register(outbox.stop, 2)
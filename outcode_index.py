@@ -0,0 +1,169 @@
+# outcode_index.py - Offline lookup of UK outward-code centroids
+#
+# The index is a flat binary file: an 8-byte magic header, a record count and
+# fixed-width records (outward code, latitude, longitude) sorted by code, so a
+# lookup is a binary search over a memory-mapped file with no parsing at load.
+#
+# data/uk_outcodes.bin is built from a CSV with columns outcode/postcode,
+# latitude and longitude. Rows may be outward codes or full postcodes; full
+# postcodes are averaged into their outward code's centroid. The committed
+# file comes from the Code-Point Open derived list bundled in postcodez 0.10
+# (see data/README.md):
+#
+#     pip download --no-deps --no-binary :all: postcodez==0.10
+#     tar xzf postcodez-0.10.tar.gz
+#     python outcode_index.py postcodez-0.10/postcodez/ukpostcodes.csv
+import csv
+import mmap
+import os
+import re
+import struct
+import sys
+import threading
+from typing import Iterable, Optional, Tuple
+
+MAGIC = b'OUTCIDX1'
+HEADER = struct.Struct('<8sI')
+RECORD = struct.Struct('<4sff')
+
+DEFAULT_INDEX_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data', 'uk_outcodes.bin')
+
+# Inward codes are always digit + two letters, so a full postcode splits cleanly
+FULL_POSTCODE_RE = re.compile(r'^([A-Z]{1,2}[0-9][A-Z0-9]?)([0-9][A-Z]{2})$')
+OUTWARD_CODE_RE = re.compile(r'^[A-Z]{1,2}[0-9][A-Z0-9]?$')
+
+
+def outward_code(postcode: str) -> Optional[str]:
+    """Extract the outward code ("SW6") from a full or partial UK postcode"""
+    clean = postcode.replace(" ", "").upper()
+    match = FULL_POSTCODE_RE.match(clean)
+    if match:
+        return match.group(1)
+    if OUTWARD_CODE_RE.match(clean):
+        return clean
+    return None
+
+
+class OutcodeIndex:
+    """Memory-mapped, sorted index of UK outward-code centroids"""
+
+    def __init__(self, path: str = None):
+        self.path = path or os.getenv("OUTCODE_INDEX_PATH", DEFAULT_INDEX_PATH)
+        self._lock = threading.Lock()
+        self._loaded = False
+        self._data = None
+        self._count = 0
+
+    def _load(self):
+        """Map the index file on first use so app startup never touches it"""
+        with self._lock:
+            if self._loaded:
+                return
+            self._loaded = True
+            try:
+                with open(self.path, 'rb') as f:
+                    data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            except (OSError, ValueError):
+                # Missing or empty file - every lookup falls back to the API
+                return
+
+            magic, count = HEADER.unpack_from(data, 0)
+            if magic != MAGIC or len(data) < HEADER.size + count * RECORD.size:
+                data.close()
+                return
+            self._data = data
+            self._count = count
+
+    def __len__(self) -> int:
+        if not self._loaded:
+            self._load()
+        return self._count
+
+    def lookup(self, code: str) -> Optional[Tuple[float, float]]:
+        """Return (lat, lon) for an outward code, or None if it is unknown"""
+        if not self._loaded:
+            self._load()
+        if not self._count or not code or len(code) > 4:
+            return None
+
+        key = code.upper().encode('ascii', 'ignore').ljust(4, b'\0')
+        data = self._data
+        lo, hi = 0, self._count
+        while lo < hi:
+            mid = (lo + hi) // 2
+            offset = HEADER.size + mid * RECORD.size
+            probe = data[offset:offset + 4]
+            if probe < key:
+                lo = mid + 1
+            elif probe > key:
+                hi = mid
+            else:
+                _, lat, lon = RECORD.unpack_from(data, offset)
+                # Stored as float32 - trim the representation noise
+                return round(lat, 4), round(lon, 4)
+        return None
+
+
+# Rough bounding box of the UK, Channel Islands and Isle of Man - source
+# files mark postcodes without coordinates with values outside it
+UK_BOUNDS = ((49.0, 61.5), (-9.0, 2.5))
+
+
+def build_index(rows: Iterable[Tuple[str, float, float]], path: str) -> int:
+    """Write (code, lat, lon) rows to a sorted binary index of outward-code centroids
+
+    Codes may be outward codes or full postcodes; every row is averaged into
+    its outward code, so a file of full postcodes gives district centroids.
+    """
+    (min_lat, max_lat), (min_lon, max_lon) = UK_BOUNDS
+    totals = {}
+    for code, lat, lon in rows:
+        code = outward_code(code)
+        if code is None or not (min_lat < lat < max_lat and min_lon < lon < max_lon):
+            continue
+        total = totals.setdefault(code.encode('ascii').ljust(4, b'\0'), [0.0, 0.0, 0])
+        total[0] += lat
+        total[1] += lon
+        total[2] += 1
+    records = {key: (lat / count, lon / count) for key, (lat, lon, count) in totals.items()}
+
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, 'wb') as f:
+        f.write(HEADER.pack(MAGIC, len(records)))
+        for key in sorted(records):
+            f.write(RECORD.pack(key, *records[key]))
+    os.replace(tmp_path, path)
+    return len(records)
+
+
+def read_centroid_csv(path: str):
+    """Yield (outcode, lat, lon) from a centroid CSV with a header row"""
+    with open(path, newline='', encoding='utf-8-sig') as f:
+        reader = csv.DictReader(f)
+        fields = {name.lower(): name for name in reader.fieldnames or []}
+        code_col = fields.get('outcode') or fields.get('postcode')
+        lat_col = fields.get('latitude') or fields.get('lat')
+        lon_col = fields.get('longitude') or fields.get('lon')
+        if not (code_col and lat_col and lon_col):
+            raise ValueError("CSV needs outcode/postcode, latitude and longitude columns")
+
+        for row in reader:
+            try:
+                yield row[code_col], float(row[lat_col]), float(row[lon_col])
+            except (TypeError, ValueError):
+                continue
+
+
+# Global instance - the file is only opened on the first lookup
+outcode_index = OutcodeIndex()
+
+
+if __name__ == "__main__":
+    if len(sys.argv) not in (2, 3):
+        print("Usage: python outcode_index.py <postcodes.csv> [output.bin]")
+        sys.exit(1)
+
+    output = sys.argv[2] if len(sys.argv) == 3 else DEFAULT_INDEX_PATH
+    count = build_index(read_centroid_csv(sys.argv[1]), output)
+    print(f"Wrote {count} outward codes to {output}")
@@ -0,0 +1,277 @@
+# roster.py - Player roster CSV import and validation
+import codecs
+import csv
+import re
+from itertools import takewhile
+
+# Allow only alphanumeric, spaces, hyphens, apostrophes, periods
+NAME_PATTERN = re.compile(r"^[a-zA-Z0-9\s\-'.]+$")
+
+# Fast path for the common case: single-spaced words with no dangerous
+# characters. Anything else goes through validate_player_name for its message
+SAFE_NAME_PATTERN = re.compile(r"[a-zA-Z0-9'.]+(?: [a-zA-Z0-9'.]+)*")
+
+# Leading characters a spreadsheet would treat as a formula
+FORMULA_PREFIXES = ('=', '+', '-', '@', '\t', '\r')
+
+# Canonical spellings of valid grades and round limits
+GRADES = {str(grade): grade for grade in range(1, 5)}
+ROUND_LIMITS = {str(rounds): rounds for rounds in range(1, 11)}
+
+MAX_CSV_BYTES = 1024 * 1024  # 1MB limit for CSV
+MAX_IMPORT_ROWS = 100
+
+def sanitize_csv_field(field_value):
+    """Sanitize CSV field to prevent formula injection"""
+    if not field_value:
+        return field_value
+
+    field_value = str(field_value).strip()
+
+    # Remove any quotes that might hide formulas
+    field_value = field_value.strip('"\'')
+
+    # If field starts with dangerous characters, prefix with single quote to neutralize
+    if field_value and field_value[0] in FORMULA_PREFIXES:
+        field_value = "'" + field_value
+
+    return field_value
+
+def validate_player_name(name):
+    """Enhanced player name validation with security checks"""
+    if not name or len(name.strip()) == 0:
+        return False, "Player name cannot be empty"
+
+    name = name.strip()
+
+    if len(name) > 50:
+        return False, "Player name too long (max 50 characters)"
+
+    # Check for dangerous CSV injection characters
+    dangerous_chars = ['=', '+', '-', '@', '\t', '\r', '\n']
+    if any(char in name for char in dangerous_chars):
+        return False, "Player name contains potentially dangerous characters"
+
+    if not NAME_PATTERN.match(name):
+        return False, "Player name contains invalid characters"
+
+    # Additional checks
+    if name.startswith(' ') or name.endswith(' '):
+        return False, "Player name cannot start or end with spaces"
+
+    if '  ' in name:  # Multiple consecutive spaces
+        return False, "Player name cannot contain multiple consecutive spaces"
+
+    return True, ""
+
+def validate_csv_file(file):
+    """Enhanced CSV file validation with security checks"""
+    if not file:
+        return False, "No file provided"
+
+    if not file.filename:
+        return False, "No file selected"
+
+    # Check file extension
+    if not file.filename.lower().endswith('.csv'):
+        return False, "File must have .csv extension"
+
+    # Check file size (already limited by MAX_CONTENT_LENGTH, but double-check)
+    file.seek(0, 2)  # Seek to end
+    size = file.tell()
+    file.seek(0)  # Reset
+
+    if size > MAX_CSV_BYTES:
+        return False, "CSV file too large (max 1MB)"
+
+    if size == 0:
+        return False, "CSV file is empty"
+
+    # Basic content validation
+    try:
+        # Read first 1KB to check if it's valid UTF-8 text
+        file_sample = file.read(min(1024, size))
+        file.seek(0)  # Reset
+
+        try:
+            # Incremental so a character split by the 1KB cut is not an error
+            codecs.getincrementaldecoder('utf-8')().decode(file_sample, final=False)
+        except UnicodeDecodeError:
+            return False, "File does not appear to be a valid text file"
+
+    except Exception:
+        return False, "Error reading file"
+
+    return True, ""
+
+def iter_csv_rows(stream, columns=('name', 'grade', 'max_rounds')):
+    """Stream sanitized rows from a binary CSV upload in a single pass
+
+    Bytes are decoded line by line as the csv module asks for them, so the
+    upload is never held in memory as one string. Yields the header once
+    (the list of column names), then (row number, {column: sanitized value})
+    for each non-blank row. Only the requested columns are sanitized.
+    """
+    reader = csv.reader(codecs.iterdecode(stream, 'utf-8-sig'))
+
+    header = next(reader, None)
+    fieldnames = [sanitize_csv_field(name) or '' for name in header or []]
+    yield fieldnames
+
+    positions = [(column, fieldnames.index(column)) for column in columns if column in fieldnames]
+    for row_num, fields in enumerate(filter(None, reader), start=2):
+        width = len(fields)
+        yield row_num, {column: sanitize_csv_field(fields[index]) if index < width else ''
+                        for column, index in positions}
+
+def parse_player_row(row):
+    """Validate one sanitized CSV row; returns (player, error)"""
+    name = str(row.get("name") or "").strip()
+    grade_str = str(row.get("grade") or "").strip()
+    max_rounds_str = str(row.get("max_rounds") or "").strip()
+
+    # Validate name with enhanced security
+    is_valid_name, name_error = validate_player_name(name)
+    if not is_valid_name:
+        return None, name_error
+
+    # Validate grade
+    try:
+        grade = int(grade_str.strip("'\""))  # Remove any quotes added by sanitization
+    except (ValueError, TypeError):
+        return None, "Invalid grade format"
+    if not (1 <= grade <= 4):
+        return None, "Grade must be between 1 and 4"
+
+    # Validate max_rounds (optional)
+    player = {"name": name, "grade": grade}
+    if max_rounds_str:
+        try:
+            max_rounds = int(max_rounds_str.strip("'\""))
+        except (ValueError, TypeError):
+            return None, "Invalid max_rounds format"
+        if not (1 <= max_rounds <= 10):
+            return None, "Max rounds must be between 1 and 10"
+        player["max_rounds"] = max_rounds
+
+    return player, ""
+
+class RosterIndex:
+    """Players keyed by casefolded name, in roster order
+
+    Built once from the session's player list so duplicate checks, lookups
+    and removals are O(1) instead of a scan per player.
+    """
+
+    def __init__(self, players=()):
+        self._players = {}
+        for player in players:
+            self._players.setdefault(self.key(player["name"]), player)
+
+    @staticmethod
+    def key(name):
+        return name.strip().casefold()
+
+    def __contains__(self, name):
+        return self.key(name) in self._players
+
+    def __len__(self):
+        return len(self._players)
+
+    def __iter__(self):
+        return iter(self._players.values())
+
+    def get(self, name):
+        return self._players.get(self.key(name))
+
+    def add(self, player):
+        """Add a player; False if the name is already taken"""
+        key = self.key(player["name"])
+        if key in self._players:
+            return False
+        self._players[key] = player
+        return True
+
+    def remove(self, name):
+        """Remove and return the player with this name, or None"""
+        return self._players.pop(self.key(name), None)
+
+    def to_list(self):
+        return list(self._players.values())
+
+def validate_roster(rows, roster=None):
+    """Validate a whole roster in one pass; returns (players, errors)
+
+    rows yields (row number, row dict) pairs such as iter_csv_rows produces.
+    Accepted players are added to roster (a RosterIndex, created if not
+    given) so duplicates within the batch are caught as well.
+    """
+    roster = RosterIndex() if roster is None else roster
+    players = []
+    errors = []
+
+    for row_num, row in rows:
+        name = str(row.get("name") or "").strip()
+        grade = GRADES.get(str(row.get("grade") or "").strip())
+        max_rounds_str = str(row.get("max_rounds") or "").strip()
+
+        # Canonical rows are checked with one regex and two dict lookups
+        if (grade and len(name) <= 50 and SAFE_NAME_PATTERN.fullmatch(name)
+                and (not max_rounds_str or max_rounds_str in ROUND_LIMITS)):
+            player = {"name": name, "grade": grade}
+            if max_rounds_str:
+                player["max_rounds"] = ROUND_LIMITS[max_rounds_str]
+        else:
+            player, row_error = parse_player_row(row)
+            if not player:
+                errors.append(f"Row {row_num}: {row_error}")
+                continue
+
+        if not roster.add(player):
+            errors.append(f"Row {row_num}: Player '{player['name']}' already exists")
+            continue
+        players.append(player)
+
+    return players, errors
+
+def process_csv_upload_secure(file, existing_players, max_rows=MAX_IMPORT_ROWS):
+    """Secure CSV upload processing with comprehensive validation
+
+    existing_players may be a list or a RosterIndex; an index passed in is
+    updated with the accepted players.
+    """
+    try:
+        # Validate file
+        is_valid, error_msg = validate_csv_file(file)
+        if not is_valid:
+            return [], error_msg
+
+        rows = iter_csv_rows(file.stream)
+
+        # Check for required columns
+        required_columns = ['name', 'grade']
+        fieldnames = next(rows)
+        if not all(col in fieldnames for col in required_columns):
+            return [], "CSV must have 'name' and 'grade' columns. Optional: 'max_rounds'"
+
+        # Limit players (plus header); duplicates are checked against the existing roster
+        limited_rows = takewhile(lambda item: item[0] <= max_rows + 2, rows)
+        if not isinstance(existing_players, RosterIndex):
+            existing_players = RosterIndex(existing_players)
+        new_players, errors = validate_roster(limited_rows, existing_players)
+        added_count = len(new_players)
+        skipped_count = len(errors)
+
+        # Prepare result message
+        if added_count > 0:
+            success_msg = f"Added {added_count} players"
+            if skipped_count > 0:
+                success_msg += f", skipped {skipped_count} invalid entries"
+            return new_players, success_msg
+        elif skipped_count > 0:
+            return [], f"No valid players found. Skipped {skipped_count} entries with errors."
+        else:
+            return [], "No players found in CSV file"
+
+    except Exception as e:
+        return [], "Error processing CSV file. Please check format and try again."
@@ -0,0 +1,492 @@
+# scheduler.py - Stateless scheduling jobs behind the JSON API
+import hashlib
+import json
+import os
+import secrets
+import threading
+import time
+from concurrent.futures import wait as futures_wait
+from typing import Dict, List, Optional, Tuple
+
+from exports import iter_rounds
+from roster import validate_roster
+from utils import (SCHEDULE_MAX_PLAYER_ROUNDS, SchedulerBusy, SchedulingTimeout, build_rounds,
+                   organize_matches, replace_round, reshuffle_single_round)
+
+MATCH_TYPES = ("singles", "doubles")
+
+# Reported for jobs cancelled before they ran, e.g. when the pool is reset
+CANCELLED_ERROR = "Scheduling was cancelled. Please try again."
+
+
+def parse_job(payload, limits: Dict, reshuffle: bool = False) -> Tuple[Optional[Dict], Optional[str]]:
+    """Validate one API job body; returns (job, error)
+
+    Players go through the same validation as CSV imports. A reshuffle job
+    also carries the schedule to change (as returned by the API) and the
+    round to reshuffle.
+    """
+    if not isinstance(payload, dict):
+        return None, "Each job must be a JSON object"
+
+    raw_players = payload.get("players")
+    if not isinstance(raw_players, list) or not all(isinstance(p, dict) for p in raw_players):
+        return None, "players must be a list of objects with 'name' and 'grade'"
+    if len(raw_players) > limits["max_players"]:
+        return None, f"Too many players (max {limits['max_players']})"
+    players, errors = validate_roster(enumerate(raw_players, start=1))
+    if errors:
+        return None, "Invalid players: " + "; ".join(error.replace("Row", "Player", 1) for error in errors[:10])
+
+    match_type = payload.get("match_type", "singles")
+    if match_type not in MATCH_TYPES:
+        return None, "match_type must be 'singles' or 'doubles'"
+    min_players = 2 if match_type == "singles" else 4
+    if len(players) < min_players:
+        return None, f"Need at least {min_players} players for {match_type} sessions"
+
+    try:
+        courts = int(payload.get("courts", 1))
+        num_matches = int(payload.get("num_matches", 1))
+    except (TypeError, ValueError):
+        return None, "courts and num_matches must be whole numbers"
+    if not 1 <= courts <= limits["max_courts"]:
+        return None, f"courts must be between 1 and {limits['max_courts']}"
+    if not 1 <= num_matches <= 10:
+        return None, "num_matches must be between 1 and 10"
+    if len(players) * num_matches > SCHEDULE_MAX_PLAYER_ROUNDS:
+        return None, "Schedule too large. Please use fewer rounds."
+
+    job = {"players": players, "courts": courts, "match_type": match_type, "num_matches": num_matches}
+    if not reshuffle:
+        return job, None
+
+    try:
+        job["round"] = int(payload.get("round"))
+    except (TypeError, ValueError):
+        return None, "round must be a whole number"
+    matchups, error = parse_schedule(payload.get("rounds"), players, courts)
+    if error:
+        return None, error
+    if not any(round_num == job["round"] for court in matchups for _, round_num in court):
+        return None, f"Round {job['round']} is not in the schedule"
+    job["matchups"] = matchups
+    return job, None
+
+
+def parse_schedule(rounds, players: List[Dict], courts: int) -> Tuple[Optional[List], Optional[str]]:
+    """Turn an API schedule back into court-major matchups of roster players"""
+    if not isinstance(rounds, list):
+        return None, "rounds must be the schedule returned by /api/v1/schedule"
+
+    by_name = {player["name"]: player for player in players}
+    matchups = [[] for _ in range(courts)]
+    try:
+        for entry in rounds:
+            round_num = int(entry["round"])
+            for match in entry["matches"]:
+                court = int(match["court"])
+                if not 1 <= court <= courts:
+                    return None, f"Court {court} is outside the {courts} courts given"
+                names = match["players"]
+                if len(names) not in (2, 4) or any(name not in by_name for name in names):
+                    return None, f"Round {round_num}, court {court} has unknown players"
+                matchups[court - 1].append(([by_name[name] for name in names], round_num))
+    except (KeyError, TypeError, ValueError):
+        return None, "rounds must be the schedule returned by /api/v1/schedule"
+    return matchups, None
+
+
+def schedule_response(players: List[Dict], rounds: Dict, match_counts: Dict) -> Dict:
+    """JSON-friendly schedule; matches list player names, side A first"""
+    return {
+        "rounds": [
+            {
+                "round": round_num,
+                "matches": [{"court": court_num, "players": [player["name"] for player in match]}
+                            for court_num, match in matches],
+                "sitting_out": [player["name"] for player in sitting_out]
+            }
+            for round_num, matches, sitting_out in iter_rounds(rounds, players)
+        ],
+        "match_counts": match_counts
+    }
+
+
+def compute_job(job: Dict, time_budget: float, start_by: float = None) -> Dict:
+    """Schedule one validated job in a worker process
+
+    Returns matchups, match_counts and rounds, or {"error": ...}. A job
+    still queued at start_by (wall-clock) is dropped without running, and a
+    running one stops at its time budget through the scheduler's deadline.
+    """
+    if start_by is not None and time.time() > start_by:
+        return {"error": "The scheduler is busy. Please try again in a moment."}
+    deadline = time.monotonic() + time_budget
+    players = job["players"]
+    try:
+        if "round" in job:
+            matchups = job["matchups"]
+            new_round_matches = reshuffle_single_round(
+                players, job["courts"], job["match_type"], job["round"],
+                matchups, build_rounds(matchups), deadline
+            )
+            if new_round_matches is None:
+                return {"error": f"Unable to reshuffle round {job['round']} - not enough available players"}
+            match_counts, rounds = replace_round(players, matchups, job["round"], new_round_matches)
+        else:
+            matchups, match_counts, _, _ = organize_matches(
+                players, job["courts"], job["match_type"], job["num_matches"], deadline
+            )
+            rounds = build_rounds(matchups)
+    except SchedulingTimeout:
+        return {"error": "Scheduling took too long. Please try fewer courts or rounds."}
+    return {"matchups": matchups, "match_counts": match_counts, "rounds": rounds}
+
+
+def run_job(job: Dict, time_budget: float, start_by: float = None) -> Dict:
+    """compute_job with the result shaped for the JSON API"""
+    result = compute_job(job, time_budget, start_by)
+    if "error" in result:
+        return result
+    return schedule_response(job["players"], result["rounds"], result["match_counts"])
+
+
+def schedule_fingerprint(players: List[Dict], courts: int, match_type: str, num_matches: int) -> str:
+    """Digest of everything a schedule depends on - roster order included"""
+    document = json.dumps([players, courts, match_type, num_matches], sort_keys=True, separators=(',', ':'))
+    return hashlib.sha256(document.encode()).hexdigest()
+
+
+class ScheduleCache:
+    """Finished schedules waiting to be adopted into a session, by token
+
+    A schedule streamed to the page is computed outside the POST that saves
+    it. The stream stores the result here under a random token together
+    with the fingerprint of its inputs, and the follow-up POST adopts it
+    only if its own roster and settings still have that fingerprint.
+    Entries live for ttl seconds and are taken at most once.
+    """
+
+    def __init__(self, ttl: float = None, max_entries: int = None):
+        self.ttl = ttl or float(os.getenv("SCHEDULE_CACHE_TTL", "300"))
+        self.max_entries = max_entries or int(os.getenv("SCHEDULE_CACHE_ENTRIES", "256"))
+        self._entries = {}  # token -> (fingerprint, result, stored)
+        self._lock = threading.Lock()
+
+    def put(self, fingerprint: str, result: Dict) -> str:
+        token = secrets.token_urlsafe(16)
+        now = time.monotonic()
+        with self._lock:
+            for stale in [key for key, entry in self._entries.items() if now - entry[2] > self.ttl]:
+                del self._entries[stale]
+            while len(self._entries) >= self.max_entries:
+                # Dicts keep insertion order, so this drops the oldest entry
+                del self._entries[next(iter(self._entries))]
+            self._entries[token] = (fingerprint, result, now)
+        return token
+
+    def take(self, token: str, fingerprint: str) -> Optional[Dict]:
+        """The cached result if the token is live and the inputs still match"""
+        with self._lock:
+            entry = self._entries.pop(token, None)
+        if entry is None or entry[0] != fingerprint or time.monotonic() - entry[2] > self.ttl:
+            return None
+        return entry[1]
+
+
+class SchedulerService:
+    """Bounded process pool for scheduling jobs, with job ids for polling
+
+    Scheduling is pure CPU work, so it runs in worker processes and never
+    on a web thread. At most max_queue jobs may be queued or running;
+    beyond that submit raises SchedulerBusy, which the views turn into a
+    429. Each job must start within queue_timeout and finish within its
+    time budget, and finished jobs are kept for job_ttl seconds. Workers
+    stop at their own deadline; one still running kill_grace seconds after
+    that is stuck, so the pool is torn down and its processes terminated.
+    """
+
+    def __init__(self, workers: int = None, max_queue: int = None, max_batch: int = None):
+        self.workers = workers or int(os.getenv("SCHEDULER_WORKERS", str(min(4, os.cpu_count() or 1))))
+        self.max_queue = max_queue or int(os.getenv("SCHEDULER_MAX_QUEUE", str(self.workers * 4)))
+        self.max_batch = min(max_batch or int(os.getenv("API_MAX_BATCH_JOBS", "16")), self.max_queue)
+        self.queue_timeout = float(os.getenv("SCHEDULER_QUEUE_TIMEOUT", "10"))
+        self.job_ttl = float(os.getenv("SCHEDULER_JOB_TTL", "300"))
+        self.kill_grace = float(os.getenv("SCHEDULER_KILL_GRACE", "5"))
+        self.limits = {
+            "max_players": int(os.getenv("API_MAX_PLAYERS", "100")),
+            "max_courts": int(os.getenv("API_MAX_COURTS", "20")),
+            "time_budget": float(os.getenv("API_TIME_BUDGET", "5"))
+        }
+        # Speculative jobs each user may have running at once; 0 turns speculation off
+        self.speculative_per_user = int(os.getenv("SCHEDULER_SPECULATIVE_PER_USER", "2"))
+        # Speculative jobs across all users, since owner ids cost a client nothing;
+        # kept below the worker count so one worker is always free for real requests
+        self.speculative_max = min(int(os.getenv("SCHEDULER_SPECULATIVE_MAX", str(max(1, self.workers // 2)))),
+                                   self.workers - 1)
+        self._pool = None
+        self._jobs = {}  # job id -> {"future", "pool", "expires", "finished"}
+        self._speculative = {}  # owner -> [(fingerprint, job id), ...]
+        self._deferred = {}  # owner -> (fingerprint, job, time budget) waiting for a free slot
+        self._lock = threading.Lock()
+
+    def _get_pool(self):
+        if self._pool is None:
+            # multiprocessing is only imported once scheduling is first needed
+            from concurrent.futures import ProcessPoolExecutor
+            self._pool = ProcessPoolExecutor(max_workers=self.workers)
+        return self._pool
+
+    def _reset_pool(self):
+        """Drop a pool whose worker died so the next job starts a fresh one"""
+        with self._lock:
+            if self._pool is not None:
+                self._pool.shutdown(wait=False, cancel_futures=True)
+                self._pool = None
+
+    def _kill_overdue(self, now: float):
+        """Terminate the pool if a job has run past its deadline plus kill_grace
+
+        shutdown() never stops a running task, so the workers are killed
+        outright, or just abandoned if the executor's internals are not as
+        expected. Other jobs on the pool fail or are cancelled, and the next
+        job starts a fresh pool. Called with the lock held.
+        """
+        pool = self._pool
+        if pool is None or not any(
+                record["pool"] is pool and not record["future"].done()
+                and now > record["expires"] + self.kill_grace
+                for record in self._jobs.values()):
+            return
+        # ProcessPoolExecutor has no public way to reach its workers, so this
+        # relies on the CPython internal _processes ({pid: Process})
+        processes = getattr(pool, "_processes", None)
+        processes = list(processes.values()) if isinstance(processes, dict) else None
+        pool.shutdown(wait=False, cancel_futures=True)
+        self._pool = None
+        if processes is None:
+            # Internals changed - abandon the pool so new jobs get fresh workers
+            print("Warning: cannot reach scheduler workers to stop an overdue job; starting a new pool")
+            return
+        for process in processes:
+            if hasattr(process, "terminate"):
+                process.terminate()
+
+    def _check_overdue(self):
+        with self._lock:
+            self._kill_overdue(time.monotonic())
+
+    def _prune(self, now: float):
+        """Forget finished jobs older than job_ttl; called with the lock held"""
+        for job_id in [job_id for job_id, record in self._jobs.items()
+                       if record["finished"] and now - record["finished"] > self.job_ttl]:
+            del self._jobs[job_id]
+        for owner in [owner for owner, entries in self._speculative.items()
+                      if not any(job_id in self._jobs for _, job_id in entries)]:
+            del self._speculative[owner]
+
+    def pending(self) -> int:
+        """Jobs queued or running"""
+        with self._lock:
+            return sum(1 for record in self._jobs.values() if not record["future"].done())
+
+    def submit(self, jobs: List[Dict], time_budget: float = None, worker=run_job) -> List[str]:
+        """Queue validated jobs; returns their ids
+
+        All or nothing - raises SchedulerBusy if the queue has no room for
+        every job.
+        """
+        time_budget = time_budget or self.limits["time_budget"]
+        now = time.monotonic()
+        with self._lock:
+            self._prune(now)
+            self._kill_overdue(now)
+            running = sum(1 for record in self._jobs.values() if not record["future"].done())
+            if running + len(jobs) > self.max_queue:
+                raise SchedulerBusy(f"Scheduler queue is full ({self.max_queue} jobs)")
+
+            pool = self._get_pool()
+            job_ids = []
+            for job in jobs:
+                job_id = secrets.token_urlsafe(12)
+                future = pool.submit(worker, job, time_budget, time.time() + self.queue_timeout)
+                record = {"future": future, "pool": pool, "expires": now + self.queue_timeout + time_budget + 1, "finished": None}
+                future.add_done_callback(lambda _, record=record: record.update(finished=time.monotonic()))
+                self._jobs[job_id] = record
+                job_ids.append(job_id)
+        return job_ids
+
+    def status(self, job_id: str, wait: float = 0) -> Optional[Dict]:
+        """Job state, waiting up to wait seconds for it to finish (long-poll)
+
+        Returns None for an unknown or forgotten job id.
+        """
+        with self._lock:
+            record = self._jobs.get(job_id)
+        if record is None:
+            return None
+
+        future = record["future"]
+        wait = min(wait, max(0, record["expires"] - time.monotonic()))
+        if wait > 0:
+            futures_wait([future], timeout=wait)
+
+        if future.cancelled():
+            return {"job_id": job_id, "status": "cancelled",
+                    "error": CANCELLED_ERROR}
+        if future.done():
+            from concurrent.futures.process import BrokenProcessPool
+            try:
+                result = future.result()
+            except BrokenProcessPool:
+                self._reset_pool()
+                return {"job_id": job_id, "status": "failed", "error": "Scheduler workers are unavailable. Please try again."}
+            if "error" in result:
+                return {"job_id": job_id, "status": "failed", "error": result["error"]}
+            return {"job_id": job_id, "status": "done", "result": result}
+        if time.monotonic() > record["expires"]:
+            # The worker should stop at its own deadline; if it is still going
+            # after kill_grace its pool is killed
+            if not future.cancel() and not record.get("reaping"):
+                record["reaping"] = True
+                timer = threading.Timer(self.kill_grace, self._check_overdue)
+                timer.daemon = True
+                timer.start()
+            return {"job_id": job_id, "status": "failed",
+                    "error": "Scheduling took too long. Please try fewer courts or rounds."}
+        return {"job_id": job_id, "status": "running" if future.running() else "queued"}
+
+    def cancel(self, job_id: str) -> Optional[bool]:
+        """Cancel a queued job; False once it has started, None if unknown"""
+        with self._lock:
+            record = self._jobs.get(job_id)
+        return record["future"].cancel() if record else None
+
+    def run(self, job: Dict, time_budget: float = None, worker=run_job) -> Dict:
+        """Submit one job and wait for its result, or {"error": ...}"""
+        job_id, = self.submit([job], time_budget, worker)
+        status = self.status(job_id, wait=float("inf"))
+        return status["result"] if status["status"] == "done" else {"error": status.get("error", CANCELLED_ERROR)}
+
+    def speculate(self, owner: str, fingerprint: str, job: Dict, time_budget: float = None) -> bool:
+        """Start computing a schedule the user is likely to ask for next
+
+        Called after roster or settings changes. Earlier guesses for the
+        owner with another fingerprint are cancelled if they have not
+        started; ones already running finish on their own deadline but
+        count towards speculative_per_user. While the owner is at that cap
+        only the latest guess is kept, and it starts when a slot frees up.
+        At most speculative_max guesses run across all owners, and never
+        more than half the queue, so speculation cannot cause a 429 for
+        real requests. Returns True if a job was started.
+        """
+        if self.speculative_per_user <= 0 or self.speculative_max <= 0:
+            return False
+        with self._lock:
+            self._deferred.pop(owner, None)
+            entries = [(fp, job_id) for fp, job_id in self._speculative.get(owner, []) if job_id in self._jobs]
+            if any(fp == fingerprint for fp, _ in entries):
+                self._speculative[owner] = entries
+                return False  # already computed or computing
+            live = [(fp, job_id) for fp, job_id in entries
+                    if not self._jobs[job_id]["future"].done() and not self._jobs[job_id]["future"].cancel()]
+            self._speculative[owner] = live
+            if len(live) >= self.speculative_per_user:
+                self._deferred[owner] = (fingerprint, job, time_budget)
+                return False
+            pending = sum(1 for record in self._jobs.values() if not record["future"].done())
+            if pending >= self.max_queue // 2:
+                return False
+            speculating = sum(1 for entries in self._speculative.values() for _, job_id in entries
+                              if job_id in self._jobs and not self._jobs[job_id]["future"].done())
+            if speculating >= self.speculative_max:
+                return False
+
+        try:
+            job_id, = self.submit([job], time_budget, worker=compute_job)
+        except SchedulerBusy:
+            return False
+        with self._lock:
+            self._speculative.setdefault(owner, []).append((fingerprint, job_id))
+            future = self._jobs[job_id]["future"]
+        # Callbacks run on the pool's management thread, so resubmit from a thread of our own
+        future.add_done_callback(
+            lambda _: threading.Thread(target=self._resume_deferred, args=(owner,), daemon=True).start()
+        )
+        return True
+
+    def _resume_deferred(self, owner: str):
+        """Start the guess that was waiting for one of the owner's slots"""
+        with self._lock:
+            deferred = self._deferred.pop(owner, None)
+        if deferred:
+            self.speculate(owner, *deferred)
+
+    def take_speculative(self, owner: str, fingerprint: str) -> Optional[Dict]:
+        """The owner's speculative result for this fingerprint, waiting if it is still running
+
+        Returns None on a miss. Every other guess for the owner is cancelled.
+        """
+        with self._lock:
+            entries = self._speculative.pop(owner, [])
+            self._deferred.pop(owner, None)
+        match = None
+        for fp, job_id in entries:
+            if fp == fingerprint and match is None:
+                match = job_id
+            else:
+                self.cancel(job_id)
+        if match is None:
+            return None
+        status = self.status(match, wait=float("inf"))
+        return status["result"] if status and status["status"] == "done" else None
+
+    def schedule(self, payload, reshuffle: bool = False) -> Dict:
+        """Validate one API job and wait for its result"""
+        job, error = parse_job(payload, self.limits, reshuffle)
+        if error:
+            return {"error": error}
+        return self.run(job)
+
+    def schedule_async(self, payload) -> Dict:
+        """Validate and queue one API job; returns its id for polling"""
+        job, error = parse_job(payload, self.limits, reshuffle=isinstance(payload, dict) and "round" in payload)
+        if error:
+            return {"error": error}
+        job_id, = self.submit([job])
+        return {"job_id": job_id, "status": "queued"}
+
+    def schedule_batch(self, payloads) -> Dict:
+        """Run independent jobs in parallel; results come back in request order
+
+        Invalid jobs get their error in place and do not stop the others.
+        """
+        if not isinstance(payloads, list) or not payloads:
+            return {"error": "jobs must be a non-empty list"}
+        if len(payloads) > self.max_batch:
+            return {"error": f"Too many jobs (max {self.max_batch})"}
+
+        results: List[Optional[Dict]] = [None] * len(payloads)
+        valid = {}
+        for index, payload in enumerate(payloads):
+            job, error = parse_job(payload, self.limits, reshuffle=isinstance(payload, dict) and "round" in payload)
+            if error:
+                results[index] = {"error": error}
+            else:
+                valid[index] = job
+
+        job_ids = self.submit(list(valid.values())) if valid else []
+        for index, job_id in zip(valid, job_ids):
+            status = self.status(job_id, wait=float("inf"))
+            results[index] = status["result"] if status["status"] == "done" else {"error": status.get("error", CANCELLED_ERROR)}
+
+        for payload, result in zip(payloads, results):
+            if isinstance(payload, dict) and "id" in payload:
+                result["id"] = payload["id"]
+        return {"results": results}
+
+
+# Global instances - worker processes are started on the first job
+scheduler = SchedulerService()
+streamed_schedules = ScheduleCache()
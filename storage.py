@@ -0,0 +1,296 @@
+# storage.py - Server-side SQLite storage for state too large for the session cookie
+import json
+import os
+import secrets
+import sqlite3
+import threading
+import time
+from abc import ABC, abstractmethod
+from typing import Dict, List, Optional
+
+
+class SQLiteStore(ABC):
+    """Embedded SQLite database with a connection per thread
+
+    Subclasses create their tables in _create_schema, which runs once on
+    first use, so importing the module never touches the filesystem.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._local = threading.local()
+        self._schema_lock = threading.Lock()
+        self._schema_ready = False
+
+    def _connect(self) -> sqlite3.Connection:
+        """Per-thread connection; the schema is created on first use"""
+        connection = getattr(self._local, "connection", None)
+        if connection is None:
+            connection = sqlite3.connect(self.path, timeout=5)
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute("PRAGMA synchronous=NORMAL")
+            connection.execute("PRAGMA foreign_keys=ON")
+            self._local.connection = connection
+
+        if not self._schema_ready:
+            with self._schema_lock:
+                if not self._schema_ready:
+                    self._create_schema(connection)
+                    self._schema_ready = True
+        return connection
+
+    @abstractmethod
+    def _create_schema(self, connection: sqlite3.Connection):
+        """Create the store's tables and indexes if they do not exist"""
+
+
+class EventStore(SQLiteStore):
+    """Roster and schedule state for large events, keyed by an event id
+
+    The session cookie only carries the event id. State is kept as one JSON
+    document per event, and events untouched for longer than the TTL are
+    purged.
+    """
+
+    def __init__(self, path: str = None, ttl: int = None, max_bytes: int = None):
+        super().__init__(path or os.getenv("EVENT_DB_PATH", "events.db"))
+        self.ttl = ttl if ttl is not None else int(os.getenv("EVENT_TTL", "86400"))
+        self.max_bytes = max_bytes if max_bytes is not None else int(os.getenv("EVENT_MAX_BYTES", str(2 * 1024 * 1024)))
+        self._last_purge = 0.0
+
+    def _create_schema(self, connection: sqlite3.Connection):
+        with connection:
+            connection.execute(
+                "CREATE TABLE IF NOT EXISTS events ("
+                " id TEXT PRIMARY KEY,"
+                " state TEXT NOT NULL,"
+                " updated REAL NOT NULL)"
+            )
+            connection.execute("CREATE INDEX IF NOT EXISTS events_updated ON events (updated)")
+
+    def create(self, state: Dict = None) -> str:
+        """Store a new event and return its id"""
+        event_id = secrets.token_urlsafe(16)
+        self.save(event_id, state or {})
+        return event_id
+
+    def load(self, event_id: str) -> Optional[Dict]:
+        """State for an event, or None if unknown or expired"""
+        row = self._connect().execute(
+            "SELECT state FROM events WHERE id = ? AND updated >= ?",
+            (event_id, time.time() - self.ttl)
+        ).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def version(self, event_id: str) -> Optional[float]:
+        """When an event was last saved, or None if unknown or expired - cheaper than load"""
+        row = self._connect().execute(
+            "SELECT updated FROM events WHERE id = ? AND updated >= ?",
+            (event_id, time.time() - self.ttl)
+        ).fetchone()
+        return row[0] if row else None
+
+    def save(self, event_id: str, state: Dict):
+        """Replace an event's state; raises ValueError above max_bytes"""
+        document = json.dumps(state, separators=(',', ':'))
+        if len(document) > self.max_bytes:
+            raise ValueError(f"Event state too large ({len(document) // 1024} KB)")
+
+        connection = self._connect()
+        with connection:
+            connection.execute(
+                "INSERT OR REPLACE INTO events (id, state, updated) VALUES (?, ?, ?)",
+                (event_id, document, time.time())
+            )
+        self._purge_expired()
+
+    def delete(self, event_id: str):
+        connection = self._connect()
+        with connection:
+            connection.execute("DELETE FROM events WHERE id = ?", (event_id,))
+
+    def _purge_expired(self):
+        """Drop stale events at most once a minute"""
+        now = time.time()
+        if now - self._last_purge < 60:
+            return
+        self._last_purge = now
+        connection = self._connect()
+        with connection:
+            connection.execute("DELETE FROM events WHERE updated < ?", (now - self.ttl,))
+
+
+class RosterLibrary(SQLiteStore):
+    """Saved rosters per owner, stored validated and one row per player
+
+    Rosters are unique per owner by casefolded name, and that unique index
+    also serves listing an owner's rosters. Loading a roster is one indexed
+    join read straight into player dicts. Players are keyed by casefolded
+    name within a roster, so single-player edits touch one row.
+    """
+
+    def __init__(self, path: str = None, max_rosters: int = None):
+        super().__init__(path or os.getenv("ROSTER_DB_PATH", "rosters.db"))
+        self.max_rosters = max_rosters if max_rosters is not None else int(os.getenv("ROSTER_LIBRARY_MAX_ROSTERS", "20"))
+
+    def _create_schema(self, connection: sqlite3.Connection):
+        with connection:
+            connection.execute(
+                "CREATE TABLE IF NOT EXISTS rosters ("
+                " id INTEGER PRIMARY KEY,"
+                " owner TEXT NOT NULL,"
+                " name TEXT NOT NULL,"
+                " name_key TEXT NOT NULL,"
+                " updated REAL NOT NULL,"
+                " UNIQUE (owner, name_key))"
+            )
+            connection.execute(
+                "CREATE TABLE IF NOT EXISTS roster_players ("
+                " roster_id INTEGER NOT NULL REFERENCES rosters (id) ON DELETE CASCADE,"
+                " name_key TEXT NOT NULL,"
+                " position INTEGER NOT NULL,"
+                " name TEXT NOT NULL,"
+                " grade INTEGER NOT NULL,"
+                " max_rounds INTEGER,"
+                " PRIMARY KEY (roster_id, name_key)) WITHOUT ROWID"
+            )
+            connection.execute(
+                "CREATE INDEX IF NOT EXISTS roster_players_position ON roster_players (roster_id, position)"
+            )
+
+    @staticmethod
+    def _key(name: str) -> str:
+        return name.strip().casefold()
+
+    @staticmethod
+    def _rows(roster_id: int, players: List[Dict], start: int = 0):
+        for position, player in enumerate(players, start=start):
+            yield (roster_id, RosterLibrary._key(player["name"]), position,
+                   player["name"], player["grade"], player.get("max_rounds"))
+
+    def _roster_id(self, connection: sqlite3.Connection, owner: str, name: str) -> Optional[int]:
+        row = connection.execute(
+            "SELECT id FROM rosters WHERE owner = ? AND name_key = ?", (owner, self._key(name))
+        ).fetchone()
+        return row[0] if row else None
+
+    def _touch(self, connection: sqlite3.Connection, roster_id: int):
+        connection.execute("UPDATE rosters SET updated = ? WHERE id = ?", (time.time(), roster_id))
+
+    def list_rosters(self, owner: str) -> List[Dict]:
+        """An owner's rosters with player counts, most recently used first"""
+        rows = self._connect().execute(
+            "SELECT r.name, COUNT(p.name_key), r.updated FROM rosters r"
+            " LEFT JOIN roster_players p ON p.roster_id = r.id"
+            " WHERE r.owner = ? GROUP BY r.id ORDER BY r.updated DESC",
+            (owner,)
+        ).fetchall()
+        return [{"name": name, "players": count, "updated": updated} for name, count, updated in rows]
+
+    def load(self, owner: str, name: str) -> Optional[List[Dict]]:
+        """Players of a saved roster in order, or None if there is no such roster"""
+        rows = self._connect().execute(
+            "SELECT p.name, p.grade, p.max_rounds FROM rosters r"
+            " LEFT JOIN roster_players p ON p.roster_id = r.id"
+            " WHERE r.owner = ? AND r.name_key = ? ORDER BY p.position",
+            (owner, self._key(name))
+        ).fetchall()
+        if not rows:
+            return None
+
+        players = []
+        for player_name, grade, max_rounds in rows:
+            if player_name is None:
+                break  # roster saved with no players
+            player = {"name": player_name, "grade": grade}
+            if max_rounds is not None:
+                player["max_rounds"] = max_rounds
+            players.append(player)
+        return players
+
+    def save(self, owner: str, name: str, players: List[Dict]):
+        """Create or replace a roster; players must already be validated
+
+        Raises ValueError when the owner already has max_rosters rosters.
+        """
+        connection = self._connect()
+        with connection:
+            roster_id = self._roster_id(connection, owner, name)
+            if roster_id is None:
+                count = connection.execute("SELECT COUNT(*) FROM rosters WHERE owner = ?", (owner,)).fetchone()[0]
+                if count >= self.max_rosters:
+                    raise ValueError(f"Roster library is full (max {self.max_rosters} rosters)")
+                roster_id = connection.execute(
+                    "INSERT INTO rosters (owner, name, name_key, updated) VALUES (?, ?, ?, ?)",
+                    (owner, name, self._key(name), time.time())
+                ).lastrowid
+            else:
+                connection.execute("DELETE FROM roster_players WHERE roster_id = ?", (roster_id,))
+                connection.execute("UPDATE rosters SET name = ?, updated = ? WHERE id = ?",
+                                   (name, time.time(), roster_id))
+            connection.executemany(
+                "INSERT OR IGNORE INTO roster_players (roster_id, name_key, position, name, grade, max_rounds)"
+                " VALUES (?, ?, ?, ?, ?, ?)",
+                self._rows(roster_id, players)
+            )
+
+    def delete(self, owner: str, name: str) -> bool:
+        connection = self._connect()
+        with connection:
+            return connection.execute(
+                "DELETE FROM rosters WHERE owner = ? AND name_key = ?", (owner, self._key(name))
+            ).rowcount > 0
+
+    def add_players(self, owner: str, name: str, players: List[Dict]) -> bool:
+        """Append players to a saved roster without rewriting it"""
+        connection = self._connect()
+        with connection:
+            roster_id = self._roster_id(connection, owner, name)
+            if roster_id is None:
+                return False
+            last = connection.execute(
+                "SELECT COALESCE(MAX(position), -1) FROM roster_players WHERE roster_id = ?", (roster_id,)
+            ).fetchone()[0]
+            connection.executemany(
+                "INSERT OR IGNORE INTO roster_players (roster_id, name_key, position, name, grade, max_rounds)"
+                " VALUES (?, ?, ?, ?, ?, ?)",
+                self._rows(roster_id, players, start=last + 1)
+            )
+            self._touch(connection, roster_id)
+        return True
+
+    def update_player(self, owner: str, name: str, player_name: str, **fields) -> bool:
+        """Change grade and/or max_rounds of one player in a saved roster"""
+        columns = {column: fields[column] for column in ("grade", "max_rounds") if column in fields}
+        if not columns:
+            return False
+        connection = self._connect()
+        with connection:
+            roster_id = self._roster_id(connection, owner, name)
+            if roster_id is None:
+                return False
+            assignments = ", ".join(f"{column} = ?" for column in columns)
+            updated = connection.execute(
+                f"UPDATE roster_players SET {assignments} WHERE roster_id = ? AND name_key = ?",
+                (*columns.values(), roster_id, self._key(player_name))
+            ).rowcount
+            self._touch(connection, roster_id)
+        return updated > 0
+
+    def remove_player(self, owner: str, name: str, player_name: str) -> bool:
+        connection = self._connect()
+        with connection:
+            roster_id = self._roster_id(connection, owner, name)
+            if roster_id is None:
+                return False
+            removed = connection.execute(
+                "DELETE FROM roster_players WHERE roster_id = ? AND name_key = ?",
+                (roster_id, self._key(player_name))
+            ).rowcount
+            self._touch(connection, roster_id)
+        return removed > 0
+
+
+# Global instances - database files are created on first use
+event_store = EventStore()
+roster_library = RosterLibrary()
@@ -1,8 +1,32 @@
 # utils.py - Tennis Match Organization Algorithm
+import os
 import random
+import time
 from collections import defaultdict
+from itertools import combinations
 
-def organize_matches(players, courts, match_type, num_matches):
+# A normal session's roster cap; reshuffles only search a window of
+# candidates for larger rosters (large events)
+SESSION_MAX_PLAYERS = int(os.getenv("SESSION_MAX_PLAYERS", "100"))
+
+# Doubles groups are searched among at most this many candidates (in
+# priority order); smaller pools still get the exhaustive search
+DOUBLES_WINDOW = int(os.getenv("SCHEDULER_DOUBLES_WINDOW", "12"))
+SINGLES_WINDOW = int(os.getenv("SCHEDULER_SINGLES_WINDOW", "40"))
+
+# The three ways to split four players into two teams
+DOUBLES_SPLITS = ((0, 1, 2, 3), (0, 2, 1, 3), (0, 3, 1, 2))
+
+# Memory guardrail - players x rounds a single schedule may hold
+SCHEDULE_MAX_PLAYER_ROUNDS = int(os.getenv("SCHEDULE_MAX_PLAYER_ROUNDS", "4000"))
+
+class SchedulingTimeout(Exception):
+    """Raised when scheduling runs past its deadline"""
+
+class SchedulerBusy(Exception):
+    """Raised when no scheduling slot is free for a large event"""
+
+def organize_matches(players, courts, match_type, num_matches, deadline=None):
     """
     Organize tennis matches based on player grades with support for limited-round players.
     
@@ -11,11 +35,48 @@ def organize_matches(players, courts, match_type, num_matches):
         courts: Number of available courts
         match_type: "singles" or "doubles"
         num_matches: Number of matches each player should play
+        deadline: Optional time.monotonic() value; SchedulingTimeout is
+            raised if a court is still being filled after it
         
     Returns:
         tuple: (matchups, match_counts, opponent_averages, opponent_diff)
     """
     matchups = [[] for _ in range(courts)]
+    for round_num, round_matches in iter_organize_rounds(players, courts, match_type, num_matches, deadline):
+        for court_num, match in round_matches:
+            matchups[court_num - 1].append((match, round_num))
+
+    match_counts = {p['name']: 0 for p in players}
+    opponent_grades = {p['name']: [] for p in players}
+    for court_matches in matchups:
+        for match, _ in court_matches:
+            for p in match:
+                match_counts[p['name']] += 1
+                opponent_grades[p['name']].extend(opp['grade'] for opp in match if opp['name'] != p['name'])
+
+    # Calculate opponent statistics
+    opponent_averages = {
+        name: round(sum(grades) / len(grades), 2) if grades else 0
+        for name, grades in opponent_grades.items()
+    }
+
+    grades = {p['name']: p['grade'] for p in players}
+    opponent_diff = {
+        name: round(abs(opponent_averages[name] - grades[name]), 2)
+        for name in opponent_averages
+    }
+
+    return matchups, match_counts, opponent_averages, opponent_diff
+
+def iter_organize_rounds(players, courts, match_type, num_matches, deadline=None):
+    """
+    Schedule rounds one at a time, yielding each as soon as it is complete.
+    
+    Takes the same arguments as organize_matches. Yields
+    (round number, [(court number, match), ...]) for rounds 1 to
+    num_matches; a round may be empty if nobody is left to play. Later
+    rounds are only computed as the caller asks for them.
+    """
     match_counts = {p['name']: 0 for p in players}
     played_matches = {p['name']: set() for p in players}
     opponent_grades = {p['name']: [] for p in players}
@@ -75,6 +136,47 @@ def organize_matches(players, courts, match_type, num_matches):
 
         return (best_group, best_match_key) if best_group else (None, None)
 
+    def find_fast_doubles_group(available, seen_matchups, last_court_groups):
+        """Best balanced group among the first DOUBLES_WINDOW candidates
+
+        Checks each 4-player combination once with its three team splits
+        instead of every ordered pair of pairs, and stops at a perfect match.
+        """
+        window = available[:DOUBLES_WINDOW]
+        best_group = None
+        best_diff = float('inf')
+        best_match_key = None
+
+        for quad in combinations(window, 4):
+            full_group = frozenset(p['name'] for p in quad)
+            if len(full_group) < 4 or any(full_group == last_court_groups.get(p['name']) for p in quad):
+                continue
+
+            for a, b, c, d in DOUBLES_SPLITS:
+                diff = abs(quad[a]['grade'] + quad[b]['grade'] - quad[c]['grade'] - quad[d]['grade']) / 2
+                if diff >= best_diff:
+                    continue
+                match_key = frozenset([frozenset([quad[a]['name'], quad[b]['name']]),
+                                       frozenset([quad[c]['name'], quad[d]['name']])])
+                if match_key in seen_matchups:
+                    continue
+                best_diff = diff
+                best_group = [quad[a], quad[b], quad[c], quad[d]]
+                best_match_key = match_key
+
+            if best_diff == 0:
+                break
+
+        if best_group is None and len(available) > len(window):
+            # Every group in the window was used before - widen the search
+            return find_doubles_group(available[len(window) // 2:], seen_matchups, last_court_groups)
+        return (best_group, best_match_key) if best_group else (None, None)
+
+    def find_doubles_group(available, seen_matchups, last_court_groups):
+        if len(available) > DOUBLES_WINDOW:
+            return find_fast_doubles_group(available, seen_matchups, last_court_groups)
+        return find_best_doubles_group(available, seen_matchups, last_court_groups)
+
     # Process rounds in order (1 to num_matches)
     for round_num in range(1, num_matches + 1):
         # Filter available players based on constraints
@@ -114,8 +216,12 @@ def organize_matches(players, courts, match_type, num_matches):
         
         used_names = set()
         new_round_groups = {p['name']: set() for p in players}
+        round_matches = []
 
         for court_index in range(courts):
+            if deadline is not None and time.monotonic() > deadline:
+                raise SchedulingTimeout(f"Scheduling stopped in round {round_num}")
+
             needed_players = 4 if match_type == "doubles" else 2
             if len(available_players) - len(used_names) < needed_players:
                 continue
@@ -123,7 +229,7 @@ def organize_matches(players, courts, match_type, num_matches):
             candidates = [p for p in available_players if p['name'] not in used_names]
 
             if match_type == "doubles":
-                group, match_key = find_best_doubles_group(
+                group, match_key = find_doubles_group(
                     candidates, seen_doubles_matchups, last_court_groups
                 )
                 if not group:
@@ -156,17 +262,184 @@ def organize_matches(players, courts, match_type, num_matches):
                         played_matches[p['name']].add(opp['name'])
                         opponent_grades[p['name']].append(opp['grade'])
 
-            matchups[court_index].append((pair, round_num))
+            round_matches.append((court_index + 1, pair))
 
-    # Calculate opponent statistics
-    opponent_averages = {
-        name: round(sum(grades) / len(grades), 2) if grades else 0
-        for name, grades in opponent_grades.items()
-    }
+        yield round_num, round_matches
 
-    opponent_diff = {
-        name: round(abs(opponent_averages[name] - next(p['grade'] for p in players if p['name'] == name)), 2)
-        for name in opponent_averages
-    }
+def reshuffle_single_round(players, courts, match_type, round_to_reshuffle, existing_matchups, existing_rounds, deadline=None):
+    """
+    Reshuffle a specific round while preserving other rounds. More flexible algorithm that allows multiple reshuffles.
+    Large-event rosters are searched in a window of the shuffled candidates; deadline works as in organize_matches.
+    """
+    # Find players available for this round
+    available_players = []
+    for player in players:
+        max_rounds = player.get('max_rounds', len(existing_rounds))
+        if round_to_reshuffle <= max_rounds:
+            available_players.append(player)
+    
+    if len(available_players) < (4 if match_type == "doubles" else 2):
+        return None  # Not enough players for reshuffling
+    
+    # Shuffle available players for maximum randomness
+    random.shuffle(available_players)
+    
+    # Track existing combinations from OTHER rounds (not the one we're reshuffling)
+    existing_combinations = set()
+    if match_type == "doubles":
+        for court_matches in existing_matchups:
+            for match, round_num in court_matches:
+                if round_num != round_to_reshuffle and len(match) == 4:
+                    # Store all possible team combinations
+                    names = [p['name'] for p in match]
+                    # Try different team splits
+                    team1 = frozenset([names[0], names[1]])
+                    team2 = frozenset([names[2], names[3]])
+                    existing_combinations.add(frozenset([team1, team2]))
+                    
+                    team1 = frozenset([names[0], names[2]])
+                    team2 = frozenset([names[1], names[3]])
+                    existing_combinations.add(frozenset([team1, team2]))
+                    
+                    team1 = frozenset([names[0], names[3]])
+                    team2 = frozenset([names[1], names[2]])
+                    existing_combinations.add(frozenset([team1, team2]))
+    else:  # singles
+        for court_matches in existing_matchups:
+            for match, round_num in court_matches:
+                if round_num != round_to_reshuffle and len(match) == 2:
+                    pair = frozenset([match[0]['name'], match[1]['name']])
+                    existing_combinations.add(pair)
+    
+    # Generate new matches for this round
+    new_round_matches = []
+    used_players = set()
+    
+    def grade_distance(g1, g2):
+        return abs(g1 - g2)
+    
+    def create_singles_match(candidates):
+        """Create a singles match, preferring new combinations"""
+        if len(candidates) < 2:
+            return None
+            
+        best_pair = None
+        best_score = float('inf')
+        
+        for i in range(len(candidates)):
+            for j in range(i+1, len(candidates)):
+                p1, p2 = candidates[i], candidates[j]
+                pair_key = frozenset([p1['name'], p2['name']])
+                
+                # Score this pairing
+                grade_diff = grade_distance(p1['grade'], p2['grade'])
+                
+                # Bonus for new combinations (but don't block old ones completely)
+                novelty_bonus = 0 if pair_key in existing_combinations else -2
+                
+                score = grade_diff + novelty_bonus
+                
+                if score < best_score:
+                    best_score = score
+                    best_pair = [p1, p2]
+                    # A new pairing of equal grades cannot be beaten
+                    if best_score == -2:
+                        return best_pair
+        
+        return best_pair
+    
+    def create_doubles_match(candidates):
+        """Create a doubles match, preferring new combinations"""
+        if len(candidates) < 4:
+            return None
+            
+        best_group = None
+        best_score = float('inf')
+        
+        # Try different combinations of 4 players
+        for i in range(len(candidates)):
+            for j in range(i+1, len(candidates)):
+                for k in range(len(candidates)):
+                    for l in range(k+1, len(candidates)):
+                        if len(set([i, j, k, l])) != 4:
+                            continue
+                            
+                        group = [candidates[i], candidates[j], candidates[k], candidates[l]]
+                        
+                        # Try this as team1 vs team2
+                        team1 = [group[0], group[1]]
+                        team2 = [group[2], group[3]]
+                        
+                        team1_avg = (team1[0]['grade'] + team1[1]['grade']) / 2
+                        team2_avg = (team2[0]['grade'] + team2[1]['grade']) / 2
+                        grade_diff = abs(team1_avg - team2_avg)
+                        
+                        # Check if this combination exists
+                        team1_names = frozenset([team1[0]['name'], team1[1]['name']])
+                        team2_names = frozenset([team2[0]['name'], team2[1]['name']])
+                        match_key = frozenset([team1_names, team2_names])
+                        
+                        # Bonus for new combinations
+                        novelty_bonus = 0 if match_key in existing_combinations else -3
+                        
+                        score = grade_diff + novelty_bonus
+                        
+                        if score < best_score:
+                            best_score = score
+                            best_group = group
+                            # A new, evenly graded match cannot be beaten
+                            if best_score == -3:
+                                return best_group
+        
+        return best_group
+    
+    # Create matches for each court
+    windowed = len(players) > SESSION_MAX_PLAYERS
+    for court_index in range(courts):
+        if deadline is not None and time.monotonic() > deadline:
+            raise SchedulingTimeout(f"Reshuffle of round {round_to_reshuffle} stopped")
+        
+        remaining_players = [p for p in available_players if p['name'] not in used_players]
+        
+        if match_type == "singles":
+            match = create_singles_match(remaining_players[:SINGLES_WINDOW] if windowed else remaining_players)
+            if match:
+                new_round_matches.append((court_index, match))
+                used_players.update([p['name'] for p in match])
+        else:  # doubles
+            match = create_doubles_match(remaining_players[:DOUBLES_WINDOW] if windowed else remaining_players)
+            if match:
+                new_round_matches.append((court_index, match))
+                used_players.update([p['name'] for p in match])
+    
+    return new_round_matches
+
+def build_rounds(matchups):
+    """Court-major matchups as {round number: [(court number, match), ...]} in round order"""
+    round_structure = defaultdict(list)
+    for court_index, court_matches in enumerate(matchups):
+        for match, round_num in court_matches:
+            round_structure[round_num].append((court_index + 1, match))
+    return dict(sorted(round_structure.items()))
 
-    return matchups, match_counts, opponent_averages, opponent_diff
\ No newline at end of file
+def replace_round(players, matchups, round_num, new_round_matches):
+    """Swap one round's matches in place; returns (player_match_counts, rounds)"""
+    for court_index in range(len(matchups)):
+        matchups[court_index] = [
+            (match, match_round) for match, match_round in matchups[court_index]
+            if match_round != round_num
+        ]
+    for court_index, match in new_round_matches:
+        if court_index < len(matchups):
+            matchups[court_index].append((match, round_num))
+
+    return count_matches(players, matchups), build_rounds(matchups)
+
+def count_matches(players, matchups):
+    """Matches played per player name"""
+    match_counts = {p['name']: 0 for p in players}
+    for court_matches in matchups:
+        for match, _ in court_matches:
+            for player in match:
+                match_counts[player['name']] += 1
+    return match_counts
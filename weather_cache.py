@@ -0,0 +1,146 @@
+# weather_cache.py - Stale-while-revalidate cache for weather lookups
+import os
+import threading
+import time
+from collections import Counter, OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Dict, Hashable, Optional
+
+
+class WeatherCache:
+    """In-memory weather cache that never makes popular locations wait
+
+    Fresh entries are served directly. Entries past their TTL but still inside
+    the grace window are served immediately while a background worker fetches
+    a replacement. A scheduler thread also refreshes the most requested
+    locations shortly before they expire, so hot venues stay fresh.
+    """
+
+    def __init__(self, ttl: int = None, grace: int = None, max_entries: int = 500,
+                 hot_locations: int = None, refresh_interval: int = 60):
+        self.ttl = ttl if ttl is not None else int(os.getenv("WEATHER_CACHE_TTL", "600"))
+        self.grace = grace if grace is not None else int(os.getenv("WEATHER_CACHE_GRACE", "3600"))
+        self.max_entries = max_entries
+        self.hot_locations = hot_locations if hot_locations is not None else int(os.getenv("WEATHER_HOT_LOCATIONS", "10"))
+        self.refresh_interval = refresh_interval
+
+        self._entries = OrderedDict()  # key -> (value, fetched_at)
+        self._fetchers = {}
+        self._request_counts = Counter()
+        self._inflight = set()
+        self._lock = threading.Lock()
+        self._executor = None
+        self._scheduler = None
+
+        self.stats = {'hits': 0, 'stale_hits': 0, 'misses': 0, 'refreshes': 0, 'refresh_errors': 0}
+
+    def get_or_fetch(self, key: Hashable, fetch: Callable[[], Dict]) -> Dict:
+        """Return the cached value for key, fetching it only on a cold miss"""
+        self._start_scheduler()
+        now = time.time()
+
+        with self._lock:
+            self._request_counts[key] += 1
+            self._fetchers[key] = fetch
+            entry = self._entries.get(key)
+            if entry:
+                self._entries.move_to_end(key)
+                value, fetched_at = entry
+                age = now - fetched_at
+                if age < self.ttl:
+                    self.stats['hits'] += 1
+                    return value
+                if age < self.ttl + self.grace:
+                    self.stats['stale_hits'] += 1
+                    self._schedule_refresh(key)
+                    return value
+            self.stats['misses'] += 1
+
+        value = fetch()
+        self._store(key, value)
+        return value
+
+    def peek(self, key: Hashable, max_age: float = None) -> Optional[Dict]:
+        """Return a cached value regardless of freshness, without fetching"""
+        with self._lock:
+            entry = self._entries.get(key)
+        if not entry:
+            return None
+        value, fetched_at = entry
+        if max_age is not None and time.time() - fetched_at > max_age:
+            return None
+        return value
+
+    def _store(self, key: Hashable, value: Dict):
+        # Errors are never cached - the next request retries upstream
+        if not value or "error" in value:
+            return
+        with self._lock:
+            self._entries[key] = (value, time.time())
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                old_key, _ = self._entries.popitem(last=False)
+                self._fetchers.pop(old_key, None)
+                self._request_counts.pop(old_key, None)
+
+    def _schedule_refresh(self, key: Hashable):
+        """Queue a background refresh unless one is already running (lock held)"""
+        if key in self._inflight or key not in self._fetchers:
+            return
+        self._inflight.add(key)
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(max_workers=2, thread_name_prefix="weather-refresh")
+        self._executor.submit(self._refresh, key, self._fetchers[key])
+
+    def _refresh(self, key: Hashable, fetch: Callable[[], Dict]):
+        ok = False
+        try:
+            value = fetch()
+            ok = bool(value) and "error" not in value
+            if ok:
+                self._store(key, value)
+        except Exception:
+            pass
+        finally:
+            with self._lock:
+                self._inflight.discard(key)
+                self.stats['refreshes' if ok else 'refresh_errors'] += 1
+
+    def _start_scheduler(self):
+        if self._scheduler is not None or self.hot_locations <= 0:
+            return
+        with self._lock:
+            if self._scheduler is None:
+                self._scheduler = threading.Thread(
+                    target=self._refresh_hot_locations, name="weather-scheduler", daemon=True
+                )
+                self._scheduler.start()
+
+    def _refresh_hot_locations(self):
+        """Refresh the top-N locations before they expire"""
+        while True:
+            time.sleep(self.refresh_interval)
+            now = time.time()
+            with self._lock:
+                for key, _ in self._request_counts.most_common(self.hot_locations):
+                    entry = self._entries.get(key)
+                    # Refresh anything that would expire before the next pass
+                    if entry and now - entry[1] > self.ttl - 2 * self.refresh_interval:
+                        self._schedule_refresh(key)
+
+                # Decay counts so the hot set follows current demand
+                for key in list(self._request_counts):
+                    self._request_counts[key] //= 2
+                    if not self._request_counts[key]:
+                        del self._request_counts[key]
+
+    def status(self) -> Dict:
+        """Cache counters for monitoring"""
+        with self._lock:
+            lookups = self.stats['hits'] + self.stats['stale_hits'] + self.stats['misses']
+            return {
+                **self.stats,
+                'entries': len(self._entries),
+                'refreshing': len(self._inflight),
+                'hit_ratio': round((lookups - self.stats['misses']) / lookups, 3) if lookups else 0.0
+            }
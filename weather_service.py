@@ -1,25 +1,109 @@
-import requests
 import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
 from datetime import datetime
+from itertools import compress
 from typing import Dict, List, Optional, Tuple
 
+from circuit_breaker import BudgetExceeded, CircuitBreaker, CircuitOpenError, UpstreamUnavailable
+from lazy_import import lazy_module
+from outcode_index import outcode_index, outward_code
+from weather_cache import WeatherCache
+
+# requests is loaded by the first upstream call, not at start-up
+requests = lazy_module("requests")
+
 class WeatherService:
     """Weather service for getting 5-day forecasts using OpenWeatherMap API"""
     
-    def __init__(self, api_key: str = None):
+    def __init__(self, api_key: str = None, api_root: str = None):
         self.api_key = api_key or 'fd94c86864c1809c326f7f0b6add6acc'
-        self.base_url = "http://api.openweathermap.org/data/2.5/forecast"
-        self.geocoding_url = "http://api.openweathermap.org/geo/1.0/zip"
+        # Point OPENWEATHER_API_ROOT at a local stand-in for load testing
+        api_root = (api_root or os.getenv("OPENWEATHER_API_ROOT", "http://api.openweathermap.org")).rstrip('/')
+        self.base_url = f"{api_root}/data/2.5/forecast"
+        self.current_url = f"{api_root}/data/2.5/weather"
+        self.geocoding_url = f"{api_root}/geo/1.0/zip"
+        # Upper bound on concurrent upstream calls made by batch lookups
+        self.max_workers = int(os.getenv("WEATHER_MAX_WORKERS", "4"))
+        self.cache = WeatherCache()
+        
+        # Fail fast while OpenWeatherMap is down rather than tying up workers
+        self.breaker = CircuitBreaker(
+            "openweathermap",
+            failure_threshold=int(os.getenv("WEATHER_BREAKER_FAILURES", "5")),
+            recovery_timeout=float(os.getenv("WEATHER_BREAKER_RECOVERY", "30"))
+        )
+        # Total upstream time allowed for one web request
+        self.request_budget_seconds = float(os.getenv("WEATHER_REQUEST_BUDGET", "4"))
+        self._budget = threading.local()
+    
+    @contextmanager
+    def request_budget(self, seconds: float = None, deadline: float = None):
+        """Bound the upstream time of every call made inside the block"""
+        previous = getattr(self._budget, 'deadline', None)
+        if deadline is None:
+            deadline = time.monotonic() + (seconds if seconds is not None else self.request_budget_seconds)
+        self._budget.deadline = deadline
+        try:
+            yield deadline
+        finally:
+            self._budget.deadline = previous
+    
+    def _get(self, url: str) -> "requests.Response":
+        """GET an upstream URL through the circuit breaker and time budget"""
+        timeout = 10
+        deadline = getattr(self._budget, 'deadline', None)
+        if deadline is not None:
+            timeout = min(timeout, deadline - time.monotonic())
+            if timeout <= 0.05:
+                raise BudgetExceeded("Weather request time budget exhausted")
+        
+        if not self.breaker.allow_request():
+            raise CircuitOpenError("Weather service temporarily unavailable")
+        
+        try:
+            response = requests.get(url, timeout=timeout)
+        except requests.exceptions.RequestException:
+            self.breaker.record_failure()
+            raise
+        
+        # Rate limiting and server errors mean upstream is struggling;
+        # a 404 for an unknown postcode is a healthy answer
+        if response.status_code >= 500 or response.status_code == 429:
+            self.breaker.record_failure()
+        else:
+            self.breaker.record_success()
+        return response
+    
+    def status(self) -> Dict:
+        """Breaker and cache state for monitoring"""
+        return {
+            'breaker': self.breaker.status(),
+            'cache': self.cache.status(),
+            'request_budget': self.request_budget_seconds
+        }
     
     def get_coordinates_from_postcode(self, postcode: str, country_code: str = "GB") -> Optional[Tuple[float, float]]:
         """Get latitude and longitude from postcode"""
         try:
             # For UK postcodes, use smarter extraction
             if country_code == "GB":
+                # Known outward codes resolve from the bundled index without
+                # any network call; a district centroid is precise enough for
+                # a weather forecast
+                area_code = outward_code(postcode)
+                if area_code:
+                    coords = outcode_index.lookup(area_code)
+                    if coords:
+                        return coords
+                
+                # Unknown outward code - fall back to the geocoding API
                 # First try the full postcode without spaces
                 clean_postcode = postcode.replace(" ", "").upper()
                 url = f"{self.geocoding_url}?zip={clean_postcode},{country_code}&appid={self.api_key}"
-                response = requests.get(url, timeout=10)
+                response = self._get(url)
                 
                 if response.status_code == 200:
                     data = response.json()
@@ -40,7 +124,7 @@ class WeatherService:
                 
                 # Try the area code
                 url = f"{self.geocoding_url}?zip={area_code},{country_code}&appid={self.api_key}"
-                response = requests.get(url, timeout=10)
+                response = self._get(url)
                 
                 if response.status_code == 200:
                     data = response.json()
@@ -50,7 +134,7 @@ class WeatherService:
                 # For non-UK postcodes, use as-is
                 clean_postcode = postcode.replace(" ", "").upper()
                 url = f"{self.geocoding_url}?zip={clean_postcode},{country_code}&appid={self.api_key}"
-                response = requests.get(url, timeout=10)
+                response = self._get(url)
                 response.raise_for_status()
                 
                 data = response.json()
@@ -58,11 +142,30 @@ class WeatherService:
                 
             return None
             
+        except (UpstreamUnavailable, requests.exceptions.ConnectionError, requests.exceptions.Timeout):
+            # Upstream trouble is not an invalid postcode - let callers report it
+            raise
         except Exception as e:
             return None
     
     def get_weather_forecast(self, postcode: str, country_code: str = "GB") -> Optional[Dict]:
-        """Get 5-day weather forecast for a postcode"""
+        """Get 5-day weather forecast for a postcode, served from cache when possible"""
+        return self._cached(
+            ('forecast', postcode, country_code),
+            lambda: self._load_weather_forecast(postcode, country_code)
+        )
+    
+    def _cached(self, key, fetch) -> Dict:
+        """Look up the cache, falling back to any stale copy if upstream fails"""
+        result = self.cache.get_or_fetch(key, fetch)
+        if result and "error" in result:
+            stale = self.cache.peek(key)
+            if stale:
+                return stale
+        return result
+    
+    def _load_weather_forecast(self, postcode: str, country_code: str = "GB") -> Optional[Dict]:
+        """Fetch and process a 5-day forecast from the upstream API"""
         try:
             # Get coordinates from postcode
             coords = self.get_coordinates_from_postcode(postcode, country_code)
@@ -72,64 +175,184 @@ class WeatherService:
             lat, lon = coords
             
             # Get weather forecast
-            url = f"{self.base_url}?lat={lat}&lon={lon}&appid={self.api_key}&units=metric"
-            response = requests.get(url, timeout=10)
-            response.raise_for_status()
-            
-            data = response.json()
+            data = self._fetch_forecast(lat, lon)
             return self._process_forecast_data(data, postcode)
             
+        except UpstreamUnavailable as e:
+            return {"error": str(e)}
         except requests.exceptions.RequestException as e:
             return {"error": f"Network error: {str(e)}"}
         except Exception as e:
             return {"error": f"Error getting weather forecast: {str(e)}"}
     
+    def _fetch_forecast(self, lat: float, lon: float) -> Dict:
+        """Fetch raw forecast data for a coordinate pair"""
+        url = f"{self.base_url}?lat={lat}&lon={lon}&appid={self.api_key}&units=metric"
+        response = self._get(url)
+        response.raise_for_status()
+        return response.json()
+    
+    def get_batch_forecasts(self, postcodes: List[str], country_code: str = "GB") -> Dict:
+        """Get daily tennis conditions for several venues in one call
+        
+        Postcodes are geocoded concurrently, venues that resolve to the same
+        location share a single forecast request, and the daily conditions are
+        returned side by side in the order the postcodes were given.
+        """
+        # Normalise and drop repeated postcodes, keeping the caller's order
+        venues = []
+        for postcode in postcodes:
+            clean = " ".join(postcode.split()).upper()
+            if clean and clean not in venues:
+                venues.append(clean)
+        
+        if not venues:
+            return {"error": "No postcodes provided"}
+        
+        # Worker threads share the caller's time budget
+        deadline = getattr(self._budget, 'deadline', None) or time.monotonic() + self.request_budget_seconds
+        unavailable = {}
+        
+        def geocode(postcode):
+            with self.request_budget(deadline=deadline):
+                try:
+                    return self.get_coordinates_from_postcode(postcode, country_code)
+                except UpstreamUnavailable as e:
+                    unavailable[postcode] = str(e)
+                    return None
+                except requests.exceptions.RequestException as e:
+                    unavailable[postcode] = f"Network error: {str(e)}"
+                    return None
+        
+        workers = max(1, min(self.max_workers, len(venues)))
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            coords = dict(zip(venues, executor.map(geocode, venues)))
+            
+            # Postcodes in the same street resolve to the same point, so only
+            # fetch each distinct location once (rounded to roughly 100m)
+            locations = {}
+            for postcode, point in coords.items():
+                if point:
+                    key = (round(point[0], 3), round(point[1], 3))
+                    locations.setdefault(key, point)
+            
+            def fetch(point):
+                try:
+                    with self.request_budget(deadline=deadline):
+                        return self._fetch_forecast(*point)
+                except UpstreamUnavailable as e:
+                    return {"error": str(e)}
+                except requests.exceptions.RequestException as e:
+                    return {"error": f"Network error: {str(e)}"}
+                except Exception as e:
+                    return {"error": f"Error getting weather forecast: {str(e)}"}
+            
+            raw = dict(zip(locations, executor.map(fetch, locations.values())))
+        
+        results = []
+        dates = set()
+        for postcode in venues:
+            point = coords[postcode]
+            if not point:
+                error = unavailable.get(postcode, "Invalid postcode or unable to get location")
+                results.append({"postcode": postcode, "error": error})
+                continue
+            
+            data = raw[(round(point[0], 3), round(point[1], 3))]
+            forecast = data if "error" in data else self._process_forecast_data(data, postcode)
+            if "error" in forecast:
+                results.append({"postcode": postcode, "error": forecast["error"]})
+                continue
+            
+            daily = {
+                date_key: {
+                    'date': day['date'],
+                    'date_short': day['date_short'],
+                    'min_temp': day['min_temp'],
+                    'max_temp': day['max_temp'],
+                    'tennis_conditions': day['tennis_conditions'],
+                    'tennis_details': day['tennis_details']
+                }
+                for date_key, day in forecast['daily_forecasts'].items()
+            }
+            dates.update(daily)
+            results.append({
+                "postcode": postcode,
+                "location": forecast['location'],
+                "daily_forecasts": daily
+            })
+        
+        # One row per date with each venue's rating in venue order
+        sorted_dates = sorted(dates)
+        conditions = {
+            date_key: [
+                venue.get('daily_forecasts', {}).get(date_key, {}).get('tennis_conditions', 'Unknown')
+                for venue in results
+            ]
+            for date_key in sorted_dates
+        }
+        
+        return {
+            'venues': results,
+            'dates': sorted_dates,
+            'tennis_conditions': conditions,
+            'last_updated': datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+        }
+    
     def _process_forecast_data(self, data: Dict, postcode: str) -> Dict:
-        """Process raw API data into formatted forecast"""
+        """Process raw API data into formatted forecast
+        
+        The forecast list is loaded into columns once; day grouping, daylight
+        filtering and the daily aggregates then work on whole columns instead
+        of re-parsing every 3-hour slot.
+        """
         try:
             location = data.get('city', {})
-            forecasts = data.get('list', [])
+            forecasts = sorted(data.get('list', []), key=lambda f: f['dt'])
             
-            # Group forecasts by day
-            daily_forecasts = {}
+            # Load the forecast list into columns in a single pass
+            timestamps = [f['dt'] for f in forecasts]
+            local_times = list(map(time.localtime, timestamps))
+            day_keys = [(t.tm_year, t.tm_mon, t.tm_mday) for t in local_times]
+            hours = [t.tm_hour for t in local_times]
+            temps = [round(f['main']['temp']) for f in forecasts]
+            winds = [round(f['wind']['speed'] * 3.6, 1) for f in forecasts]  # Convert m/s to km/h
+            precipitation = [
+                f.get('rain', {}).get('3h', 0) + f.get('snow', {}).get('3h', 0) for f in forecasts
+            ]
+            humidity = [f['main']['humidity'] for f in forecasts]
             
-            for forecast in forecasts:
-                dt = datetime.fromtimestamp(forecast['dt'])
-                date_key = dt.strftime('%Y-%m-%d')
+            # Slots are in time order, so each day is a contiguous run; keep
+            # the first 5 days and skip the rest of a longer horizon entirely
+            day_bounds = [
+                i for i in range(len(day_keys)) if i == 0 or day_keys[i] != day_keys[i - 1]
+            ][:6]
+            if len(day_bounds) < 6:
+                day_bounds.append(len(day_keys))
+            
+            daily_forecasts = {}
+            for start, stop in zip(day_bounds, day_bounds[1:]):
+                dt = datetime.fromtimestamp(timestamps[start])
+                day_temps = temps[start:stop]
                 
-                # Extract weather data
-                weather_data = {
-                    'time': dt.strftime('%H:%M'),
-                    'timestamp': forecast['dt'],
-                    'temperature': round(forecast['main']['temp']),
-                    'feels_like': round(forecast['main']['feels_like']),
-                    'humidity': forecast['main']['humidity'],
-                    'description': forecast['weather'][0]['description'].title(),
-                    'icon': forecast['weather'][0]['icon'],
-                    'wind_speed': round(forecast['wind']['speed'] * 3.6, 1),  # Convert m/s to km/h
-                    'wind_direction': forecast['wind'].get('deg', 0),
-                    'precipitation': forecast.get('rain', {}).get('3h', 0) + forecast.get('snow', {}).get('3h', 0),
-                    'visibility': forecast.get('visibility', 10000) / 1000  # Convert to km
+                day_data = {
+                    'date': dt.strftime('%A, %B %d'),
+                    'date_short': dt.strftime('%a %d'),
+                    'forecasts': [
+                        self._format_forecast_slot(forecasts[i], local_times[i], temps[i], winds[i], precipitation[i])
+                        for i in range(start, stop)
+                    ],
+                    'min_temp': min(day_temps),
+                    'max_temp': max(day_temps),
+                    'tennis_conditions': 'Unknown'
                 }
                 
-                if date_key not in daily_forecasts:
-                    daily_forecasts[date_key] = {
-                        'date': dt.strftime('%A, %B %d'),
-                        'date_short': dt.strftime('%a %d'),
-                        'forecasts': [],
-                        'min_temp': weather_data['temperature'],
-                        'max_temp': weather_data['temperature'],
-                        'tennis_conditions': 'Unknown'
-                    }
-                
-                daily_forecasts[date_key]['forecasts'].append(weather_data)
-                daily_forecasts[date_key]['min_temp'] = min(daily_forecasts[date_key]['min_temp'], weather_data['temperature'])
-                daily_forecasts[date_key]['max_temp'] = max(daily_forecasts[date_key]['max_temp'], weather_data['temperature'])
-            
-            # Assess tennis playing conditions for each day
-            for day_data in daily_forecasts.values():
+                # Assess tennis playing conditions for the day
                 try:
-                    tennis_assessment = self._assess_tennis_conditions(day_data['forecasts'])
+                    tennis_assessment = self._assess_tennis_columns(
+                        hours[start:stop], day_temps, winds[start:stop],
+                        precipitation[start:stop], humidity[start:stop]
+                    )
                     
                     # Set defaults in case of missing keys
                     day_data['tennis_conditions'] = tennis_assessment.get('rating', 'Unknown')
@@ -150,9 +373,8 @@ class WeatherService:
                         'precipitation': '0.0mm',
                         'avg_humidity': 'Unknown'
                     }
-            
-            # Sort by date and take first 5 days
-            sorted_days = sorted(daily_forecasts.items())[:5]
+                
+                daily_forecasts['%04d-%02d-%02d' % day_keys[start]] = day_data
             
             return {
                 'location': {
@@ -160,47 +382,76 @@ class WeatherService:
                     'country': location.get('country', ''),
                     'postcode': postcode
                 },
-                'daily_forecasts': dict(sorted_days),
+                'daily_forecasts': daily_forecasts,
                 'last_updated': datetime.now().strftime('%Y-%m-%d %H:%M:%S')
             }
             
         except Exception as e:
             return {"error": f"Error processing forecast data: {str(e)}"}
     
+    def _format_forecast_slot(self, forecast: Dict, local_time: time.struct_time,
+                              temperature: int, wind_speed: float, precipitation: float) -> Dict:
+        """Build the display record for a single forecast slot"""
+        return {
+            'time': f"{local_time.tm_hour:02d}:{local_time.tm_min:02d}",
+            'timestamp': forecast['dt'],
+            'temperature': temperature,
+            'feels_like': round(forecast['main']['feels_like']),
+            'humidity': forecast['main']['humidity'],
+            'description': forecast['weather'][0]['description'].title(),
+            'icon': forecast['weather'][0]['icon'],
+            'wind_speed': wind_speed,
+            'wind_direction': forecast['wind'].get('deg', 0),
+            'precipitation': precipitation,
+            'visibility': forecast.get('visibility', 10000) / 1000  # Convert to km
+        }
+    
     def _assess_tennis_conditions(self, forecasts: List[Dict]) -> Dict[str, str]:
         """Assess tennis playing conditions based on weather data"""
-        # Find best conditions during daylight hours (7 AM - 8 PM for tennis)
-        daylight_forecasts = [f for f in forecasts if 7 <= int(f['time'].split(':')[0]) <= 20]
-        
-        if not daylight_forecasts:
+        try:
+            return self._assess_tennis_columns(
+                [int(f['time'].split(':')[0]) for f in forecasts],
+                [f['temperature'] for f in forecasts],
+                [f['wind_speed'] for f in forecasts],
+                [f['precipitation'] for f in forecasts],
+                [f['humidity'] for f in forecasts]
+            )
+        except (KeyError, ValueError) as e:
             return {
                 'rating': 'Unknown', 
-                'details': 'No daylight hours data available',
+                'details': f'Error calculating weather conditions: {str(e)}',
                 'temperature_range': 'Unknown',
                 'max_wind': 'Unknown',
                 'precipitation': '0.0mm',
                 'avg_humidity': 'Unknown'
             }
+    
+    def _assess_tennis_columns(self, hours: List[int], temps: List[int], winds: List[float],
+                               precipitation: List[float], humidity: List[int]) -> Dict[str, str]:
+        """Assess tennis playing conditions from per-slot weather columns"""
+        # Find best conditions during daylight hours (7 AM - 8 PM for tennis)
+        daylight = [7 <= hour <= 20 for hour in hours]
+        daylight_temps = list(compress(temps, daylight))
         
-        # Check various factors with error handling
-        try:
-            avg_temp = sum(f['temperature'] for f in daylight_forecasts) / len(daylight_forecasts)
-            max_wind = max(f['wind_speed'] for f in daylight_forecasts)
-            total_precipitation = sum(f['precipitation'] for f in daylight_forecasts)
-            avg_humidity = sum(f['humidity'] for f in daylight_forecasts) / len(daylight_forecasts)
-            min_temp = min(f['temperature'] for f in daylight_forecasts)
-            max_temp = max(f['temperature'] for f in daylight_forecasts)
-        except (KeyError, ValueError, ZeroDivisionError) as e:
-            # Return default values if calculation fails
+        if not daylight_temps:
             return {
                 'rating': 'Unknown', 
-                'details': f'Error calculating weather conditions: {str(e)}',
+                'details': 'No daylight hours data available',
                 'temperature_range': 'Unknown',
                 'max_wind': 'Unknown',
                 'precipitation': '0.0mm',
                 'avg_humidity': 'Unknown'
             }
         
+        # Aggregate each column over the daylight slots
+        count = len(daylight_temps)
+        avg_temp = sum(daylight_temps) / count
+        max_wind = max(compress(winds, daylight))
+        total_precipitation = sum(compress(precipitation, daylight))
+        avg_humidity = sum(compress(humidity, daylight)) / count
+        min_temp = min(daylight_temps)
+        max_temp = max(daylight_temps)
+        
         # Tennis-specific condition assessment
         issues = []
         
@@ -264,7 +515,14 @@ class WeatherService:
         }
     
     def get_current_weather(self, postcode: str, country_code: str = "GB") -> Optional[Dict]:
-        """Get current weather for a postcode"""
+        """Get current weather for a postcode, served from cache when possible"""
+        return self._cached(
+            ('current', postcode, country_code),
+            lambda: self._load_current_weather(postcode, country_code)
+        )
+    
+    def _load_current_weather(self, postcode: str, country_code: str = "GB") -> Optional[Dict]:
+        """Fetch current weather from the upstream API"""
         try:
             coords = self.get_coordinates_from_postcode(postcode, country_code)
             if not coords:
@@ -272,8 +530,8 @@ class WeatherService:
             
             lat, lon = coords
             
-            url = f"http://api.openweathermap.org/data/2.5/weather?lat={lat}&lon={lon}&appid={self.api_key}&units=metric"
-            response = requests.get(url, timeout=10)
+            url = f"{self.current_url}?lat={lat}&lon={lon}&appid={self.api_key}&units=metric"
+            response = self._get(url)
             response.raise_for_status()
             
             data = response.json()
@@ -288,5 +546,7 @@ class WeatherService:
                 'visibility': data.get('visibility', 10000) / 1000
             }
             
+        except UpstreamUnavailable as e:
+            return {"error": str(e)}
         except Exception as e:
             return {"error": f"Error getting current weather: {str(e)}"}
\ No newline at end of file